@@ -0,0 +1,166 @@
+"""Контроль допуска запросов и сброс нагрузки по группам маршрутов.
+
+Маршрут объявляет группу декоратором @admit("writes"). У каждой группы свой
+предел одновременных запросов, ограниченная очередь ожидания и максимальное
+время ожидания; кроме того, все группы вместе не превышают
+ADMISSION_TOTAL_LIMIT. Освободившееся место отдаётся ожидающим в порядке
+приоритета групп (вебхуки раньше чтений), внутри группы — по очереди.
+
+Запрос, которому нет места в очереди, сразу получает 503 с Retry-After; запрос,
+не дождавшийся допуска за время ожидания группы, — тоже 503. Так очередь
+внутри Sanic не растёт без предела, и задержка допущенных запросов остаётся
+ограниченной. Время ожидания в очереди и счётчики — в /admin/admission.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from functools import wraps
+from sanic.exceptions import SanicException
+from app.config import config
+
+QUEUE_TIME_SAMPLES = 1024
+
+class Group:
+    __slots__ = (
+        "name", "priority", "limit", "queue_size", "max_wait", "active", "waiters",
+        "admitted", "rejected", "timed_out", "queue_times"
+    )
+
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, max_wait_ms: int):
+        self.name = name
+        self.priority = priority  # меньше — раньше
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait_ms / 1000
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Последние времена ожидания в очереди, секунды
+        self.queue_times = deque(maxlen=QUEUE_TIME_SAMPLES)
+
+    def stats(self) -> dict:
+        samples = sorted(self.queue_times)
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3) if samples else 0.0
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_ms_p50": percentile(0.50),
+            "queue_ms_p99": percentile(0.99)
+        }
+
+class Admission:
+    def __init__(self, total_limit: int, groups: list):
+        self.total_limit = total_limit
+        self.groups = {group.name: group for group in groups}
+        self.by_priority = sorted(groups, key=lambda group: group.priority)
+        self.active = 0
+
+    def _can_run(self, group: Group) -> bool:
+        return group.active < group.limit and self.active < self.total_limit
+
+    def _start(self, group: Group):
+        group.active += 1
+        group.admitted += 1
+        self.active += 1
+
+    def _dispatch(self):
+        for group in self.by_priority:
+            while group.waiters and self._can_run(group):
+                waiter = group.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._start(group)
+                waiter.set_result(None)
+
+    def _reject(self, group: Group, reason: str):
+        retry_after = max(1, math.ceil(group.max_wait))
+        raise SanicException(
+            f"Server is overloaded ({group.name}: {reason}), retry later",
+            status_code=503,
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    async def acquire(self, name: str):
+        group = self.groups[name]
+        self._dispatch()
+        if self._can_run(group) and not group.waiters:
+            self._start(group)
+            group.queue_times.append(0.0)
+            return
+        if len(group.waiters) >= group.queue_size:
+            group.rejected += 1
+            self._reject(group, "queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        group.waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=group.max_wait)
+        except asyncio.TimeoutError:
+            if not self._abandon(group, waiter):
+                group.timed_out += 1
+                self._reject(group, "queue timeout")
+            # Место выдано одновременно с истечением ожидания: запрос допущен
+        except asyncio.CancelledError:
+            if self._abandon(group, waiter):
+                # Клиент отключился в момент допуска: место уже занято и должно вернуться
+                self.release(name)
+            raise
+        group.queue_times.append(time.monotonic() - started)
+
+    def _abandon(self, group: Group, waiter: asyncio.Future) -> bool:
+        """Убирает прерванное ожидание из очереди; True, если место уже было выдано.
+
+        _dispatch мог успеть вынуть ожидание из очереди, пока wait_for его
+        отменял, поэтому его может там и не быть"""
+        try:
+            group.waiters.remove(waiter)
+        except ValueError:
+            pass
+        return waiter.done() and not waiter.cancelled()
+
+    def release(self, name: str):
+        group = self.groups[name]
+        group.active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.ADMISSION_ENABLED,
+            "total_limit": self.total_limit,
+            "active": self.active,
+            "groups": {group.name: group.stats() for group in self.by_priority}
+        }
+
+admission = Admission(config.ADMISSION_TOTAL_LIMIT, [
+    Group("webhooks", 0, config.ADMISSION_WEBHOOKS_LIMIT, config.ADMISSION_WEBHOOKS_QUEUE, config.ADMISSION_WEBHOOKS_WAIT_MS),
+    Group("auth", 1, config.ADMISSION_AUTH_LIMIT, config.ADMISSION_AUTH_QUEUE, config.ADMISSION_AUTH_WAIT_MS),
+    Group("writes", 1, config.ADMISSION_WRITES_LIMIT, config.ADMISSION_WRITES_QUEUE, config.ADMISSION_WRITES_WAIT_MS),
+    Group("reads", 2, config.ADMISSION_READS_LIMIT, config.ADMISSION_READS_QUEUE, config.ADMISSION_READS_WAIT_MS),
+])
+
+def admit(group: str):
+    """Ставится сразу под декоратор маршрута: ожидание допуска идёт до аутентификации"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request, *args, **kwargs):
+            if not config.ADMISSION_ENABLED:
+                return await f(request, *args, **kwargs)
+            await admission.acquire(group)
+            try:
+                return await f(request, *args, **kwargs)
+            finally:
+                admission.release(group)
+        return decorated_function
+    return decorator
@@ -0,0 +1,230 @@
+"""Помесячный архив платежей.
+
+Закрытые месяцы (всё, что раньше текущего месяца UTC) переносятся из горячих
+таблиц payments шардов в архивные SQLite-файлы ARCHIVE_DIR/payments-YYYY-MM.db:
+по файлу на месяц, строки всех шардов с колонкой shard. Готовый файл сжимается
+VACUUM и становится read-only; читается он через отдельный движок с
+mode=ro&immutable=1, без блокировок и WAL. Запросы по диапазону дат открывают
+только месяцы, пересекающиеся с диапазоном.
+
+Сжатие выполняется фоновой задачей раз в ARCHIVE_COMPACTION_INTERVAL_S секунд
+(0 — отключено) или вручную при остановленном API:
+
+    python -m app.archive compact
+"""
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime
+from sqlalchemy import Column, Index, Integer, MetaData, Table, bindparam, create_engine, delete, func, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.future import select
+from sqlalchemy.pool import NullPool
+from app.config import config
+from app.models import Payment, ArchivedTransaction
+from app.schemas import PaymentFilters
+from app.search import search_statement
+from app.sharding import shards
+
+ARCHIVE_FILE = re.compile(r"^payments-(\d{4})-(\d{2})\.db$")
+
+archive_metadata = MetaData()
+archived_payments = Table(
+    "payments",
+    archive_metadata,
+    Column("shard", Integer, primary_key=True),
+    *(column._copy() for column in Payment.__table__.columns),
+    # Подмножество индексов Payment, достаточное для check_indexed (app.search)
+    Index("ix_archived_payments_user_created", "user_id", "created_at"),
+    Index("ix_archived_payments_recipient_created", "recipient_email", "created_at"),
+    Index("ix_archived_payments_transaction", "transaction_id"),
+    Index("ix_archived_payments_created", "created_at")
+)
+
+# Запросы к горячему шарду при сжатии
+CLOSED_MONTHS = select(func.strftime("%Y-%m", Payment.created_at).label("month")).where(
+    Payment.created_at < bindparam("before")
+).distinct()
+# Платёж по id в архивном файле; индекс (user_id, created_at) сужает поиск до платежей пользователя
+ARCHIVED_PAYMENT_BY_ID_AND_USER = select(archived_payments).where(
+    archived_payments.c.id == bindparam("payment_id"),
+    archived_payments.c.user_id == bindparam("user_id")
+)
+PAYMENTS_IN_MONTH = select(Payment).where(
+    Payment.created_at >= bindparam("start"),
+    Payment.created_at < bindparam("end")
+).order_by(Payment.id)
+
+_engines = {}
+compaction_lock = asyncio.Lock()
+
+def archive_dir() -> str:
+    if config.ARCHIVE_DIR:
+        return config.ARCHIVE_DIR
+    database = make_url(config.DATABASE_URL).database or ""
+    return os.path.join(os.path.dirname(database), "archive")
+
+def month_start(month: tuple) -> datetime:
+    return datetime(month[0], month[1], 1)
+
+def next_month(month: tuple) -> tuple:
+    year, number = month
+    return (year + 1, 1) if number == 12 else (year, number + 1)
+
+def archive_path(month: tuple) -> str:
+    return os.path.join(archive_dir(), f"payments-{month[0]:04d}-{month[1]:02d}.db")
+
+def archived_months() -> list:
+    """Месяцы, для которых есть архивный файл, по возрастанию"""
+    try:
+        names = os.listdir(archive_dir())
+    except FileNotFoundError:
+        return []
+    return sorted((int(m.group(1)), int(m.group(2))) for m in map(ARCHIVE_FILE.match, names) if m)
+
+def months_in_range(start: datetime = None, end: datetime = None) -> list:
+    """Архивные месяцы, пересекающиеся с полуинтервалом [start, end)"""
+    return [
+        month for month in archived_months()
+        if (end is None or month_start(month) < end) and (start is None or month_start(next_month(month)) > start)
+    ]
+
+def engine_for(month: tuple):
+    # NullPool: каждое чтение открывает файл заново и видит его после пересборки при сжатии
+    if month not in _engines:
+        _engines[month] = create_async_engine(
+            f"sqlite+aiosqlite:///file:{archive_path(month)}?mode=ro&immutable=1&uri=true",
+            poolclass=NullPool
+        )
+    return _engines[month]
+
+async def fetch_archived(statement, params: dict, months: list, limit: int = None) -> list:
+    """Выполняет запрос по архивным месяцам в заданном порядке; с limit останавливается, набрав строки"""
+    rows = []
+    for month in months:
+        async with engine_for(month).connect() as conn:
+            result = await conn.execute(statement, params)
+            rows.extend(result.all())
+        if limit is not None and len(rows) >= limit:
+            return rows[:limit]
+    return rows
+
+async def search(filters: PaymentFilters, user_id: int = None, newest_first: bool = False, limit: int = None) -> list:
+    """Архивные платежи по фильтрам из месяцев, пересекающихся с [from, to), в порядке created_at.
+    Без from — все архивные месяцы; с limit файлы открываются по порядку, пока limit не набран"""
+    statement = search_statement(archived_payments, filters, user_id, newest_first, limit)
+    months = months_in_range(filters.date_from, filters.date_to)
+    return await fetch_archived(statement, {}, months[::-1] if newest_first else months, limit)
+
+async def get_payment(payment_id: int, user_id: int):
+    """Архивный платёж пользователя по id или None; месяцы просматриваются от новых к старым"""
+    rows = await fetch_archived(
+        ARCHIVED_PAYMENT_BY_ID_AND_USER, {"payment_id": payment_id, "user_id": user_id}, archived_months()[::-1], limit=1
+    )
+    return rows[0] if rows else None
+
+# --- сжатие -------------------------------------------------------------------
+
+def _write_archive(month: tuple, rows: list) -> str:
+    """Собирает новый файл месяца из уже заархивированных строк и rows, сжимает его и
+    атомарно подменяет старый. Строки, уже попавшие в архив, повторно не вставляются"""
+    path = archive_path(month)
+    temp_path = f"{path}.tmp"
+    os.makedirs(archive_dir(), exist_ok=True)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    if os.path.exists(path):
+        source = create_engine(f"sqlite:///file:{path}?mode=ro&immutable=1&uri=true", poolclass=NullPool)
+        with source.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(select(archived_payments))] + rows
+        source.dispose()
+
+    target = create_engine(f"sqlite:///{temp_path}", poolclass=NullPool)
+    archive_metadata.create_all(target)
+    with target.begin() as conn:
+        conn.execute(insert(archived_payments).prefix_with("OR IGNORE"), rows)
+    with target.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+    target.dispose()
+
+    os.chmod(temp_path, 0o444)
+    os.replace(temp_path, path)
+    return path
+
+async def compact_shard(shard, now: datetime = None) -> int:
+    """Переносит закрытые месяцы шарда в архив; возвращает число перенесённых платежей"""
+    current_month = (now or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    async with shard.ReadSession() as session:
+        result = await session.execute(CLOSED_MONTHS, {"before": current_month})
+        months = sorted(tuple(map(int, value.split("-"))) for value in result.scalars().all())
+
+    moved = 0
+    for month in months:
+        bounds = {"start": month_start(month), "end": month_start(next_month(month))}
+        async with shard.ReadSession() as session:
+            result = await session.execute(PAYMENTS_IN_MONTH, bounds)
+            payments = result.scalars().all()
+        if not payments:
+            continue
+        if any(payment.status == "pending" for payment in payments):
+            # Непроведённый платёж ещё изменится (app.settlement): месяц архивируется при следующем сжатии
+            print(f"⚠️ Skipping archive of {month[0]}-{month[1]:02d} in shard {shard.index}: pending payments")
+            continue
+        rows = [
+            {"shard": shard.index, **{column.name: getattr(payment, column.key) for column in Payment.__table__.columns}}
+            for payment in payments
+        ]
+        # Файл пишется до удаления из шарда: при сбое между шагами строки остаются в шарде
+        # и при следующем сжатии пропускаются как уже заархивированные
+        path = await asyncio.to_thread(_write_archive, month, rows)
+
+        max_id = payments[-1].id
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                transactions = [
+                    {"transaction_id": payment.transaction_id, "user_id": payment.user_id}
+                    for payment in payments if payment.transaction_id
+                ]
+                if transactions:
+                    await session.execute(insert(ArchivedTransaction).prefix_with("OR IGNORE"), transactions)
+                await session.execute(
+                    delete(Payment).where(
+                        Payment.created_at >= bounds["start"],
+                        Payment.created_at < bounds["end"],
+                        Payment.id <= max_id
+                    )
+                )
+        moved += len(payments)
+        print(f"✅ Archived {len(payments)} payments of shard {shard.index} into {path}")
+    return moved
+
+async def compact(now: datetime = None) -> int:
+    # Один проход за раз: файлы месяцев общие для всех шардов
+    async with compaction_lock:
+        moved = 0
+        for shard in shards:
+            moved += await compact_shard(shard, now)
+        return moved
+
+async def compaction_loop():
+    while True:
+        await asyncio.sleep(config.ARCHIVE_COMPACTION_INTERVAL_S)
+        try:
+            await compact()
+        except Exception as e:
+            print(f"❌ Archive compaction failed: {str(e)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API payment archive")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("compact", help="move closed months into read-only archive files")
+    args = parser.parse_args()
+    if args.command == "compact":
+        moved = asyncio.run(compact())
+        print(f"✅ Compaction finished: {moved} payments archived")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,65 @@
+import asyncio
+import hmac
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from sanic.exceptions import SanicException
 from app.config import config
 from app.models import User
+from app import queries
 from hashlib import sha256
 from functools import wraps
+# Хэши паролей — в app.passwords: процессы пула хэшей (app.provisioning) импортируют
+# только его, без SQLAlchemy и Sanic
+from app.passwords import PASSWORD_SCHEMES, get_pwd_context, get_password_hash, hash_passwords, verify_password
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib (и bcrypt-бэкенд) и python-jose с cryptography-бэкендом импортируются
+# при первом использовании, чтобы не замедлять старт воркера
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# user_id, чьи пароли сейчас перехэшируются, и задачи перехэширования (ссылки держат их до конца)
+_rehashing = set()
+_rehash_tasks = set()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def _rehash_password(user_id: int, old_hash: str, password: str):
+    from app import database, provisioning  # оба модуля импортируют app.auth
+    try:
+        # bcrypt держит GIL, поэтому хэш считается в пуле процессов, а не в потоке
+        loop = asyncio.get_running_loop()
+        [new_hash] = await loop.run_in_executor(provisioning.get_hash_pool(), hash_passwords, [password])
+        async with database.WriteSession() as session:
+            async with session.begin():
+                await session.execute(
+                    queries.UPDATE_PASSWORD_HASH, {"user_id": user_id, "old_hash": old_hash, "new_hash": new_hash}
+                )
+        print(f"✅ Password rehashed to current policy: user_id={user_id}")
+    except Exception as e:
+        print(f"❌ Password rehash failed: user_id={user_id}, error={str(e)}")
+    finally:
+        _rehashing.discard(user_id)
 
 async def authenticate_user(session: AsyncSession, email: str, password: str):
-    result = await session.execute(select(User).where(User.email == email))
+    result = await session.execute(queries.USER_BY_EMAIL, {"email": email})
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return False
+    from app import provisioning  # импортирует app.auth
+    # То же, что CryptContext.verify_and_update, но новый хэш считается после ответа:
+    # вход со старым хэшем не платит за второй bcrypt. Проверка тоже идёт в пуле процессов
+    # (app.provisioning): в цикле событий bcrypt останавливал бы все остальные запросы на время
+    # хэша, а в потоке держал бы GIL так же, как перехэширование
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(provisioning.get_hash_pool(), verify_password, password, user.hashed_password):
         return False
+    pwd_context = get_pwd_context()
+    if pwd_context.needs_update(user.hashed_password) and user.id not in _rehashing:
+        _rehashing.add(user.id)
+        task = asyncio.get_running_loop().create_task(_rehash_password(user.id, user.hashed_password, password))
+        _rehash_tasks.add(task)
+        task.add_done_callback(_rehash_tasks.discard)
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -36,6 +70,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 async def get_current_user(session: AsyncSession, token: str):
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
         user_id: int = int(payload.get("sub"))
@@ -44,7 +79,7 @@ async def get_current_user(session: AsyncSession, token: str):
     except (JWTError, ValueError):
         raise SanicException("Invalid token", status_code=401)
     
-    result = await session.execute(select(User).where(User.id == user_id))
+    result = await session.execute(queries.USER_BY_ID, {"user_id": user_id})
     user = result.scalar_one_or_none()
     if user is None:
         raise SanicException("User not found", status_code=401)
@@ -60,31 +95,81 @@ async def get_current_admin_user(current_user: User):
         raise SanicException("Not enough permissions", status_code=403)
     return current_user
 
+def compute_webhook_signature(data: dict, secret_key: str) -> str:
+    """sha256 от значений всех полей, кроме signature, в порядке ключей, и секрета"""
+    sorted_keys = sorted(key for key in data.keys() if key != "signature")
+    concatenated = ''.join(str(data[key]) for key in sorted_keys)
+    concatenated += secret_key
+    return sha256(concatenated.encode()).hexdigest()
+
 def verify_webhook_signature(data: dict) -> bool:
     """Verify webhook signature"""
     if not data.get("signature"):
         return False
     
-    received_signature = data["signature"]
-    secret_key = config.WEBHOOK_SECRET
-    
-    sorted_keys = sorted(key for key in data.keys() if key != "signature")
-    concatenated = ''.join(str(data[key]) for key in sorted_keys)
-    concatenated += secret_key
-    expected_signature = sha256(concatenated.encode()).hexdigest()
+    received_signature = str(data["signature"])
+    expected_signature = compute_webhook_signature(data, config.WEBHOOK_SECRET)
     
-    return received_signature == expected_signature
+    return hmac.compare_digest(received_signature.encode(), expected_signature.encode())
+
+# Ключ HMAC обрабатывается один раз; на каждый запрос копируется готовое состояние
+_webhook_hmac = hmac.new(config.WEBHOOK_SECRET.encode(), digestmod=sha256)
+
+def compute_webhook_hmac(body: bytes) -> str:
+    """HMAC-SHA256 от сырого тела запроса с WEBHOOK_SECRET, hex"""
+    mac = _webhook_hmac.copy()
+    mac.update(body)
+    return mac.hexdigest()
+
+def verify_webhook_hmac(body: bytes, header: str) -> bool:
+    # Заголовок: sha256=<hex> или просто <hex>
+    received = header.strip()
+    if received.startswith("sha256="):
+        received = received[len("sha256="):]
+    return hmac.compare_digest(received.lower().encode(), compute_webhook_hmac(body).encode())
+
+def signed_webhook():
+    """Проверка HMAC-подписи вебхука по сырому телу, до разбора JSON и до очереди допуска.
+
+    WEBHOOK_SIGNATURE_MODE: hmac — обязателен заголовок WEBHOOK_SIGNATURE_HEADER;
+    legacy — только прежняя подпись в поле signature; both — заголовок, если он
+    есть, иначе прежняя подпись. Прежнюю подпись обработчик проверяет после
+    разбора JSON, если request.ctx.signature_verified ложно.
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request, *args, **kwargs):
+            mode = config.WEBHOOK_SIGNATURE_MODE
+            header = request.headers.get(config.WEBHOOK_SIGNATURE_HEADER)
+            if mode != "legacy" and header is not None:
+                if not verify_webhook_hmac(request.body, header):
+                    print(f"❌ Invalid webhook HMAC signature from {request.ip}")
+                    raise SanicException("Invalid signature", status_code=400)
+                request.ctx.signature_verified = True
+            elif mode == "hmac":
+                raise SanicException(f"Missing {config.WEBHOOK_SIGNATURE_HEADER} header", status_code=400)
+            else:
+                request.ctx.signature_verified = False
+            return await f(request, *args, **kwargs)
+        return decorated_function
+    return decorator
 
-def protected():
+def protected(query_token: bool = False):
+    # query_token разрешает ?token=... для клиентов, которые не умеют заголовки (EventSource)
     def decorator(f):
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
             session = request.ctx.session
             auth_header = request.headers.get("Authorization", "")
-            if not auth_header.startswith("Bearer "):
+            if auth_header.startswith("Bearer "):
+                token = auth_header.replace("Bearer ", "")
+            elif query_token and request.args.get("token"):
+                token = request.args.get("token")
+            else:
                 raise SanicException("Missing or invalid token", status_code=401)
-            token = auth_header.replace("Bearer ", "")
             user = await get_current_user(session, token)
+            # Закрываем неявную транзакцию чтения, чтобы обработчик мог открыть свою через session.begin()
+            await session.commit()
             request.ctx.user = user  # Сохраняем пользователя в контексте запроса
             return await f(request, *args, **kwargs)
         return decorated_function
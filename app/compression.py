@@ -0,0 +1,129 @@
+"""Сжатие ответов по Accept-Encoding.
+
+Сжимаются только ответы с JSON или текстом длиной от COMPRESSION_MIN_SIZE байт;
+кодировка выбирается по q-значениям клиента из br (если установлен пакет
+brotli), gzip и deflate. Тела от COMPRESSION_THREAD_MIN_SIZE байт сжимаются в
+пуле потоков (zlib и brotli отпускают GIL), чтобы не останавливать цикл событий.
+
+Сжатые тела хранятся в LRU размером COMPRESSION_CACHE_BYTES по ключу
+(кодировка, хэш несжатого тела): повторяющиеся ответы — повторы
+Idempotency-Key из кэша app.idempotency, неизменившиеся списки при опросе —
+отдаются без повторного сжатия.
+"""
+import asyncio
+import gzip
+import hashlib
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from app.config import config
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+@lru_cache(maxsize=None)
+def get_brotli():
+    # brotli — необязательная зависимость
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def supported_encodings() -> tuple:
+    # В порядке предпочтения сервера при равных q
+    return ("br", "gzip", "deflate") if get_brotli() else ("gzip", "deflate")
+
+def negotiate(accept_encoding: str):
+    """Лучшая поддерживаемая кодировка из Accept-Encoding или None"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return get_brotli().compress(body, quality=config.COMPRESSION_BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0: одинаковое тело даёт одинаковые байты
+        return gzip.compress(body, compresslevel=config.COMPRESSION_LEVEL, mtime=0)
+    return zlib.compress(body, config.COMPRESSION_LEVEL)
+
+class CompressedBodyCache:
+    """LRU сжатых тел с ограничением по суммарному размеру"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self.bodies.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.bodies.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        previous = self.bodies.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self.bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.bodies), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+cache = CompressedBodyCache(config.COMPRESSION_CACHE_BYTES)
+
+async def compress_response(request, response):
+    """Сжимает тело ответа на месте, если клиент и размер позволяют"""
+    body = getattr(response, "body", None)
+    # Потоковые ответы (/events) уходят по частям и тела здесь не имеют
+    if not body or response.status in (204, 304) or "content-encoding" in response.headers:
+        return
+    content_type = response.content_type or ""
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return
+    response.headers.add("Vary", "Accept-Encoding")
+    if len(body) < config.COMPRESSION_MIN_SIZE:
+        return
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    if encoding is None:
+        return
+
+    key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+    compressed = cache.get(key)
+    if compressed is None:
+        if len(body) >= config.COMPRESSION_THREAD_MIN_SIZE:
+            compressed = await asyncio.get_running_loop().run_in_executor(None, compress, body, encoding)
+        else:
+            compressed = compress(body, encoding)
+        cache.put(key, compressed)
+    if len(compressed) >= len(body):
+        return
+    response.body = compressed
+    response.headers["Content-Encoding"] = encoding
@@ -6,6 +6,60 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
     DATABASE_URL = os.getenv("DATABASE_URL")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+    ARCHIVE_COMPACTION_INTERVAL_S = int(os.getenv("ARCHIVE_COMPACTION_INTERVAL_S", 3600))
+    LEDGER_SNAPSHOT_INTERVAL_S = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL_S", 3600))
+    EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+    EVENTS_HEARTBEAT_S = float(os.getenv("EVENTS_HEARTBEAT_S", 15))
+    EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+    IDEMPOTENCY_TTL_S = int(os.getenv("IDEMPOTENCY_TTL_S", 86400))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+    COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+    COMPRESSION_THREAD_MIN_SIZE = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", 256 * 1024))
+    COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+    COMPRESSION_CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_BYTES", 32 * 1024 * 1024))
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_TOTAL_LIMIT = int(os.getenv("ADMISSION_TOTAL_LIMIT", 48))
+    ADMISSION_WEBHOOKS_LIMIT = int(os.getenv("ADMISSION_WEBHOOKS_LIMIT", 16))
+    ADMISSION_WEBHOOKS_QUEUE = int(os.getenv("ADMISSION_WEBHOOKS_QUEUE", 256))
+    ADMISSION_WEBHOOKS_WAIT_MS = int(os.getenv("ADMISSION_WEBHOOKS_WAIT_MS", 5000))
+    ADMISSION_AUTH_LIMIT = int(os.getenv("ADMISSION_AUTH_LIMIT", 4))
+    ADMISSION_AUTH_QUEUE = int(os.getenv("ADMISSION_AUTH_QUEUE", 32))
+    ADMISSION_AUTH_WAIT_MS = int(os.getenv("ADMISSION_AUTH_WAIT_MS", 2000))
+    ADMISSION_WRITES_LIMIT = int(os.getenv("ADMISSION_WRITES_LIMIT", 16))
+    ADMISSION_WRITES_QUEUE = int(os.getenv("ADMISSION_WRITES_QUEUE", 128))
+    ADMISSION_WRITES_WAIT_MS = int(os.getenv("ADMISSION_WRITES_WAIT_MS", 2000))
+    ADMISSION_READS_LIMIT = int(os.getenv("ADMISSION_READS_LIMIT", 32))
+    ADMISSION_READS_QUEUE = int(os.getenv("ADMISSION_READS_QUEUE", 128))
+    ADMISSION_READS_WAIT_MS = int(os.getenv("ADMISSION_READS_WAIT_MS", 1000))
+    PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "bcrypt")
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", 29000))
+    SETTLEMENT_MODE = os.getenv("SETTLEMENT_MODE", "sync")
+    SETTLEMENT_BATCH_SIZE = int(os.getenv("SETTLEMENT_BATCH_SIZE", 500))
+    SETTLEMENT_INTERVAL_S = float(os.getenv("SETTLEMENT_INTERVAL_S", 0.5))
+    BASE_CURRENCY = os.getenv("BASE_CURRENCY", "USD")
+    FX_RATES_FILE = os.getenv("FX_RATES_FILE", "")
+    VELOCITY_ENABLED = os.getenv("VELOCITY_ENABLED", "true").lower() == "true"
+    VELOCITY_LIMITS = os.getenv(
+        "VELOCITY_LIMITS",
+        "account:debit:minute:count=30,account:debit:day:amount=50000,user:debit:hour:count=300,"
+        "account:credit:day:amount=1000000"
+    )
+    BULK_USERS_MAX_ROWS = int(os.getenv("BULK_USERS_MAX_ROWS", 10000))
+    BULK_USERS_CHUNK_SIZE = int(os.getenv("BULK_USERS_CHUNK_SIZE", 500))
+    BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", os.cpu_count() or 2))
+    DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "false").lower() == "true"
+    DIAGNOSTICS_TRACEMALLOC_FRAMES = int(os.getenv("DIAGNOSTICS_TRACEMALLOC_FRAMES", 1))
+    DIAGNOSTICS_MAX_SNAPSHOTS = int(os.getenv("DIAGNOSTICS_MAX_SNAPSHOTS", 4))
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_POOL_CONNECTIONS = int(os.getenv("WARMUP_POOL_CONNECTIONS", 5))
     DEFAULT_ADMIN_EMAIL = os.getenv("DEFAULT_ADMIN_EMAIL", "admin@example.com")
     DEFAULT_ADMIN_PASSWORD = os.getenv("DEFAULT_ADMIN_PASSWORD", "admin123")
     DEFAULT_USER_EMAIL = os.getenv("DEFAULT_USER_EMAIL", "user@example.com")
@@ -14,5 +68,18 @@ class Config:
     JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 30))
     WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "your-webhook-secret")
+    WEBHOOK_SIGNATURE_MODE = os.getenv("WEBHOOK_SIGNATURE_MODE", "both")
+    WEBHOOK_SIGNATURE_HEADER = os.getenv("WEBHOOK_SIGNATURE_HEADER", "X-Signature-256")
+    NOTIFY_WEBHOOK_URLS = [url.strip() for url in os.getenv("NOTIFY_WEBHOOK_URLS", "").split(",") if url.strip()]
+    NOTIFY_WEBHOOK_SECRET = os.getenv("NOTIFY_WEBHOOK_SECRET") or WEBHOOK_SECRET
+    NOTIFY_POLL_INTERVAL_S = float(os.getenv("NOTIFY_POLL_INTERVAL_S", 1))
+    NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 50))
+    NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", 4))
+    NOTIFY_CONNECTIONS_PER_HOST = int(os.getenv("NOTIFY_CONNECTIONS_PER_HOST", 4))
+    NOTIFY_TIMEOUT_S = float(os.getenv("NOTIFY_TIMEOUT_S", 10))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 8))
+    NOTIFY_BACKOFF_BASE_S = float(os.getenv("NOTIFY_BACKOFF_BASE_S", 1))
+    NOTIFY_BACKOFF_MAX_S = float(os.getenv("NOTIFY_BACKOFF_MAX_S", 600))
+    NOTIFY_RETENTION_DAYS = int(os.getenv("NOTIFY_RETENTION_DAYS", 7))
 
 config = Config()
\ No newline at end of file
@@ -1,12 +1,68 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql import select
 from app.config import config
 from app.models import Base, User, Account, Payment
 from app.auth import get_password_hash
 from datetime import datetime
 
-engine = create_async_engine(config.DATABASE_URL, echo=True)
+def is_sqlite_file(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def create_write_engine(database_url: str):
+    """Движок для записи. Для SQLite — ровно одно соединение: запись сериализуется
+    очередью пула, а не ретраями на 'database is locked'"""
+    # Для aiosqlite по умолчанию NullPool (новое соединение на каждую сессию), поэтому пул задаём явно
+    if not is_sqlite_file(database_url):
+        return create_async_engine(
+            database_url,
+            echo=True,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=config.DB_POOL_SIZE
+        )
+    write_engine = create_async_engine(
+        database_url,
+        echo=True,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0
+    )
+    event.listen(write_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return write_engine
+
+def create_read_engine(database_url: str, write_engine):
+    """Движок для чтения: несколько соединений mode=ro к той же базе в режиме WAL,
+    читатели не ждут писателя. Для других СУБД используется движок записи"""
+    if not is_sqlite_file(database_url):
+        return write_engine
+    url = make_url(database_url)
+    read_url = url.set(
+        database=f"file:{url.database}",
+        query={**url.query, "mode": "ro", "uri": "true"}
+    )
+    return create_async_engine(
+        read_url,
+        echo=True,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.DB_READ_POOL_SIZE
+    )
+
+engine = create_write_engine(config.DATABASE_URL)
+read_engine = create_read_engine(config.DATABASE_URL, engine)
+
+WriteSession = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+ReadSession = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
 
 async def init_db():
     try:
@@ -0,0 +1,206 @@
+"""Диагностика памяти процесса (маршруты /admin/diagnostics, DIAGNOSTICS_ENABLED=true).
+
+Без флага модуль не импортируется, маршруты не регистрируются, а tracemalloc не
+запущен — диагностика ничего не стоит. С флагом tracemalloc по-прежнему
+выключен, пока его не запустят через POST /admin/diagnostics/tracemalloc/start:
+трассировка замедляет каждое выделение памяти и хранит кадр стека на каждый
+живой блок, поэтому включается только на время поиска утечки.
+
+Порядок поиска: запустить трассировку, снять снимок, дать поработать обычной
+нагрузке, снять второй снимок и сравнить их. Разница группируется по файлу,
+строке или стеку (для стека нужно frames > 1) и показывает, где копится
+память. Снимков хранится не больше DIAGNOSTICS_MAX_SNAPSHOTS, старые
+вытесняются. Счётчики живых объектов (экземпляры моделей ORM, сессии, самые
+частые типы) собираются обходом gc.get_objects() — это единицы секунд на
+большом heap, поэтому только по запросу.
+"""
+import gc
+import os
+import resource
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from sanic.exceptions import SanicException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app import compression, idempotency, queries, velocity
+from app.config import config
+from app.events import bus
+from app.models import Base
+from app.sharding import shards
+
+SESSION_TYPES = (Session, AsyncSession)
+
+# Собственные выделения tracemalloc и импорт модулей в снимки не попадают
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# Номер снимка -> (время снятия, tracemalloc.Snapshot)
+snapshots = OrderedDict()
+_next_snapshot_id = 1
+
+def start_tracing(frames: int = None) -> bool:
+    """Запускает tracemalloc; False, если он уже запущен"""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames or config.DIAGNOSTICS_TRACEMALLOC_FRAMES)
+    print(f"🔍 tracemalloc started: frames={tracemalloc.get_traceback_limit()}")
+    return True
+
+def stop_tracing() -> bool:
+    """Останавливает tracemalloc; снятые снимки остаются доступны для сравнения"""
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    print("🔍 tracemalloc stopped")
+    return True
+
+def take_snapshot() -> int:
+    global _next_snapshot_id
+    if not tracemalloc.is_tracing():
+        raise SanicException("tracemalloc is not running", status_code=409)
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    snapshot_id = _next_snapshot_id
+    _next_snapshot_id += 1
+    snapshots[snapshot_id] = (time.time(), snapshot)
+    while len(snapshots) > config.DIAGNOSTICS_MAX_SNAPSHOTS:
+        snapshots.popitem(last=False)
+    return snapshot_id
+
+def get_snapshot(snapshot_id: int):
+    entry = snapshots.get(snapshot_id)
+    if entry is None:
+        raise SanicException(f"Snapshot {snapshot_id} not found", status_code=404)
+    return entry[1]
+
+def clear_snapshots() -> int:
+    removed = len(snapshots)
+    snapshots.clear()
+    return removed
+
+def _location(traceback: tracemalloc.Traceback, group_by: str):
+    if group_by == "filename":
+        return traceback[0].filename
+    if group_by == "lineno":
+        return f"{traceback[0].filename}:{traceback[0].lineno}"
+    # Стек от внешнего вызова к месту выделения
+    return [f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback)]
+
+def snapshot_top(snapshot_id: int, group_by: str, limit: int) -> dict:
+    snapshot = get_snapshot(snapshot_id)
+    statistics = snapshot.statistics(group_by)
+    return {
+        "id": snapshot_id,
+        "taken_at": snapshots[snapshot_id][0],
+        "group_by": group_by,
+        "total_size": sum(stat.size for stat in statistics),
+        "total_count": sum(stat.count for stat in statistics),
+        "top": [
+            {"location": _location(stat.traceback, group_by), "size": stat.size, "count": stat.count}
+            for stat in statistics[:limit]
+        ]
+    }
+
+def compare_snapshots(snapshot_id: int, base_id: int, group_by: str, limit: int) -> dict:
+    """Разница снимка snapshot_id с base_id, по убыванию модуля прироста"""
+    statistics = get_snapshot(snapshot_id).compare_to(get_snapshot(base_id), group_by)
+    return {
+        "id": snapshot_id,
+        "base": base_id,
+        "group_by": group_by,
+        "size_diff": sum(stat.size_diff for stat in statistics),
+        "count_diff": sum(stat.count_diff for stat in statistics),
+        "top": [
+            {
+                "location": _location(stat.traceback, group_by),
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff
+            }
+            for stat in statistics[:limit]
+        ]
+    }
+
+def list_snapshots() -> list:
+    return [
+        {"id": snapshot_id, "taken_at": taken_at, "traces": len(snapshot.traces)}
+        for snapshot_id, (taken_at, snapshot) in snapshots.items()
+    ]
+
+def object_counts(limit: int) -> dict:
+    """Живые экземпляры моделей, сессии и самые частые типы среди объектов, отслеживаемых gc"""
+    mapped = {mapper.class_ for mapper in Base.registry.mappers}
+    types = Counter(type(obj) for obj in gc.get_objects())
+    return {
+        "tracked": sum(types.values()),
+        "orm": {cls.__name__: types[cls] for cls in sorted(mapped, key=lambda cls: cls.__name__) if types[cls]},
+        "sessions": {cls.__name__: count for cls, count in types.items() if issubclass(cls, SESSION_TYPES)},
+        "top_types": [
+            {"type": f"{cls.__module__}.{cls.__qualname__}", "count": count}
+            for cls, count in types.most_common(limit)
+        ],
+        "gc": {"counts": gc.get_count(), "collections": [stat["collections"] for stat in gc.get_stats()]}
+    }
+
+def _pool_stats(engine) -> dict:
+    pool = engine.pool
+    return {"size": pool.size(), "checked_in": pool.checkedin(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+def pool_stats() -> list:
+    return [
+        {
+            "shard": shard.index,
+            "write": _pool_stats(shard.engine),
+            # Не SQLite: читатели используют движок записи
+            "read": _pool_stats(shard.read_engine) if shard.read_engine is not shard.engine else None
+        }
+        for shard in shards
+    ]
+
+def cache_stats() -> dict:
+    return {
+        "query_cache": queries.get_cache_stats(),
+        "idempotency": {
+            "entries": len(idempotency.cache.records),
+            "max_size": idempotency.cache.max_size,
+            "in_flight": len(idempotency.in_flight)
+        },
+        "compression": compression.cache.stats(),
+        "events": bus.stats(),
+        "velocity_counters": len(velocity.engine.counters)
+    }
+
+def process_memory() -> dict:
+    memory = {
+        # ru_maxrss в Linux — в килобайтах
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "tracemalloc": tracemalloc.is_tracing()
+    }
+    try:
+        with open("/proc/self/statm") as statm:
+            memory["rss"] = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass  # Не Linux: текущего RSS нет, остаётся пиковый
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        memory.update(
+            traced_current=current,
+            traced_peak=peak,
+            tracemalloc_overhead=tracemalloc.get_tracemalloc_memory(),
+            frames=tracemalloc.get_traceback_limit()
+        )
+    return memory
+
+def overview(limit: int) -> dict:
+    return {
+        "memory": process_memory(),
+        "objects": object_counts(limit),
+        "pools": pool_stats(),
+        "caches": cache_stats(),
+        "snapshots": list_snapshots()
+    }
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Внутрипроцессная шина событий для потока /events (Server-Sent Events).
+
+Обработчики публикуют события пользователя после commit; каждое событие
+сериализуется в кадр SSE один раз и раздаётся всем подключениям пользователя.
+У подписчика ограниченная очередь (EVENTS_QUEUE_SIZE): если клиент не успевает
+её разбирать, очередь очищается, поток получает событие dropped и закрывается —
+клиент переподключается и перечитывает состояние через REST. Простаивающее
+подключение — это корутина и пустая очередь; раз в EVENTS_HEARTBEAT_S секунд в
+него уходит комментарий-heartbeat, который держит прокси и RESPONSE_TIMEOUT
+Sanic и обнаруживает закрытые соединения.
+
+Шина живёт в памяти процесса: API запускается single_process.
+"""
+import asyncio
+import json
+from collections import defaultdict
+from app.config import config
+
+HEARTBEAT = b": heartbeat\n\n"
+DROPPED = b"event: dropped\ndata: {}\n\n"
+
+def encode(event_type: str, data: dict) -> bytes:
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+class Subscriber:
+    __slots__ = ("user_id", "queue")
+
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        # None в очереди — сигнал закрыть поток
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def drop(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class EventBus:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(user_id, self.queue_size)
+        self.subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.user_id]
+
+    def publish(self, user_id: int, event_type: str, data: dict):
+        """Не блокирует: медленный подписчик отключается, а не задерживает обработчик"""
+        subscribers = self.subscribers.get(user_id)
+        if not subscribers:
+            return
+        frame = encode(event_type, data)
+        self.published += 1
+        for subscriber in list(subscribers):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                print(f"⚠️ Dropping slow event subscriber: user_id={user_id}")
+                self.unsubscribe(subscriber)
+                subscriber.drop()
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values()),
+            "users": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+bus = EventBus(config.EVENTS_QUEUE_SIZE)
+
+async def stream(request, user_id: int):
+    """Отдаёт события пользователя в открытый ответ text/event-stream до отключения клиента"""
+    subscriber = bus.subscribe(user_id)
+    try:
+        response = await request.respond(
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        await response.send(f"retry: {config.EVENTS_RETRY_MS}\n\n".encode())
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscriber.queue.get(), timeout=config.EVENTS_HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                frame = HEARTBEAT
+            if frame is None:
+                await response.send(DROPPED)
+                break
+            await response.send(frame)
+        await response.eof()
+    finally:
+        bus.unsubscribe(subscriber)
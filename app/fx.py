@@ -0,0 +1,134 @@
+"""Курсы валют для счетов и платежей в разных валютах.
+
+Курс валюты — сколько единиц BASE_CURRENCY стоит одна её единица; у базовой
+валюты курс 1. Таблица fx_rates основной базы хранит все версии курсов,
+действующая — последняя. Новая версия появляется при старте, если курсы в
+файле FX_RATES_FILE ({"rates": {"EUR": 1.08, "GBP": 1.27}}) отличаются от
+действующих, или через PUT /admin/fx-rates с тем же телом.
+
+В памяти держится неизменяемая RateTable действующей версии; обновление
+подменяет ссылку целиком, поэтому расчёт, взявший таблицу один раз, видит
+курсы одной версии. Платёж хранит сумму в валюте счёта и курс этой валюты на
+момент платежа (Payment.fx_rate): агрегаты /admin/stats и лимиты app.velocity
+ведутся в базовой валюте по этому курсу и не пересчитываются при смене курсов.
+Отчёты переводят целые выборки в валюту ?convert_to= одной операцией NumPy
+(convert_many), а не построчно.
+"""
+import json
+from datetime import datetime
+from sanic.exceptions import SanicException
+from sqlalchemy import distinct, func, insert
+from sqlalchemy.future import select
+from app import database
+from app.config import config
+from app.models import Account, FxRate
+from app.schemas import FxRatesUpdate
+from app.sharding import gather_rows
+
+LATEST_RATES = select(FxRate).where(
+    FxRate.version == select(func.max(FxRate.version)).scalar_subquery()
+)
+ACCOUNT_CURRENCIES = select(distinct(Account.currency))
+
+class UnknownCurrency(SanicException):
+    status_code = 400
+
+class RateTable:
+    """Курсы одной версии: валюта -> единиц базовой валюты за единицу"""
+    __slots__ = ("version", "rates", "updated_at")
+
+    def __init__(self, version: int, rates: dict, updated_at: datetime = None):
+        self.version = version
+        self.rates = rates
+        self.updated_at = updated_at
+
+    def rate(self, currency: str) -> float:
+        try:
+            return self.rates[currency]
+        except KeyError:
+            raise UnknownCurrency(f"Unknown currency: {currency}")
+
+    def convert(self, amount: float, source: str, target: str) -> float:
+        if source == target:
+            return amount
+        return amount * self.rate(source) / self.rate(target)
+
+    def convert_many(self, amounts, currencies, target: str):
+        """Массив сумм в валютах currencies (по строке) -> массив NumPy в валюте target.
+
+        Курсы ищутся только для различных валют выборки (np.unique), каждой
+        строке множитель достаётся индексом, перевод — одно умножение массивов"""
+        import numpy as np  # NumPy нужен отчётам, не запуску API
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if not len(amounts):
+            return amounts
+        codes, inverse = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+        factors = np.array([self.rate(code) for code in codes.tolist()], dtype=np.float64) / self.rate(target)
+        return amounts * factors[inverse]
+
+    def as_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "base": config.BASE_CURRENCY,
+            "rates": dict(sorted(self.rates.items())),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+# До load() известна только базовая валюта
+table = RateTable(0, {config.BASE_CURRENCY: 1.0})
+
+def payment_fields(amount: float, currency: str, account_currency: str) -> dict:
+    """Поля Payment для суммы amount в валюте currency (None — валюта счёта) по счёту в account_currency"""
+    rates = table  # Одна версия курсов на весь расчёт
+    fields = {"amount": amount, "currency": account_currency, "fx_rate": rates.rate(account_currency)}
+    if currency is not None and currency != account_currency:
+        # Перевод в другой валюте проводится по счёту в его валюте; исходная сумма сохраняется
+        fields.update(
+            amount=round(rates.convert(amount, currency, account_currency), 2),
+            original_amount=amount,
+            original_currency=currency
+        )
+    return fields
+
+def validate_rates(rates: dict) -> dict:
+    base_rate = rates.get(config.BASE_CURRENCY, 1.0)
+    if base_rate != 1.0:
+        raise SanicException(f"Rate of the base currency {config.BASE_CURRENCY} must be 1", status_code=400)
+    return {**rates, config.BASE_CURRENCY: 1.0}
+
+async def save(rates: dict) -> RateTable:
+    """Сохраняет курсы новой версией и делает её действующей"""
+    global table
+    rates = validate_rates(rates)
+    # Без курса валюты счёта платежи и отчёты по нему получали бы 400
+    missing = sorted({currency for currency, in await gather_rows(ACCOUNT_CURRENCIES)} - rates.keys())
+    if missing:
+        raise SanicException(f"Rates are missing for currencies of existing accounts: {', '.join(missing)}", status_code=400)
+    now = datetime.utcnow()
+    async with database.WriteSession() as session:
+        async with session.begin():
+            version = ((await session.execute(select(func.max(FxRate.version)))).scalar() or 0) + 1
+            await session.execute(insert(FxRate), [
+                {"version": version, "currency": currency, "rate": rate, "created_at": now}
+                for currency, rate in rates.items()
+            ])
+    table = RateTable(version, rates, now)
+    print(f"✅ FX rates version {version} saved: {len(rates)} currencies")
+    return table
+
+def read_rates_file(path: str) -> dict:
+    with open(path) as rates_file:
+        return FxRatesUpdate(**json.load(rates_file)).rates
+
+async def load():
+    """Загружает действующие курсы; курсы из FX_RATES_FILE, если они другие, сохраняются новой версией"""
+    global table
+    async with database.ReadSession() as session:
+        rows = (await session.execute(LATEST_RATES)).scalars().all()
+    if rows:
+        table = RateTable(rows[0].version, {row.currency: row.rate for row in rows}, rows[0].created_at)
+    if config.FX_RATES_FILE:
+        rates = validate_rates(read_rates_file(config.FX_RATES_FILE))
+        if rates != table.rates:
+            await save(rates)
+    print(f"✅ FX rates loaded: version {table.version}, {len(table.rates)} currencies")
\ No newline at end of file
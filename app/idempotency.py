@@ -0,0 +1,166 @@
+"""Заголовок Idempotency-Key для изменяющих маршрутов.
+
+Первый успешный (2xx) ответ на запрос с ключом сохраняется в idempotency_keys
+шарда пользователя на IDEMPOTENCY_TTL_S секунд и в LRU-кэше процесса на
+IDEMPOTENCY_CACHE_SIZE записей. Повтор с тем же ключом получает сохранённые
+статус и тело с заголовком Idempotent-Replayed: true, обработчик не
+вызывается. Повтор, пришедший, пока первый запрос ещё выполняется, ждёт его
+результата. Тот же ключ с другим методом, путём или телом — 422.
+
+Ответы с ошибкой не сохраняются: запрос с тем же ключом выполнится заново.
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from sanic import response
+from sanic.exceptions import SanicException
+from sqlalchemy import bindparam, delete
+from sqlalchemy.future import select
+from app.config import config
+from app.models import IdempotencyRecord
+from app.sharding import shard_for, shards
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+RECORD_BY_KEY = select(IdempotencyRecord).where(
+    IdempotencyRecord.user_id == bindparam("user_id"),
+    IdempotencyRecord.key == bindparam("key"),
+    IdempotencyRecord.expires_at > bindparam("now")
+)
+
+class ResponseCache:
+    """LRU сохранённых ответов: (user_id, ключ) -> IdempotencyRecord"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.records = OrderedDict()
+
+    def get(self, cache_key):
+        record = self.records.get(cache_key)
+        if record is None:
+            return None
+        if record.expires_at <= datetime.utcnow():
+            del self.records[cache_key]
+            return None
+        self.records.move_to_end(cache_key)
+        return record
+
+    def put(self, cache_key, record: IdempotencyRecord):
+        self.records[cache_key] = record
+        self.records.move_to_end(cache_key)
+        while len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+
+cache = ResponseCache(config.IDEMPOTENCY_CACHE_SIZE)
+# Запросы, которые выполняются сейчас: (user_id, ключ) -> Future с записью или None
+in_flight = {}
+
+def fingerprint(request) -> str:
+    return hashlib.sha256(b"\n".join([request.method.encode(), request.path.encode(), request.body or b""])).hexdigest()
+
+def replay(record: IdempotencyRecord, request_fingerprint: str):
+    if record.fingerprint != request_fingerprint:
+        raise SanicException("Idempotency-Key was already used with a different request", status_code=422)
+    return response.raw(
+        record.body,
+        status=record.status,
+        content_type=record.content_type,
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def _load(user_id: int, key: str):
+    async with shard_for(user_id).ReadSession() as session:
+        result = await session.execute(RECORD_BY_KEY, {"user_id": user_id, "key": key, "now": datetime.utcnow()})
+        return result.scalar_one_or_none()
+
+async def _store(user_id: int, key: str, request_fingerprint: str, handler_response) -> IdempotencyRecord:
+    now = datetime.utcnow()
+    record = IdempotencyRecord(
+        user_id=user_id,
+        key=key,
+        fingerprint=request_fingerprint,
+        status=handler_response.status,
+        content_type=handler_response.content_type,
+        body=bytes(handler_response.body or b""),
+        created_at=now,
+        expires_at=now + timedelta(seconds=config.IDEMPOTENCY_TTL_S)
+    )
+    async with shard_for(user_id).WriteSession() as session:
+        async with session.begin():
+            # merge: запись с истёкшим сроком, ещё не удалённая очисткой, перезаписывается
+            await session.merge(record)
+    return record
+
+def idempotent():
+    """Ставится под @protected(): ключ действует в пределах пользователя"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await f(request, *args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                raise SanicException(f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters", status_code=400)
+
+            user_id = request.ctx.user.id
+            cache_key = (user_id, key)
+            request_fingerprint = fingerprint(request)
+            while True:
+                record = cache.get(cache_key)
+                if record is not None:
+                    return replay(record, request_fingerprint)
+                pending = in_flight.get(cache_key)
+                if pending is None:
+                    break
+                # Тот же ключ уже обрабатывается: ждём его результата; если первый
+                # запрос завершился ошибкой, этот выполняется сам
+                record = await asyncio.shield(pending)
+                if record is not None:
+                    return replay(record, request_fingerprint)
+
+            pending = asyncio.get_running_loop().create_future()
+            in_flight[cache_key] = pending
+            record = None
+            try:
+                record = await _load(user_id, key)
+                if record is not None:
+                    cache.put(cache_key, record)
+                    return replay(record, request_fingerprint)
+                handler_response = await f(request, *args, **kwargs)
+                if 200 <= handler_response.status < 300:
+                    try:
+                        record = await _store(user_id, key, request_fingerprint, handler_response)
+                        cache.put(cache_key, record)
+                    except Exception as e:
+                        # Изменение уже выполнено — клиент получает ответ, даже если ключ не сохранился
+                        print(f"❌ Failed to store idempotency key: user_id={user_id}, error={str(e)}")
+                return handler_response
+            finally:
+                del in_flight[cache_key]
+                pending.set_result(record)
+        return decorated_function
+    return decorator
+
+async def purge_expired() -> int:
+    deleted = 0
+    for shard in shards:
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                result = await session.execute(
+                    delete(IdempotencyRecord).where(IdempotencyRecord.expires_at <= datetime.utcnow())
+                )
+                deleted += result.rowcount
+    return deleted
+
+async def cleanup_loop():
+    while True:
+        await asyncio.sleep(min(config.IDEMPOTENCY_TTL_S, 3600))
+        try:
+            deleted = await purge_expired()
+            if deleted:
+                print(f"✅ Purged {deleted} expired idempotency keys")
+        except Exception as e:
+            print(f"❌ Idempotency key cleanup failed: {str(e)}")
@@ -0,0 +1,199 @@
+"""Журнал проводок (двойная запись) и снимки балансов счетов.
+
+Каждое движение денег — списание, зачисление или открытие счёта — пишется
+двумя строками ledger_entries с общим entry_group: нога счёта клиента и
+встречная нога клирингового счёта, в сумме 0. Проводки только добавляются и
+пишутся в той же транзакции, что и платёж.
+
+Фоновая задача раз в LEDGER_SNAPSHOT_INTERVAL_S секунд (0 — отключено)
+сохраняет баланс каждого счёта, по которому были проводки, в
+balance_snapshots. Выписка начинает с ближайшего снимка до начала периода и
+дочитывает только проводки после него, поэтому её стоимость зависит от длины
+периода и интервала снимков, а не от возраста счёта. Запись в шард идёт через
+единственное соединение, поэтому порядок id проводок совпадает с порядком
+created_at.
+
+Счета, открытые до появления журнала, получают проводку открытия на текущий
+баланс при первом снимке или вручную:
+
+    python -m app.ledger snapshot
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime
+from sqlalchemy import bindparam, func, insert
+from sqlalchemy.future import select
+from app.config import config
+from app.models import Account, Payment, LedgerEntry, BalanceSnapshot, LedgerState
+from app.sharding import shards
+
+CUSTOMER = "customer"
+# Встречные счета: куда уходят списания, откуда приходят зачисления, чем открыт счёт
+COUNTER_ACCOUNTS = {
+    "debit": "clearing:outgoing",
+    "credit": "clearing:incoming",
+    "opening": "equity:opening",
+}
+
+def _post(session, kind: str, account_id: int, amount: float, payment_id: int = None):
+    """Добавляет в сессию две ноги проводки; amount > 0 увеличивает баланс счёта клиента"""
+    group = str(uuid.uuid4())
+    created_at = datetime.utcnow()
+    session.add_all([
+        LedgerEntry(
+            entry_group=group, ledger_account=CUSTOMER, account_id=account_id, payment_id=payment_id,
+            kind=kind, amount=amount, created_at=created_at
+        ),
+        LedgerEntry(
+            entry_group=group, ledger_account=COUNTER_ACCOUNTS[kind], account_id=None, payment_id=payment_id,
+            kind=kind, amount=-amount, created_at=created_at
+        ),
+    ])
+
+async def open_account(session, account: Account):
+    """Проводка открытия счёта; вызывается в транзакции, которая создаёт счёт"""
+    await open_accounts(session, [account])
+
+async def open_accounts(session, accounts: list):
+    """Проводки открытия пачки счетов с одним flush на всю пачку"""
+    await session.flush()  # Нужны account.id
+    for account in accounts:
+        opening = account.balance if account.opening_balance is None else account.opening_balance
+        _post(session, "opening", account.id, opening)
+
+async def record_payment(session, payment: Payment):
+    """Проводка платежа; вызывается в транзакции, которая создаёт платёж"""
+    await record_payments(session, [payment])
+
+async def record_payments(session, payments: list):
+    """Проводки пачки платежей с одним flush (app.settlement)"""
+    await session.flush()  # Нужны payment.id
+    for payment in payments:
+        amount = payment.amount if payment.direction == "credit" else -payment.amount
+        _post(session, payment.direction, payment.account_id, amount, payment.id)
+
+# --- выписка ------------------------------------------------------------------
+
+SNAPSHOT_BEFORE = select(BalanceSnapshot).where(
+    BalanceSnapshot.account_id == bindparam("account_id"),
+    BalanceSnapshot.as_of < bindparam("at")
+).order_by(BalanceSnapshot.as_of.desc(), BalanceSnapshot.id.desc()).limit(1)
+
+def _entries_between(columns: list, account_id: int, after_id: int, start: datetime, end: datetime):
+    # Нижняя граница по created_at держит чтение внутри ix_ledger_entries_account_created
+    statement = select(*columns).where(LedgerEntry.account_id == account_id, LedgerEntry.id > after_id)
+    if start is not None:
+        statement = statement.where(LedgerEntry.created_at >= start)
+    if end is not None:
+        statement = statement.where(LedgerEntry.created_at < end)
+    return statement
+
+async def statement(session, account_id: int, date_from: datetime = None, date_to: datetime = None) -> dict:
+    """Входящий и исходящий балансы и проводки счёта за [date_from, date_to)"""
+    opening = 0.0
+    if date_from is not None:
+        snapshot = (await session.execute(
+            SNAPSHOT_BEFORE, {"account_id": account_id, "at": date_from}
+        )).scalar_one_or_none()
+        after_id, since = (snapshot.last_entry_id, snapshot.as_of) if snapshot else (0, None)
+        opening = (snapshot.balance if snapshot else 0.0) + ((await session.execute(
+            _entries_between([func.coalesce(func.sum(LedgerEntry.amount), 0.0)], account_id, after_id, since, date_from)
+        )).scalar())
+
+    entries = (await session.execute(
+        _entries_between([LedgerEntry], account_id, 0, date_from, date_to)
+        .order_by(LedgerEntry.created_at, LedgerEntry.id)
+    )).scalars().all()
+
+    balance = opening
+    lines = []
+    for entry in entries:
+        balance += entry.amount
+        lines.append({
+            "id": entry.id,
+            "payment_id": entry.payment_id,
+            "kind": entry.kind,
+            "amount": entry.amount,
+            "balance": balance,
+            "created_at": entry.created_at.isoformat()
+        })
+    return {
+        "account_id": account_id,
+        "from": date_from.isoformat() if date_from else None,
+        "to": date_to.isoformat() if date_to else None,
+        "opening_balance": opening,
+        "closing_balance": balance,
+        "entries": lines
+    }
+
+# --- снимки -------------------------------------------------------------------
+
+UNLEDGERED_ACCOUNTS = select(Account).where(
+    ~select(LedgerEntry.id).where(LedgerEntry.account_id == Account.id).exists()
+)
+
+LATEST_BALANCE = func.coalesce(
+    select(BalanceSnapshot.balance)
+    .where(BalanceSnapshot.account_id == LedgerEntry.account_id)
+    .order_by(BalanceSnapshot.id.desc())
+    .limit(1)
+    .scalar_subquery(),
+    0.0
+)
+
+async def snapshot_shard(shard) -> int:
+    """Снимки балансов счетов шарда с проводками после прошлого прогона; возвращает число снимков"""
+    async with shard.WriteSession() as session:
+        async with session.begin():
+            backfilled = (await session.execute(UNLEDGERED_ACCOUNTS)).scalars().all()
+            for account in backfilled:
+                _post(session, "opening", account.id, account.balance)
+            await session.flush()
+
+            # Каждый прогон снимает все счета с проводками выше high-water mark, поэтому
+            # проводки ниже него уже учтены в последнем снимке своего счёта
+            state = await session.get(LedgerState, 1)
+            high_water = state.snapshot_high_water_id if state else 0
+            rows = (await session.execute(
+                select(
+                    LedgerEntry.account_id,
+                    LATEST_BALANCE + func.sum(LedgerEntry.amount),
+                    func.max(LedgerEntry.id),
+                    func.max(LedgerEntry.created_at)
+                ).where(
+                    LedgerEntry.id > high_water, LedgerEntry.account_id.is_not(None)
+                ).group_by(LedgerEntry.account_id)
+            )).all()
+            if rows:
+                await session.execute(insert(BalanceSnapshot), [
+                    {"account_id": account_id, "balance": balance, "last_entry_id": last_entry_id, "as_of": as_of}
+                    for account_id, balance, last_entry_id, as_of in rows
+                ])
+                high_water = max(last_entry_id for _, _, last_entry_id, _ in rows)
+            await session.merge(LedgerState(id=1, snapshot_high_water_id=high_water))
+    print(f"✅ Ledger snapshots of shard {shard.index}: {len(rows)} accounts, {len(backfilled)} backfilled")
+    return len(rows)
+
+async def snapshot() -> int:
+    return sum([await snapshot_shard(shard) for shard in shards])
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(config.LEDGER_SNAPSHOT_INTERVAL_S)
+        try:
+            await snapshot()
+        except Exception as e:
+            print(f"❌ Ledger snapshot failed: {str(e)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API ledger")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("snapshot", help="snapshot account balances and backfill opening entries")
+    args = parser.parse_args()
+    if args.command == "snapshot":
+        total = asyncio.run(snapshot())
+        print(f"✅ Ledger snapshots taken for {total} accounts")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Boolean, Float, Integer, DateTime
-from datetime import datetime
+from sqlalchemy import String, Text, LargeBinary, Boolean, Float, Integer, BigInteger, Date, DateTime, Index, text
+from datetime import date, datetime
+from app.config import config
+
+# id счетов и платежей и ссылки на них: шард N выдаёт id из диапазона от N * 2**40 (app.sharding).
+# В SQLite остаётся INTEGER — только он делает первичный ключ псевдонимом rowid
+ID = BigInteger().with_variant(Integer(), "sqlite")
 
 class Base(DeclarativeBase):
     pass
@@ -19,19 +24,212 @@ class User(Base):
 class Account(Base):
     __tablename__ = "accounts"
     
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(ID, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, nullable=False)
     balance: Mapped[float] = mapped_column(Float, default=0.0)
+    # Баланс при открытии счёта — точка отсчёта для сверки с историей платежей (app.reconciliation)
+    opening_balance: Mapped[float] = mapped_column(Float, nullable=True)
+    # Сумма платежей в статусе pending (SETTLEMENT_MODE=async): уже обещана, но ещё не списана
+    reserved: Mapped[float] = mapped_column(Float, default=0.0, server_default="0")
+    # Валюта баланса (app.fx); счета, созданные до валют, — в базовой
+    currency: Mapped[str] = mapped_column(String(3), default=config.BASE_CURRENCY, server_default=config.BASE_CURRENCY)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 class Payment(Base):
     __tablename__ = "payments"
     
-    id: Mapped[int] = mapped_column(primary_key=True)
-    account_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    id: Mapped[int] = mapped_column(ID, primary_key=True)
+    account_id: Mapped[int] = mapped_column(ID, nullable=False)
     user_id: Mapped[int] = mapped_column(Integer, nullable=False)
     amount: Mapped[float] = mapped_column(Float, nullable=False)
     recipient_email: Mapped[str] = mapped_column(String(120), nullable=False)
     transaction_id: Mapped[str] = mapped_column(String(100), nullable=True)
     status: Mapped[str] = mapped_column(String(50), default="pending")
+    # debit — списание со счёта (POST /payments/), credit — зачисление (вебхук)
+    direction: Mapped[str] = mapped_column(String(10), default="debit", server_default="debit")
+    # amount — в валюте счёта; fx_rate — курс этой валюты к базовой на момент платежа (app.fx)
+    currency: Mapped[str] = mapped_column(String(3), default=config.BASE_CURRENCY, server_default=config.BASE_CURRENCY)
+    fx_rate: Mapped[float] = mapped_column(Float, default=1.0, server_default="1")
+    # Сумма и валюта перевода, если он был не в валюте счёта
+    original_amount: Mapped[float] = mapped_column(Float, nullable=True)
+    original_currency: Mapped[str] = mapped_column(String(3), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    # Индексы под фильтры поиска (app.search): user_id ведущий для запросов пользователя,
+    # created_at замыкает каждый индекс, чтобы диапазон дат и сортировка шли по индексу
+    __table_args__ = (
+        Index("ix_payments_user_created", "user_id", "created_at"),
+        Index("ix_payments_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_payments_user_account_created", "user_id", "account_id", "created_at"),
+        Index("ix_payments_recipient_created", "recipient_email", "created_at"),
+        Index("ix_payments_transaction", "transaction_id"),
+        Index("ix_payments_created", "created_at"),
+        # Очередь проведения (app.settlement): частичный индекс содержит только платежи pending
+        Index(
+            "ix_payments_pending", "id",
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'")
+        ),
+    )
+
+# Версии курсов валют (app.fx), в основной базе: действующая — с наибольшим version
+class FxRate(Base):
+    __tablename__ = "fx_rates"
+    
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    currency: Mapped[str] = mapped_column(String(3), primary_key=True)
+    rate: Mapped[float] = mapped_column(Float, nullable=False)  # Единиц базовой валюты за единицу валюты
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class ArchivedTransaction(Base):
+    # transaction_id платежей, перенесённых в архив (app.archive): проверка дублей в вебхуке
+    # остаётся одним индексным поиском в шарде, без открытия архивных файлов
+    __tablename__ = "archived_transactions"
+    
+    transaction_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+class WebhookTransaction(Base):
+    # transaction_id зачисленных вебхуков, только в основной базе: первичный ключ не даёт
+    # зачислить один transaction_id пользователям из разных шардов (app.routes.webhook)
+    __tablename__ = "webhook_transactions"
+    
+    transaction_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# Агрегаты платежей для /admin/stats (app.rollups): обновляются в транзакции платежа
+class DailyPaymentStats(Base):
+    __tablename__ = "payment_stats_daily"
+    
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    direction: Mapped[str] = mapped_column(String(10), primary_key=True)
+    status: Mapped[str] = mapped_column(String(50), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    volume: Mapped[float] = mapped_column(Float, default=0.0)
+
+class UserPaymentStats(Base):
+    __tablename__ = "payment_stats_users"
+    
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    direction: Mapped[str] = mapped_column(String(10), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    volume: Mapped[float] = mapped_column(Float, default=0.0)
+
+class RecipientPaymentStats(Base):
+    # Только списания: получатели исходящих платежей
+    __tablename__ = "payment_stats_recipients"
+    
+    recipient_email: Mapped[str] = mapped_column(String(120), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    volume: Mapped[float] = mapped_column(Float, default=0.0)
+
+# Состояние сверки балансов (app.reconciliation): сумма учтённых платежей по счёту
+# и последний обработанный Payment.id шарда
+class AccountReconciliation(Base):
+    __tablename__ = "account_reconciliation"
+    
+    account_id: Mapped[int] = mapped_column(ID, primary_key=True)
+    net: Mapped[float] = mapped_column(Float, default=0.0)
+
+class ReconciliationState(Base):
+    __tablename__ = "reconciliation_state"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    high_water_id: Mapped[int] = mapped_column(ID, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# Двойная запись (app.ledger): у каждой проводки две ноги с общим entry_group и суммой 0.
+# Нога клиента — account_id счёта и ledger_account "customer", встречная нога — account_id
+# NULL и клиринговый счёт ("clearing:outgoing", "clearing:incoming", "equity:opening")
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    entry_group: Mapped[str] = mapped_column(String(36), nullable=False)
+    ledger_account: Mapped[str] = mapped_column(String(50), nullable=False)
+    account_id: Mapped[int] = mapped_column(ID, nullable=True)
+    payment_id: Mapped[int] = mapped_column(ID, nullable=True)
+    kind: Mapped[str] = mapped_column(String(10), nullable=False)  # opening, debit, credit
+    amount: Mapped[float] = mapped_column(Float, nullable=False)  # > 0 увеличивает баланс ноги
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ledger_entries_account_created", "account_id", "created_at", "id"),
+        Index("ix_ledger_entries_group", "entry_group"),
+    )
+
+class BalanceSnapshot(Base):
+    # Баланс счёта с учётом всех проводок до last_entry_id включительно
+    __tablename__ = "balance_snapshots"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    account_id: Mapped[int] = mapped_column(ID, nullable=False)
+    as_of: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # created_at проводки last_entry_id
+    balance: Mapped[float] = mapped_column(Float, nullable=False)
+    last_entry_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_balance_snapshots_account_as_of", "account_id", "as_of"),
+    )
+
+class LedgerState(Base):
+    __tablename__ = "ledger_state"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    snapshot_high_water_id: Mapped[int] = mapped_column(Integer, default=0)
+
+# Исходящие уведомления (app.notifications): строка на событие и адрес получателя,
+# пишется в транзакции платежа и доставляется фоновым диспетчером
+class OutboxEvent(Base):
+    __tablename__ = "notification_outbox"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    event_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    endpoint: Mapped[str] = mapped_column(String(500), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # JSON без подписи
+    status: Mapped[str] = mapped_column(String(20), default="pending")  # pending, delivered, dead
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str] = mapped_column(String(500), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    delivered_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+# Сохранённые ответы на запросы с Idempotency-Key (app.idempotency), в шарде пользователя
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+    
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)  # sha256 метода, пути и тела
+    status: Mapped[int] = mapped_column(Integer, nullable=False)
+    content_type: Mapped[str] = mapped_column(String(100), nullable=True)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires", "expires_at"),
+    )
+
+# Последний выданный id счетов и платежей шарда (app.sharding): строка на таблицу,
+# увеличивается в транзакции, которая вставляет строки
+class IdSequence(Base):
+    __tablename__ = "id_sequences"
+    
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    last_id: Mapped[int] = mapped_column(ID, nullable=False)
+
+# Перенос пользователя в этот шард (python -m app.sharding rebalance), скопированный, но ещё
+# не удалённый из исходного шарда: после сбоя перебалансировка дочищает исходный шард
+class ShardMove(Base):
+    __tablename__ = "shard_moves"
+    
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    source_shard: Mapped[int] = mapped_column(Integer, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
\ No newline at end of file
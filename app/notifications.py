@@ -0,0 +1,183 @@
+"""Исходящие уведомления о платежах (transactional outbox).
+
+create_payment и вебхук пишут событие в notification_outbox шарда в той же
+транзакции, что и платёж, — по строке на каждый адрес из NOTIFY_WEBHOOK_URLS.
+Фоновый диспетчер раз в NOTIFY_POLL_INTERVAL_S секунд забирает готовые к
+отправке строки, группирует их по адресу в пачки до NOTIFY_BATCH_SIZE и
+отправляет пачки параллельно (не больше NOTIFY_WORKERS одновременно) через одну
+aiohttp.ClientSession с ограничением NOTIFY_CONNECTIONS_PER_HOST соединений на
+хост.
+
+Тело запроса — {"events": [...]}; каждое событие — плоский словарь с полем
+signature, которое проверяется так же, как входящий вебхук
+(app.auth.verify_webhook_signature) с секретом NOTIFY_WEBHOOK_SECRET. Доставка
+«хотя бы один раз»: получатель отбрасывает повторы по event_id.
+
+Ответ не 2xx или ошибка сети — повтор через случайную задержку от 0 до
+min(NOTIFY_BACKOFF_MAX_S, NOTIFY_BACKOFF_BASE_S * 2^попытки) (full jitter);
+после NOTIFY_MAX_ATTEMPTS попыток строка получает статус dead (очередь
+недоставленных, см. /admin/notifications).
+"""
+import asyncio
+import json
+import random
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, func, update
+from sqlalchemy.future import select
+from app.auth import compute_webhook_signature
+from app.config import config
+from app.models import Payment, OutboxEvent
+from app.sharding import shards
+
+def payment_event(payment: Payment) -> dict:
+    from app.settlement import payment_data  # app.settlement импортирует этот модуль
+    # Те же поля, что в ответах API, но id платежа в уведомлении — payment_id
+    data = payment_data(payment)
+    return {"payment_id": data.pop("id"), **data}
+
+def enqueue(session, event_type: str, data: dict, endpoints: list = None):
+    """Добавляет событие в outbox; вызывается в транзакции, которая создаёт платёж"""
+    event_id = str(uuid.uuid4())
+    payload = json.dumps({"event_id": event_id, "event_type": event_type, **data})
+    session.add_all(
+        OutboxEvent(event_id=event_id, event_type=event_type, endpoint=endpoint, payload=payload)
+        for endpoint in (config.NOTIFY_WEBHOOK_URLS if endpoints is None else endpoints)
+    )
+
+def sign(event: dict) -> dict:
+    return {**event, "signature": compute_webhook_signature(event, config.NOTIFY_WEBHOOK_SECRET)}
+
+def backoff_delay(attempts: int) -> float:
+    # Full jitter: повторы разных строк не приходят к получателю одной волной
+    return random.uniform(0, min(config.NOTIFY_BACKOFF_MAX_S, config.NOTIFY_BACKOFF_BASE_S * 2 ** attempts))
+
+DUE_EVENTS = select(OutboxEvent).where(
+    OutboxEvent.status == "pending",
+    OutboxEvent.next_attempt_at <= bindparam("now")
+).order_by(OutboxEvent.next_attempt_at, OutboxEvent.id).limit(bindparam("limit"))
+
+MARK_DELIVERED = update(OutboxEvent).where(OutboxEvent.id.in_(bindparam("ids", expanding=True))).values(
+    status="delivered", delivered_at=bindparam("now"), attempts=OutboxEvent.attempts + 1, last_error=None
+)
+
+# Через таблицу, а не модель: executemany с WHERE по bindparam, без ORM bulk update по ключу
+outbox = OutboxEvent.__table__
+MARK_FAILED = update(outbox).where(outbox.c.id == bindparam("row_id")).values(
+    status=bindparam("new_status"),
+    attempts=bindparam("new_attempts"),
+    next_attempt_at=bindparam("retry_at"),
+    last_error=bindparam("error")
+)
+
+STATUS_COUNTS = select(OutboxEvent.status, func.count()).group_by(OutboxEvent.status)
+DEAD_EVENTS = select(OutboxEvent).where(OutboxEvent.status == "dead").order_by(OutboxEvent.id.desc())
+REQUEUE_DEAD = update(OutboxEvent).where(OutboxEvent.status == "dead").values(
+    status="pending", attempts=0, next_attempt_at=bindparam("now"), last_error=None
+)
+
+class Dispatcher:
+    """Доставка outbox всех шардов через одну HTTP-сессию"""
+
+    def __init__(self):
+        self.http = None
+        self.workers = asyncio.Semaphore(config.NOTIFY_WORKERS)
+
+    async def __aenter__(self):
+        import aiohttp  # aiohttp нужен только диспетчеру, не запуску API
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.NOTIFY_WORKERS * 4, limit_per_host=config.NOTIFY_CONNECTIONS_PER_HOST),
+            timeout=aiohttp.ClientTimeout(total=config.NOTIFY_TIMEOUT_S),
+            raise_for_status=True
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.http.close()
+
+    async def _post(self, endpoint: str, rows: list):
+        """Отправляет пачку; возвращает текст ошибки или None"""
+        body = {"events": [sign(json.loads(row.payload)) for row in rows]}
+        async with self.workers:
+            try:
+                async with self.http.post(endpoint, json=body) as response:
+                    await response.read()
+                return None
+            except Exception as e:
+                return f"{type(e).__name__}: {e}"[:500]
+
+    async def deliver_shard(self, shard) -> dict:
+        now = datetime.utcnow()
+        async with shard.ReadSession() as session:
+            due = (await session.execute(
+                DUE_EVENTS, {"now": now, "limit": config.NOTIFY_BATCH_SIZE * config.NOTIFY_WORKERS}
+            )).scalars().all()
+        if not due:
+            return {"delivered": 0, "failed": 0, "dead": 0}
+
+        by_endpoint = defaultdict(list)
+        for row in due:
+            by_endpoint[row.endpoint].append(row)
+        batches = [
+            rows[start:start + config.NOTIFY_BATCH_SIZE]
+            for rows in by_endpoint.values()
+            for start in range(0, len(rows), config.NOTIFY_BATCH_SIZE)
+        ]
+        errors = await asyncio.gather(*(self._post(rows[0].endpoint, rows) for rows in batches))
+
+        delivered, failed = [], []
+        for rows, error in zip(batches, errors):
+            if error is None:
+                delivered.extend(row.id for row in rows)
+            else:
+                print(f"⚠️ Notification delivery to {rows[0].endpoint} failed: {error}")
+                now = datetime.utcnow()
+                for row in rows:
+                    attempts = row.attempts + 1
+                    failed.append({
+                        "row_id": row.id,
+                        "new_status": "dead" if attempts >= config.NOTIFY_MAX_ATTEMPTS else "pending",
+                        "new_attempts": attempts,
+                        "retry_at": now + timedelta(seconds=backoff_delay(attempts)),
+                        "error": error
+                    })
+
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                if delivered:
+                    await session.execute(MARK_DELIVERED, {"ids": delivered, "now": datetime.utcnow()})
+                if failed:
+                    await session.execute(MARK_FAILED, failed)
+        dead = sum(1 for row in failed if row["new_status"] == "dead")
+        if dead:
+            print(f"❌ {dead} notifications moved to the dead-letter queue (shard {shard.index})")
+        return {"delivered": len(delivered), "failed": len(failed), "dead": dead}
+
+    async def prune(self, shard):
+        # Доставленные строки нужны только для разбора инцидентов
+        cutoff = datetime.utcnow() - timedelta(days=config.NOTIFY_RETENTION_DAYS)
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(OutboxEvent).where(OutboxEvent.status == "delivered", OutboxEvent.delivered_at < cutoff)
+                )
+
+async def delivery_loop():
+    async with Dispatcher() as dispatcher:
+        last_prune = datetime.min
+        while True:
+            try:
+                for shard in shards:
+                    # Полная выборка — в очереди есть ещё строки, следующая забирается без паузы
+                    while True:
+                        result = await dispatcher.deliver_shard(shard)
+                        if result["delivered"] + result["failed"] < config.NOTIFY_BATCH_SIZE * config.NOTIFY_WORKERS:
+                            break
+                if datetime.utcnow() - last_prune > timedelta(hours=1):
+                    for shard in shards:
+                        await dispatcher.prune(shard)
+                    last_prune = datetime.utcnow()
+            except Exception as e:
+                print(f"❌ Notification delivery failed: {str(e)}")
+            await asyncio.sleep(config.NOTIFY_POLL_INTERVAL_S)
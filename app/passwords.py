@@ -0,0 +1,144 @@
+"""Хэширование паролей и калибровка его стоимости под задержку входа.
+
+Модуль импортирует только app.config, а passlib — при первом хэше: его функции
+выполняются в пуле процессов (app.provisioning), и процессы пула не загружают
+SQLAlchemy и Sanic.
+
+Команда измеряет время хэша на этой машине для растущей стоимости и выбирает
+наибольшую, при которой медиана укладывается в --target-ms; результат
+записывается в .env (BCRYPT_ROUNDS или PBKDF2_ROUNDS, с --scheme — ещё и
+PASSWORD_SCHEME):
+
+    python -m app.passwords calibrate --target-ms 250
+    python -m app.passwords calibrate --scheme pbkdf2_sha256 --dry-run
+
+Менять стоимость можно без сброса паролей: при следующем входе хэш, не
+совпадающий с политикой, пересчитывается в фоне (app.auth.authenticate_user).
+Калибровать стоит на машине того же типа, что и серверы API, при обычной
+нагрузке; бюджет CPU на вход — время хэша × ADMISSION_AUTH_LIMIT параллельных
+входов.
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from functools import lru_cache
+from app.config import config
+
+# Схемы, хэши которых принимаются при входе; новые пароли хэшируются PASSWORD_SCHEME
+PASSWORD_SCHEMES = ("bcrypt", "pbkdf2_sha256")
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    # Стоимость задаётся точно (min = max = rounds): хэш другой схемы или с другим
+    # числом раундов — и дороже, и дешевле политики — помечается needs_update
+    return CryptContext(
+        schemes=[config.PASSWORD_SCHEME] + [scheme for scheme in PASSWORD_SCHEMES if scheme != config.PASSWORD_SCHEME],
+        deprecated="auto",
+        bcrypt__rounds=config.BCRYPT_ROUNDS,
+        bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+        bcrypt__max_rounds=config.BCRYPT_ROUNDS,
+        pbkdf2_sha256__rounds=config.PBKDF2_ROUNDS,
+        pbkdf2_sha256__min_rounds=config.PBKDF2_ROUNDS,
+        pbkdf2_sha256__max_rounds=config.PBKDF2_ROUNDS
+    )
+
+def verify_password(plain_password, hashed_password):
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return get_pwd_context().hash(password)
+
+def watch_server(server_pid: int):
+    # Инициализатор процессов пула (app.provisioning): процесс завершается вслед за сервером.
+    # Сервер, убитый без остановки пула (SIGKILL, OOM), иначе оставил бы процессы пула и forkserver навсегда
+    def watch():
+        while True:
+            time.sleep(1)
+            try:
+                os.kill(server_pid, 0)
+            except ProcessLookupError:
+                os._exit(0)
+    threading.Thread(target=watch, name="watch_server", daemon=True).start()
+
+def hash_passwords(passwords: list) -> list:
+    # Выполняется в пуле процессов (app.provisioning): одна задача — пачка паролей
+    pwd_context = get_pwd_context()
+    return [pwd_context.hash(password) for password in passwords]
+
+SAMPLE_PASSWORD = "calibration-password"
+
+# Переменная окружения со стоимостью и её пределы для каждой схемы
+COST_SETTINGS = {
+    "bcrypt": ("BCRYPT_ROUNDS", 4, 20),
+    "pbkdf2_sha256": ("PBKDF2_ROUNDS", 1000, 10_000_000),
+}
+
+def measure(scheme: str, rounds: int, samples: int) -> float:
+    """Медиана времени одного хэша, секунды"""
+    from passlib.registry import get_crypt_handler
+    handler = get_crypt_handler(scheme).using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash(SAMPLE_PASSWORD)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def calibrate_bcrypt(target: float, samples: int) -> tuple:
+    # Стоимость bcrypt — log2 числа раундов: каждый шаг вдвое дороже, перебор короткий
+    _, low, high = COST_SETTINGS["bcrypt"]
+    best = None
+    for rounds in range(low, high + 1):
+        elapsed = measure("bcrypt", rounds, samples)
+        print(f"🔍 bcrypt rounds={rounds}: {elapsed * 1000:.1f} ms")
+        if elapsed > target:
+            break
+        best = (rounds, elapsed)
+    # Даже минимальная стоимость не укладывается в бюджет — остаётся минимальная
+    return best or (rounds, elapsed)
+
+def calibrate_pbkdf2(target: float, samples: int) -> tuple:
+    # Время PBKDF2 линейно по раундам: одно измерение, оценка и проверка оценки
+    _, low, high = COST_SETTINGS["pbkdf2_sha256"]
+    base = 10000
+    elapsed = measure("pbkdf2_sha256", base, samples)
+    print(f"🔍 pbkdf2_sha256 rounds={base}: {elapsed * 1000:.1f} ms")
+    rounds = min(high, max(low, int(base * target / elapsed) // 1000 * 1000))
+    elapsed = measure("pbkdf2_sha256", rounds, samples)
+    print(f"🔍 pbkdf2_sha256 rounds={rounds}: {elapsed * 1000:.1f} ms")
+    return rounds, elapsed
+
+def write_env(path: str, values: dict):
+    from dotenv import set_key
+    for key, value in values.items():
+        set_key(path, key, str(value), quote_mode="never")
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API password hashing")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subcommands.add_parser("calibrate", help="pick the hash cost for a target login latency")
+    calibrate_parser.add_argument("--target-ms", type=float, default=250, help="hash time budget per login")
+    calibrate_parser.add_argument("--scheme", choices=PASSWORD_SCHEMES, help="also switch PASSWORD_SCHEME")
+    calibrate_parser.add_argument("--samples", type=int, default=5, help="hashes per measurement")
+    calibrate_parser.add_argument("--env-file", default=".env", help="file to write the settings to")
+    calibrate_parser.add_argument("--dry-run", action="store_true", help="only print the chosen cost")
+    args = parser.parse_args()
+    if args.command == "calibrate":
+        scheme = args.scheme or config.PASSWORD_SCHEME
+        calibrate = calibrate_bcrypt if scheme == "bcrypt" else calibrate_pbkdf2
+        measure(scheme, COST_SETTINGS[scheme][1], 1)  # Первый хэш загружает бэкенд passlib и в замер не входит
+        rounds, elapsed = calibrate(args.target_ms / 1000, args.samples)
+        values = {COST_SETTINGS[scheme][0]: rounds}
+        if args.scheme:
+            values["PASSWORD_SCHEME"] = scheme
+        print(f"✅ {scheme}: rounds={rounds}, {elapsed * 1000:.1f} ms per hash (target {args.target_ms:.0f} ms)")
+        if args.dry_run:
+            return
+        write_env(args.env_file, values)
+        print(f"✅ Written to {args.env_file}: {values}; restart the API to apply")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
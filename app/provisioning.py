@@ -0,0 +1,236 @@
+"""Массовое создание пользователей (POST /admin/users/bulk).
+
+Тело — JSON-массив объектов BulkUserCreate или CSV (Content-Type: text/csv) с
+заголовком email,full_name,password[,opening_balance], не больше
+BULK_USERS_MAX_ROWS строк. Порядок работы:
+
+1. Каждая строка проверяется схемой; неверные строки и повторы email внутри
+   пачки получают статус invalid / duplicate, остальные идут дальше.
+2. Уже занятые email находятся одним запросом IN по всей пачке (exists).
+3. Пароли хэшируются bcrypt в пуле из BULK_HASH_WORKERS процессов: хэш
+   занимает сотни миллисекунд CPU и в цикле событий остановил бы все запросы.
+   Тот же пул проверяет и перехэширует пароли при входе (app.auth); он
+   запускается при прогреве (app.warmup) и закрывается при остановке сервера.
+4. Пользователи вставляются в основную базу пачками по BULK_USERS_CHUNK_SIZE,
+   каждая пачка — своя транзакция, поэтому единственное соединение записи не
+   занято на всё время импорта. Если email заняли параллельно, пачка
+   повторяется без конфликтующих строк.
+5. Строкам с opening_balance открывается счёт в шарде пользователя с проводкой
+   открытия (app.ledger), тоже пачками.
+
+Ответ — статус каждой строки по её номеру и пропускная способность. Время
+ответа определяется хэшированием: при стоимости bcrypt по умолчанию и 8 ядрах
+10 000 строк — около минуты, для таких пачек RESPONSE_TIMEOUT нужно увеличить.
+"""
+import asyncio
+import csv
+import io
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pydantic import ValidationError
+from sanic.exceptions import SanicException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from app import database, ledger
+from app.passwords import hash_passwords, watch_server
+from app.config import config
+from app.models import User, Account
+from app.schemas import BulkUserCreate
+from app.sharding import shard_for
+
+_hash_pool = None
+
+def get_hash_pool() -> ProcessPoolExecutor:
+    # Процессы запускаются через forkserver, а не fork: копия процесса сервера унаследовала бы
+    # слушающий сокет и потоки aiosqlite. Сервер forkserver заранее импортирует app.passwords
+    global _hash_pool
+    if _hash_pool is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["app.passwords", "passlib.context"])
+        _hash_pool = ProcessPoolExecutor(
+            max_workers=config.BULK_HASH_WORKERS,
+            mp_context=context,
+            initializer=watch_server,
+            initargs=(os.getpid(),)
+        )
+    return _hash_pool
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(cancel_futures=True)
+        _hash_pool = None
+
+def parse_rows(request) -> list:
+    """Строки запроса как словари: JSON-массив или CSV с заголовком"""
+    if (request.content_type or "").startswith("text/csv"):
+        try:
+            reader = csv.DictReader(io.StringIO(request.body.decode("utf-8-sig")))
+            # Пустая ячейка opening_balance — счёт не нужен
+            rows = [{key: value for key, value in row.items() if key and value != ""} for row in reader]
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise SanicException(f"Invalid CSV: {str(e)}", status_code=400)
+    else:
+        rows = request.json
+        if not isinstance(rows, list):
+            raise SanicException("Expected a JSON array of users or a text/csv body", status_code=400)
+    if not rows:
+        raise SanicException("No users to create", status_code=400)
+    if len(rows) > config.BULK_USERS_MAX_ROWS:
+        raise SanicException(f"Too many users: {len(rows)} > {config.BULK_USERS_MAX_ROWS}", status_code=413)
+    return rows
+
+def validate(rows: list, results: list) -> list:
+    """Проверенные строки (номер, BulkUserCreate); ошибки и повторы — сразу в results"""
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = {"row": index, "status": "invalid", "error": "row must be an object"}
+            continue
+        try:
+            user = BulkUserCreate(**row)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[index] = {"row": index, "status": "invalid", "error": error}
+            continue
+        if user.email in seen:
+            results[index] = {"row": index, "email": user.email, "status": "duplicate"}
+            continue
+        seen.add(user.email)
+        valid.append((index, user))
+    return valid
+
+async def existing_emails(emails: list) -> set:
+    # Один запрос IN на всю пачку; BULK_USERS_MAX_ROWS держит число параметров в пределах SQLite
+    async with database.ReadSession() as session:
+        result = await session.execute(select(User.email).where(User.email.in_(emails)))
+        return set(result.scalars())
+
+async def hash_all(passwords: list) -> list:
+    """Хэши в исходном порядке; пароли режутся на пачки, чтобы не гонять каждый через IPC отдельно"""
+    if not passwords:
+        return []
+    loop = asyncio.get_running_loop()
+    pool = get_hash_pool()
+    # По несколько пачек на процесс: медленная пачка не оставляет остальные процессы без работы
+    size = max(1, -(-len(passwords) // (config.BULK_HASH_WORKERS * 4)))
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(pool, hash_passwords, passwords[start:start + size])
+        for start in range(0, len(passwords), size)
+    ))
+    return [hashed for chunk in chunks for hashed in chunk]
+
+async def insert_users(rows: list, results: list) -> list:
+    """Вставляет (номер, схема, хэш) пачками; возвращает [(номер, схема, User)]"""
+    created = []
+    for start in range(0, len(rows), config.BULK_USERS_CHUNK_SIZE):
+        chunk = rows[start:start + config.BULK_USERS_CHUNK_SIZE]
+        while chunk:
+            now = datetime.utcnow()
+            users = [
+                User(
+                    email=data.email,
+                    full_name=data.full_name,
+                    hashed_password=hashed,
+                    is_active=True,
+                    is_admin=False,
+                    created_at=now
+                )
+                for _, data, hashed in chunk
+            ]
+            try:
+                async with database.WriteSession() as session:
+                    async with session.begin():
+                        session.add_all(users)
+            except IntegrityError:
+                # Кто-то создал пользователя с тем же email после проверки: убираем такие строки и повторяем
+                taken = await existing_emails([data.email for _, data, _ in chunk])
+                conflicts = [row for row in chunk if row[1].email in taken]
+                if not conflicts:
+                    raise
+                for index, data, _ in conflicts:
+                    results[index] = {"row": index, "email": data.email, "status": "exists"}
+                chunk = [row for row in chunk if row[1].email not in taken]
+                continue
+            created.extend((index, data, user) for (index, data, _), user in zip(chunk, users))
+            break
+    return created
+
+async def open_accounts(created: list) -> dict:
+    """Счета с начальным балансом в шардах пользователей; возвращает номер строки -> Account"""
+    by_shard = defaultdict(list)
+    for index, data, user in created:
+        if data.opening_balance is not None:
+            by_shard[shard_for(user.id)].append((index, data, user))
+    accounts = {}
+    for shard, rows in by_shard.items():
+        for start in range(0, len(rows), config.BULK_USERS_CHUNK_SIZE):
+            chunk = rows[start:start + config.BULK_USERS_CHUNK_SIZE]
+            now = datetime.utcnow()
+            chunk_accounts = [
+                Account(user_id=user.id, balance=data.opening_balance, opening_balance=data.opening_balance, created_at=now)
+                for _, data, user in chunk
+            ]
+            async with shard.WriteSession() as session:
+                async with session.begin():
+                    session.add_all(chunk_accounts)
+                    await ledger.open_accounts(session, chunk_accounts)
+            accounts.update((index, account) for (index, _, _), account in zip(chunk, chunk_accounts))
+    return accounts
+
+async def create_users(request) -> dict:
+    started = time.perf_counter()
+    rows = parse_rows(request)
+    results = [None] * len(rows)
+
+    valid = validate(rows, results)
+    taken = await existing_emails([data.email for _, data in valid]) if valid else set()
+    fresh = []
+    for index, data in valid:
+        if data.email in taken:
+            results[index] = {"row": index, "email": data.email, "status": "exists"}
+        else:
+            fresh.append((index, data))
+
+    hash_started = time.perf_counter()
+    hashes = await hash_all([data.password for _, data in fresh])
+    hash_elapsed = time.perf_counter() - hash_started
+
+    created = await insert_users([(index, data, hashed) for (index, data), hashed in zip(fresh, hashes)], results)
+    try:
+        accounts = await open_accounts(created)
+    except Exception as e:
+        # Пользователи уже сохранены: ошибка счетов не должна выдавать их за несозданных
+        print(f"❌ Bulk account creation failed: {str(e)}")
+        accounts = None
+    for index, data, user in created:
+        result = {"row": index, "email": user.email, "status": "created", "id": user.id}
+        if data.opening_balance is not None:
+            if accounts is None:
+                result["account_error"] = "account was not created"
+            else:
+                result["account_id"] = accounts[index].id
+        results[index] = result
+
+    elapsed = time.perf_counter() - started
+    counts = defaultdict(int)
+    for result in results:
+        counts[result["status"]] += 1
+    print(f"✅ Bulk users: {dict(counts)} in {elapsed:.2f}s")
+    return {
+        "total": len(rows),
+        "created": counts["created"],
+        "exists": counts["exists"],
+        "duplicate": counts["duplicate"],
+        "invalid": counts["invalid"],
+        "accounts_created": len(accounts or {}),
+        "elapsed_s": round(elapsed, 3),
+        "hashing_s": round(hash_elapsed, 3),
+        "users_per_s": round(counts["created"] / elapsed, 1) if elapsed > 0 else None,
+        "results": results
+    }
\ No newline at end of file
@@ -0,0 +1,118 @@
+from collections import Counter
+from sqlalchemy import bindparam, case, delete, event, func, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.future import select
+from app.models import (
+    User, Account, Payment, ArchivedTransaction, WebhookTransaction,
+    DailyPaymentStats, UserPaymentStats, RecipientPaymentStats
+)
+
+# Горячие запросы строятся один раз при импорте. Значения передаются через именованные
+# bind-параметры: session.execute(USER_BY_ID, {"user_id": 1}). Ключ кэша у готового
+# выражения мемоизирован, поэтому на запрос не тратится ни построение select(), ни
+# вычисление ключа, а скомпилированный SQL всегда берётся из кэша движка
+USER_BY_ID = select(User).where(User.id == bindparam("user_id"))
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+ALL_USERS = select(User)
+# Перехэширование пароля при входе: не перезаписывает пароль, сменённый после проверки
+UPDATE_PASSWORD_HASH = update(User).where(
+    User.id == bindparam("user_id"),
+    User.hashed_password == bindparam("old_hash")
+).values(hashed_password=bindparam("new_hash"))
+
+ACCOUNT_BY_ID = select(Account).where(Account.id == bindparam("account_id"))
+ACCOUNTS_BY_USER = select(Account).where(Account.user_id == bindparam("user_id"))
+ACCOUNT_BY_ID_AND_USER = select(Account).where(
+    Account.id == bindparam("account_id"),
+    Account.user_id == bindparam("user_id")
+)
+
+PAYMENT_BY_ID_AND_USER = select(Payment).where(
+    Payment.id == bindparam("payment_id"),
+    Payment.user_id == bindparam("user_id")
+)
+PAYMENT_BY_TRANSACTION = select(Payment).where(Payment.transaction_id == bindparam("transaction_id"))
+ARCHIVED_TRANSACTION = select(ArchivedTransaction).where(
+    ArchivedTransaction.transaction_id == bindparam("transaction_id")
+)
+DELETE_WEBHOOK_TRANSACTION = delete(WebhookTransaction).where(
+    WebhookTransaction.transaction_id == bindparam("transaction_id")
+)
+
+# Агрегаты /admin/stats (app.rollups): выполняются на каждом шарде, строки суммируются
+STATS_DAILY = select(
+    DailyPaymentStats.day,
+    DailyPaymentStats.direction,
+    func.sum(DailyPaymentStats.count),
+    func.sum(DailyPaymentStats.volume)
+).where(
+    DailyPaymentStats.status == "completed",
+    DailyPaymentStats.day >= bindparam("start"),
+    DailyPaymentStats.day < bindparam("end")
+).group_by(DailyPaymentStats.day, DailyPaymentStats.direction)
+STATS_STATUSES = select(
+    DailyPaymentStats.status,
+    func.sum(DailyPaymentStats.count),
+    func.sum(DailyPaymentStats.volume)
+).group_by(DailyPaymentStats.status)
+STATS_FLOWS = select(
+    DailyPaymentStats.direction,
+    func.sum(DailyPaymentStats.count),
+    func.sum(DailyPaymentStats.volume)
+).where(DailyPaymentStats.status == "completed").group_by(DailyPaymentStats.direction)
+# Пользователь целиком живёт в одном шарде, поэтому топ-N шардов сливается в точный общий топ-N
+STATS_TOP_USERS = select(
+    UserPaymentStats.user_id,
+    func.sum(UserPaymentStats.count),
+    func.sum(UserPaymentStats.volume),
+    func.sum(case((UserPaymentStats.direction == "credit", UserPaymentStats.volume), else_=0.0)),
+    func.sum(case((UserPaymentStats.direction == "debit", UserPaymentStats.volume), else_=0.0))
+).group_by(UserPaymentStats.user_id).order_by(func.sum(UserPaymentStats.volume).desc()).limit(bindparam("limit"))
+# Получатель встречается в нескольких шардах — строки читаются целиком (одна на получателя)
+STATS_RECIPIENTS = select(
+    RecipientPaymentStats.recipient_email,
+    RecipientPaymentStats.count,
+    RecipientPaymentStats.volume
+)
+
+# Запросы с параметрами-заглушками для прогрева кэша (app.warmup): к основной базе
+# и к шардам со счетами и платежами (app.sharding)
+USER_STATEMENTS = [
+    (USER_BY_ID, {"user_id": 0}),
+    (USER_BY_EMAIL, {"email": ""}),
+    (ALL_USERS, {}),
+]
+SHARD_STATEMENTS = [
+    (ACCOUNT_BY_ID, {"account_id": 0}),
+    (ACCOUNTS_BY_USER, {"user_id": 0}),
+    (ACCOUNT_BY_ID_AND_USER, {"account_id": 0, "user_id": 0}),
+    (PAYMENT_BY_TRANSACTION, {"transaction_id": ""}),
+    (ARCHIVED_TRANSACTION, {"transaction_id": ""}),
+]
+
+_cache_counts = Counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _count_compiled_cache_usage(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    if context.cache_hit == CacheStats.CACHE_HIT:
+        _cache_counts["hits"] += 1
+    elif context.cache_hit == CacheStats.CACHE_MISS:
+        _cache_counts["misses"] += 1
+    else:
+        # DDL, PRAGMA, сырой SQL — такие запросы не кэшируются
+        _cache_counts["uncached"] += 1
+
+def get_cache_stats() -> dict:
+    hits, misses = _cache_counts["hits"], _cache_counts["misses"]
+    return {
+        "hits": hits,
+        "misses": misses,
+        "uncached": _cache_counts["uncached"],
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0
+    }
+
+def reset_cache_stats():
+    _cache_counts.clear()
@@ -0,0 +1,243 @@
+"""Сверка балансов счетов с историей платежей.
+
+Ожидаемый баланс счёта = opening_balance + зачисления - списания по
+завершённым платежам (горячая таблица и архив); платежи pending и failed
+баланс не меняют. Резерв счёта (Account.reserved) сверяется с суммой его
+платежей pending, ожидающих проведения (app.settlement). Сумма платежей по каждому
+счёту хранится в account_reconciliation вместе с последним учтённым
+Payment.id (high-water mark) шарда, поэтому инкрементальный прогон читает
+только новые платежи — с id из диапазона шарда; суммы платежей, перенесённых
+из других шардов, переносятся вместе со счётом (moved_net). Платежи читаются
+порциями и группируются NumPy; расхождения ищет SQL-соединение счетов с
+накопленными суммами.
+
+    python -m app.reconciliation            # только новые платежи
+    python -m app.reconciliation --full     # пересчёт всей истории
+
+Код выхода 1, если найдены расхождения.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from sqlalchemy import case, delete, func, or_, update
+from sqlalchemy.future import select
+from app import archive
+from app.models import Account, Payment, AccountReconciliation, ReconciliationState
+from app.rollups import iter_chunks, group_sum, upsert_insert
+from app.sharding import id_range, local_ids, shards
+
+# Расхождение меньше полкопейки считается погрешностью float
+TOLERANCE = 0.005
+DRIFT_REPORT_LIMIT = 100
+
+def signed_amount_columns(columns) -> list:
+    # Зачисление увеличивает баланс, списание уменьшает
+    return [
+        columns.id,
+        columns.account_id,
+        case((columns.direction == "credit", columns.amount), else_=-columns.amount).label("signed_amount")
+    ]
+
+def completed_after(columns, shard_index: int, after_id: int, up_to_id: int = None) -> list:
+    # Только id, выданные шардом: у перенесённых из других шардов id не связаны с его high-water mark
+    conditions = [columns.status == "completed", local_ids(columns.id, shard_index), columns.id > after_id]
+    if up_to_id is not None:
+        conditions.append(columns.id <= up_to_id)
+    return conditions
+
+async def local_high_water(session, shard_index: int) -> int:
+    start, _ = id_range(shard_index)
+    return (await session.execute(
+        select(func.max(Payment.id)).where(local_ids(Payment.id, shard_index))
+    )).scalar() or start
+
+async def sum_by_account(executor, columns, conditions, totals: dict) -> int:
+    """Добавляет в totals суммы платежей по счетам; возвращает число прочитанных платежей"""
+    import numpy as np  # NumPy нужен только сверке, не запуску API
+    processed = 0
+    async for rows in iter_chunks(executor, signed_amount_columns(columns), conditions):
+        _, account_ids, amounts = zip(*rows)
+        grouped = group_sum([np.asarray(account_ids)], np.asarray(amounts, dtype=np.float64))
+        for (account_id,), (_, net) in grouped.items():
+            totals[account_id] = totals.get(account_id, 0.0) + net
+        processed += len(rows)
+    return processed
+
+EXPECTED_NET = func.coalesce(AccountReconciliation.net, 0.0)
+DRIFT = select(
+    Account.id,
+    Account.user_id,
+    Account.balance,
+    (Account.opening_balance + EXPECTED_NET).label("expected")
+).outerjoin(
+    AccountReconciliation, AccountReconciliation.account_id == Account.id
+).where(
+    Account.opening_balance.is_not(None),
+    func.abs(Account.balance - Account.opening_balance - EXPECTED_NET) > TOLERANCE
+).order_by(Account.id)
+DRIFT_COUNT = select(func.count()).select_from(DRIFT.order_by(None).subquery())
+
+PENDING_BY_ACCOUNT = select(
+    Payment.account_id,
+    func.sum(Payment.amount).label("pending")
+).where(Payment.status == "pending", Payment.direction == "debit").group_by(Payment.account_id).subquery()
+EXPECTED_RESERVED = func.coalesce(PENDING_BY_ACCOUNT.c.pending, 0.0)
+RESERVED_DRIFT = select(
+    Account.id,
+    Account.user_id,
+    Account.reserved,
+    EXPECTED_RESERVED.label("expected")
+).outerjoin(
+    PENDING_BY_ACCOUNT, PENDING_BY_ACCOUNT.c.account_id == Account.id
+).where(
+    func.abs(Account.reserved - EXPECTED_RESERVED) > TOLERANCE
+).order_by(Account.id)
+
+async def reconcile_shard(shard, full: bool = False) -> dict:
+    async with archive.compaction_lock:
+        # Один снимок WAL на всё чтение: порции видят одно и то же состояние таблицы
+        async with shard.ReadSession() as session:
+            async with session.begin():
+                state = await session.get(ReconciliationState, 1)
+                # Первый прогон шарда — всегда полный
+                full = full or state is None
+                start, _ = id_range(shard.index)
+                after_id = start if full else max(state.high_water_id, start)
+                high_water = await local_high_water(session, shard.index)
+                if full:
+                    # Все платежи, кроме собственных выше high-water mark: их дочитает соединение записи
+                    conditions = [
+                        Payment.status == "completed",
+                        or_(~local_ids(Payment.id, shard.index), Payment.id <= high_water)
+                    ]
+                else:
+                    conditions = completed_after(Payment, shard.index, after_id, high_water)
+                totals = {}
+                processed = await sum_by_account(session, Payment, conditions, totals)
+
+        archived = archive.archived_payments.c
+        for month in archive.archived_months():
+            async with archive.engine_for(month).connect() as conn:
+                if full:
+                    # Архив перенесённого пользователя остаётся записанным за прежним шардом, поэтому
+                    # полный прогон читает весь архив и оставляет суммы только по счетам шарда (ниже)
+                    conditions = [archived.status == "completed"]
+                else:
+                    conditions = [archived.shard == shard.index, *completed_after(archived, shard.index, after_id)]
+                processed += await sum_by_account(conn, archived, conditions, totals)
+
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                # Платежи, созданные во время чтения: под единственным соединением записи
+                # новых не появится, поэтому балансы и суммы сравниваются согласованно
+                processed += await sum_by_account(
+                    session, Payment, completed_after(Payment, shard.index, high_water), totals
+                )
+                high_water = await local_high_water(session, shard.index)
+
+                if full:
+                    await session.execute(delete(AccountReconciliation))
+                    account_ids = set((await session.execute(select(Account.id))).scalars().all())
+                    totals = {account_id: net for account_id, net in totals.items() if account_id in account_ids}
+                if totals:
+                    insert_function = upsert_insert(session)
+                    statement = insert_function(AccountReconciliation)
+                    await session.execute(
+                        statement.on_conflict_do_update(
+                            index_elements=["account_id"],
+                            set_={"net": AccountReconciliation.net + statement.excluded.net}
+                        ),
+                        [{"account_id": account_id, "net": net} for account_id, net in totals.items()]
+                    )
+                await session.merge(ReconciliationState(id=1, high_water_id=high_water, updated_at=datetime.utcnow()))
+
+                # Счета, созданные до появления opening_balance: текущий баланс принимается
+                # верным, и точка отсчёта выводится из него
+                baselined = (await session.execute(
+                    update(Account).where(Account.opening_balance.is_(None)).values(
+                        opening_balance=Account.balance - func.coalesce(
+                            select(AccountReconciliation.net)
+                            .where(AccountReconciliation.account_id == Account.id)
+                            .scalar_subquery(),
+                            0.0
+                        )
+                    )
+                )).rowcount
+
+                drift_count = (await session.execute(DRIFT_COUNT)).scalar()
+                drift = (await session.execute(DRIFT.limit(DRIFT_REPORT_LIMIT))).all()
+                reserved_drift = (await session.execute(RESERVED_DRIFT.limit(DRIFT_REPORT_LIMIT))).all()
+
+    report = {
+        "shard": shard.index,
+        "mode": "full" if full else "incremental",
+        "payments_processed": processed,
+        "high_water_id": high_water,
+        "baselined_accounts": baselined,
+        "drift_count": drift_count,
+        "drift": [
+            {
+                "account_id": account_id,
+                "user_id": user_id,
+                "balance": balance,
+                "expected": expected,
+                "difference": round(balance - expected, 6)
+            }
+            for account_id, user_id, balance, expected in drift
+        ],
+        "reserved_drift": [
+            {"account_id": account_id, "user_id": user_id, "reserved": reserved, "expected": expected}
+            for account_id, user_id, reserved, expected in reserved_drift
+        ]
+    }
+    print(f"{'⚠️' if drift_count else '✅'} Reconciled shard {shard.index}: {processed} payments, {drift_count} drifted accounts")
+    if reserved_drift:
+        print(f"⚠️ Shard {shard.index}: {len(reserved_drift)} accounts with reserved funds not matching pending payments")
+    return report
+
+async def moved_net(session, shard_index: int, user_id: int, payments: list) -> dict:
+    """Суммы по счетам пользователя, переносимого в шард shard_index, которые его инкрементальная
+    сверка не прочитает сама: платежи с id не выше его high-water mark или из чужого диапазона и
+    архив, записанный за другими шардами. Вызывается в транзакции переноса (app.sharding)"""
+    state = await session.get(ReconciliationState, 1)
+    start, end = id_range(shard_index)
+    after_id = max(state.high_water_id, start) if state else start
+
+    def seen_later(payment_shard: int, payment_id: int) -> bool:
+        return payment_shard == shard_index and after_id < payment_id < end
+
+    archived = archive.archived_payments.c
+    rows = [
+        (shard_index, payment.id, payment.account_id, payment.direction, payment.amount)
+        for payment in payments if payment.status == "completed"
+    ]
+    for month in archive.archived_months():
+        async with archive.engine_for(month).connect() as conn:
+            rows += (await conn.execute(
+                select(archived.shard, archived.id, archived.account_id, archived.direction, archived.amount)
+                .where(archived.user_id == user_id, archived.status == "completed")
+            )).all()
+    totals = {}
+    for payment_shard, payment_id, account_id, direction, amount in rows:
+        if not seen_later(payment_shard, payment_id):
+            totals[account_id] = totals.get(account_id, 0.0) + (amount if direction == "credit" else -amount)
+    return totals
+
+async def reconcile(full: bool = False) -> list:
+    return [await reconcile_shard(shard, full) for shard in shards]
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API balance reconciliation")
+    parser.add_argument("--full", action="store_true", help="recompute from the whole payment history")
+    args = parser.parse_args()
+    reports = asyncio.run(reconcile(full=args.full))
+    for report in reports:
+        for row in report["drift"]:
+            print(f"   shard {report['shard']} account {row['account_id']}: balance {row['balance']}, expected {row['expected']}")
+        for row in report["reserved_drift"]:
+            print(f"   shard {report['shard']} account {row['account_id']}: reserved {row['reserved']}, expected {row['expected']}")
+    sys.exit(1 if any(report["drift_count"] or report["reserved_drift"] for report in reports) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Агрегаты платежей для /admin/stats.
+
+Каждый шард хранит агрегаты своих платежей: по дням (с направлением и
+статусом), по пользователям и по получателям списаний. create_payment и
+вебхук обновляют их upsert'ом в той же транзакции, что и платёж; /admin/stats
+суммирует строки агрегатов всех шардов. Объёмы ведутся в BASE_CURRENCY: сумма
+платежа умножается на его курс Payment.fx_rate (app.fx).
+
+Платёж pending в агрегаты не попадает: его учитывает проведение (app.settlement),
+когда статус уже известен. Дневные агрегаты хранят и failed (для
+/admin/stats/statuses), агрегаты пользователей и получателей — только completed.
+
+Полный пересчёт (например, после ручной правки payments) читает горячую
+таблицу и архив шарда порциями и агрегирует их NumPy:
+
+    python -m app.rollups rebuild
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from sqlalchemy import delete, func, insert, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from app import archive
+from app.models import Payment, DailyPaymentStats, UserPaymentStats, RecipientPaymentStats
+from app.sharding import id_range, local_ids, shards
+
+CHUNK_SIZE = 50_000
+
+# Колонки, по которым строятся агрегаты; id первым — по нему идёт постраничное чтение
+PAYMENT_COLUMNS = ("id", "user_id", "amount", "fx_rate", "direction", "status", "recipient_email", "day")
+
+def chunk_columns(columns) -> list:
+    # День берётся строкой date(created_at): разбор DateTime в Python стоит дороже самой агрегации
+    return [
+        columns.id,
+        columns.user_id,
+        columns.amount,
+        columns.fx_rate,
+        columns.direction,
+        columns.status,
+        columns.recipient_email,
+        func.date(columns.created_at).label("day")
+    ]
+
+def upsert_insert(session):
+    return postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+
+def _increment(insert_function, model, keys: dict, count: int, volume: float):
+    statement = insert_function(model).values(**keys, count=count, volume=volume)
+    return statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            "count": model.count + statement.excluded.count,
+            "volume": model.volume + statement.excluded.volume
+        }
+    )
+
+async def record_payment(session, payment: Payment):
+    """Добавляет платёж в агрегаты; вызывается в транзакции, которая создаёт или проводит платёж"""
+    if payment.status == "pending":
+        return
+    insert_function = upsert_insert(session)
+    day = payment.created_at.date()
+    volume = payment.amount * payment.fx_rate
+    await session.execute(_increment(
+        insert_function, DailyPaymentStats,
+        {"day": day, "direction": payment.direction, "status": payment.status}, 1, volume
+    ))
+    if payment.status != "completed":
+        return
+    await session.execute(_increment(
+        insert_function, UserPaymentStats,
+        {"user_id": payment.user_id, "direction": payment.direction}, 1, volume
+    ))
+    if payment.direction == "debit":
+        await session.execute(_increment(
+            insert_function, RecipientPaymentStats,
+            {"recipient_email": payment.recipient_email}, 1, volume
+        ))
+
+# --- пересчёт -----------------------------------------------------------------
+
+async def iter_chunks(executor, columns: list, conditions=(), chunk_size: int = CHUNK_SIZE):
+    """Читает строки порциями по возрастанию первой колонки (id) с keyset-пагинацией:
+    память постоянна, и между порциями не держится открытая транзакция чтения.
+    executor — AsyncSession или AsyncConnection"""
+    id_column = columns[0]
+    last_id = None
+    while True:
+        statement = select(*columns).where(*conditions).order_by(id_column).limit(chunk_size)
+        if last_id is not None:
+            statement = statement.where(id_column > last_id)
+        rows = (await executor.execute(statement)).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+        if len(rows) < chunk_size:
+            return
+
+def to_arrays(rows, names) -> dict:
+    """Строки порции -> колонки NumPy"""
+    import numpy as np  # NumPy нужен только пересчёту, не запуску API
+    columns = dict(zip(names, zip(*rows)))
+    arrays = {name: np.asarray(values) for name, values in columns.items()}
+    # Суммы в базовой валюте по курсу каждого платежа — одним умножением колонок
+    arrays["amount"] = arrays["amount"].astype(np.float64) * arrays.pop("fx_rate").astype(np.float64)
+    arrays["day"] = arrays["day"].astype("datetime64[D]")
+    return arrays
+
+def group_sum(keys: list, amounts) -> dict:
+    """Количество и сумма amounts по составному ключу из нескольких колонок.
+
+    Каждая колонка кодируется np.unique, коды сводятся в один int64 через
+    ravel_multi_index, после чего группировка — один np.unique и два bincount"""
+    import numpy as np
+    uniques, codes = zip(*(np.unique(column, return_inverse=True) for column in keys))
+    shape = tuple(len(values) for values in uniques)
+    groups, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    counts = np.bincount(inverse)
+    volumes = np.bincount(inverse, weights=amounts)
+    return {
+        tuple(values[index].item() for values, index in zip(uniques, key_indexes)): (int(count), float(volume))
+        for *key_indexes, count, volume in zip(*np.unravel_index(groups, shape), counts, volumes)
+    }
+
+class Rollup:
+    """Накопитель агрегатов по порциям"""
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0.0])
+        self.users = defaultdict(lambda: [0, 0.0])
+        self.recipients = defaultdict(lambda: [0, 0.0])
+        self.payments = 0
+
+    @staticmethod
+    def _merge(target, grouped: dict):
+        for key, (count, volume) in grouped.items():
+            target[key][0] += count
+            target[key][1] += volume
+
+    def add(self, arrays: dict):
+        self.payments += len(arrays["amount"])
+        self._merge(self.daily, group_sum([arrays["day"], arrays["direction"], arrays["status"]], arrays["amount"]))
+        completed = arrays["status"] == "completed"
+        if completed.any():
+            self._merge(self.users, group_sum(
+                [arrays["user_id"][completed], arrays["direction"][completed]], arrays["amount"][completed]
+            ))
+        debit = completed & (arrays["direction"] == "debit")
+        if debit.any():
+            self._merge(self.recipients, group_sum([arrays["recipient_email"][debit]], arrays["amount"][debit]))
+
+async def rebuild_shard(shard) -> int:
+    """Пересчитывает агрегаты шарда с нуля; возвращает число учтённых платежей"""
+    rollup = Rollup()
+    payment_columns = chunk_columns(Payment)
+    # Платежи pending попадут в агрегаты при проведении, как и в record_payment
+    settled = Payment.status != "pending"
+    # Сжатие переносит строки между шардом и архивом — на время пересчёта оно остановлено
+    async with archive.compaction_lock:
+        async with shard.ReadSession() as session:
+            # High-water mark — по id, выданным шардом: новые платежи получают только их,
+            # а id платежей, перенесённых из других шардов, могут быть и больше
+            own = local_ids(Payment.id, shard.index)
+            high_water = (await session.execute(select(func.max(Payment.id)).where(own))).scalar() or id_range(shard.index)[0]
+            async for rows in iter_chunks(session, payment_columns, [settled, or_(~own, Payment.id <= high_water)]):
+                rollup.add(to_arrays(rows, PAYMENT_COLUMNS))
+
+        archived_columns = chunk_columns(archive.archived_payments.c)
+        for month in archive.archived_months():
+            async with archive.engine_for(month).connect() as conn:
+                conditions = [
+                    archive.archived_payments.c.shard == shard.index,
+                    archive.archived_payments.c.status != "pending"
+                ]
+                async for rows in iter_chunks(conn, archived_columns, conditions):
+                    rollup.add(to_arrays(rows, PAYMENT_COLUMNS))
+
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                # Платежи, созданные во время чтения, уже учтены в старых агрегатах; под
+                # единственным соединением записи новых не появится, поэтому их можно дочитать
+                async for rows in iter_chunks(session, payment_columns, [settled, own, Payment.id > high_water]):
+                    rollup.add(to_arrays(rows, PAYMENT_COLUMNS))
+                for model in (DailyPaymentStats, UserPaymentStats, RecipientPaymentStats):
+                    await session.execute(delete(model))
+                if rollup.daily:
+                    await session.execute(insert(DailyPaymentStats), [
+                        {"day": day, "direction": direction, "status": status, "count": count, "volume": volume}
+                        for (day, direction, status), (count, volume) in rollup.daily.items()
+                    ])
+                if rollup.users:
+                    await session.execute(insert(UserPaymentStats), [
+                        {"user_id": user_id, "direction": direction, "count": count, "volume": volume}
+                        for (user_id, direction), (count, volume) in rollup.users.items()
+                    ])
+                if rollup.recipients:
+                    await session.execute(insert(RecipientPaymentStats), [
+                        {"recipient_email": email, "count": count, "volume": volume}
+                        for (email,), (count, volume) in rollup.recipients.items()
+                    ])
+    print(f"✅ Rebuilt rollups of shard {shard.index}: {rollup.payments} payments")
+    return rollup.payments
+
+async def rebuild() -> int:
+    total = 0
+    for shard in shards:
+        total += await rebuild_shard(shard)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API payment rollups")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="recompute rollups from payments and the archive")
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        total = asyncio.run(rebuild())
+        print(f"✅ Rollups rebuilt from {total} payments")
+
+if __name__ == "__main__":
+    main()
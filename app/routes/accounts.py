@@ -1,39 +1,82 @@
 from sanic import Blueprint, response
 from sanic.exceptions import SanicException
-from sqlalchemy.future import select
+from app.admission import admit
 from app.models import Account
+from app import fx, ledger, queries
+from app.events import bus
 from app.auth import protected
-from app.schemas import AccountCreate
+from app.config import config
+from app.fx import UnknownCurrency
+from app.idempotency import idempotent
+from app.sharding import shard_for
+from app.schemas import AccountCreate, StatementQuery
+from app.search import parse_filters
 from datetime import datetime
 
 accounts_bp = Blueprint("accounts", url_prefix="/accounts")
 
-@accounts_bp.post("/")
+@accounts_bp.post("/", ctx_db="read")
+@admit("writes")
 @protected()
+@idempotent()
 async def create_account(request):
     try:
         data = AccountCreate(**request.json).dict()
         print(f"🔍 Creating account: {data}")
-        session = request.ctx.session
         user = request.ctx.user  # Используем user из контекста
-        async with session.begin():
-            account = Account(
-                user_id=user.id,
-                balance=data["balance"],
-                created_at=datetime.utcnow()
-            )
-            session.add(account)
-            await session.commit()
-            print(f"✅ Account created: id={account.id}, user_id={user.id}")
-            return response.json(
-                {
+        currency = data["currency"] or config.BASE_CURRENCY
+        fx.table.rate(currency)  # Счёт открывается только в валюте, для которой есть курс
+        # Счёт создаётся в шарде пользователя; сессия запроса только читает основную базу
+        async with shard_for(user.id).WriteSession() as session:
+            async with session.begin():
+                account = Account(
+                    user_id=user.id,
+                    balance=data["balance"],
+                    opening_balance=data["balance"],
+                    currency=currency,
+                    created_at=datetime.utcnow()
+                )
+                session.add(account)
+                await ledger.open_account(session, account)
+                await session.commit()
+                print(f"✅ Account created: id={account.id}, user_id={user.id}")
+                account_data = {
                     "id": account.id,
                     "user_id": account.user_id,
                     "balance": account.balance,
+                    "currency": account.currency,
                     "created_at": account.created_at.isoformat()
-                },
-                status=201
-            )
+                }
+                bus.publish(user.id, "account.created", account_data)
+                return response.json(account_data, status=201)
+    except UnknownCurrency:
+        raise
     except Exception as e:
         print(f"❌ Error in create_account: {str(e)}")
-        raise SanicException(f"Account creation failed: {str(e)}", status_code=500)
\ No newline at end of file
+        raise SanicException(f"Account creation failed: {str(e)}", status_code=500)
+
+@accounts_bp.get("/<account_id:int>/statement", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_statement(request, account_id: int):
+    # Период — ?from=2024-01-01&to=2024-02-01; без from выписка начинается с открытия счёта
+    params = parse_filters(request, StatementQuery)
+    user = request.ctx.user  # Используем user из контекста
+    async with shard_for(user.id).ReadSession() as session:
+        # Один снимок WAL: снимок баланса и проводки читаются согласованно
+        async with session.begin():
+            result = await session.execute(queries.ACCOUNT_BY_ID, {"account_id": account_id})
+            account = result.scalar_one_or_none()
+            if not account:
+                print(f"❌ Account not found: account_id={account_id}")
+                raise SanicException("Account not found", status_code=404)
+            if account.user_id != user.id:
+                print(f"❌ Unauthorized access to account: account_id={account_id}, user_id={user.id}")
+                raise SanicException("Unauthorized", status_code=403)
+            try:
+                statement = await ledger.statement(session, account_id, params.date_from, params.date_to)
+            except Exception as e:
+                print(f"❌ Error in get_statement: {str(e)}")
+                raise SanicException(f"Failed to build statement: {str(e)}", status_code=500)
+    print(f"🔍 Statement for account_id={account_id}: {len(statement['entries'])} entries")
+    return response.json(statement)
\ No newline at end of file
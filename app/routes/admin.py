@@ -1,21 +1,28 @@
+from pydantic import ValidationError
 from sanic import Blueprint, response
 from sanic.exceptions import SanicException
-from sqlalchemy.future import select
-from app.models import User
+from app.admission import admission, admit
+from app.models import User, Payment
+from app import archive, fx, notifications, provisioning, queries, reconciliation, settlement, velocity
+from app.config import config
+from app.events import bus
+from app.sharding import scatter_gather, gather_rows, shards
 from app.auth import protected, get_current_admin_user
-from app.schemas import UserCreate
+from app.schemas import UserCreate, AdminPaymentFilters, FxRatesUpdate, VelocityQuery
+from app.search import parse_filters, search_statement
 from app.auth import get_password_hash
 from datetime import datetime
 
 admin_bp = Blueprint("admin", url_prefix="/admin")
 
-@admin_bp.get("/users")
+@admin_bp.get("/users", ctx_db="read")
+@admit("reads")
 @protected()
 async def get_all_users(request):
     try:
         session = request.ctx.session
         await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
-        result = await session.execute(select(User))
+        result = await session.execute(queries.ALL_USERS)
         users = result.scalars().all()
         print(f"🔍 Retrieved {len(users)} users")
         return response.json(
@@ -35,7 +42,8 @@ async def get_all_users(request):
         print(f"❌ Error in get_all_users: {str(e)}")
         raise SanicException(f"Failed to retrieve users: {str(e)}", status_code=500)
 
-@admin_bp.get("/me")
+@admin_bp.get("/me", ctx_db="read")
+@admit("reads")
 @protected()
 async def get_admin_info(request):
     try:
@@ -55,7 +63,206 @@ async def get_admin_info(request):
         print(f"❌ Error in get_admin_info: {str(e)}")
         raise SanicException(f"Failed to retrieve admin info: {str(e)}", status_code=500)
 
+@admin_bp.get("/query-cache", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_query_cache_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json(queries.get_cache_stats())
+
+# Без @admit: статистика допуска нужна именно под перегрузкой
+@admin_bp.get("/admission", ctx_db="read")
+@protected()
+async def get_admission_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json(admission.stats())
+
+@admin_bp.get("/events", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_event_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json(bus.stats())
+
+@admin_bp.get("/velocity", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_velocity_usage(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, VelocityQuery)
+    if params.account_id is not None and params.user_id is None:
+        # Счётчики счёта ведутся по паре (владелец, счёт)
+        raise SanicException("account_id requires user_id", status_code=400)
+    data = velocity.engine.stats()
+    if params.user_id is not None:
+        data["user"] = {"id": params.user_id, "usage": velocity.engine.usage("user", params.user_id)}
+    if params.account_id is not None:
+        data["account"] = {
+            "id": params.account_id,
+            "user_id": params.user_id,
+            "usage": velocity.engine.usage("account", (params.user_id, params.account_id))
+        }
+    return response.json(data)
+
+@admin_bp.get("/fx-rates", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_fx_rates(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json(fx.table.as_dict())
+
+@admin_bp.put("/fx-rates", ctx_db="read")
+@admit("writes")
+@protected()
+async def update_fx_rates(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    try:
+        data = FxRatesUpdate(**(request.json or {}))
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise SanicException(f"Invalid rates: {errors}", status_code=400)
+    try:
+        table = await fx.save(data.rates)
+    except SanicException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in update_fx_rates: {str(e)}")
+        raise SanicException(f"Failed to update rates: {str(e)}", status_code=500)
+    return response.json(table.as_dict())
+
+@admin_bp.get("/payments", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_all_payments(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    # Фильтры — см. AdminPaymentFilters; без фильтров отдаются последние limit платежей
+    filters = parse_filters(request, AdminPaymentFilters)
+    # Фильтры без индекса отклоняются здесь же с 400
+    statement = search_statement(Payment, filters, filters.user_id, newest_first=True, limit=filters.limit)
+    rates = fx.table  # Одна версия курсов на весь отчёт
+    if filters.convert_to is not None:
+        rates.rate(filters.convert_to)  # Неизвестная валюта отчёта — 400 до запросов к шардам
+    try:
+        # Каждый шард отдаёт не больше limit последних платежей, результаты сливаются по created_at
+        payments = await scatter_gather(
+            statement,
+            key=lambda payment: payment.created_at,
+            reverse=True,
+            limit=filters.limit
+        )
+        if len(payments) < filters.limit:
+            # Горячие шарды исчерпаны — добираем более старые платежи из архива
+            archived = await archive.search(
+                filters, filters.user_id, newest_first=True, limit=filters.limit - len(payments)
+            )
+            payments += [(payment.shard, payment) for payment in archived]
+        print(f"🔍 Retrieved {len(payments)} payments from all shards")
+        items = [{**settlement.payment_data(payment), "shard": shard} for shard, payment in payments]
+        if filters.convert_to is not None:
+            # Выборка в разных валютах переводится целиком: один массив сумм, один массив валют (app.fx)
+            converted = rates.convert_many(
+                [payment.amount for _, payment in payments],
+                [payment.currency for _, payment in payments],
+                filters.convert_to
+            ).round(2).tolist()
+            for item, amount in zip(items, converted):
+                item["converted_amount"] = amount
+                item["converted_currency"] = filters.convert_to
+        return response.json(items)
+    except Exception as e:
+        print(f"❌ Error in get_all_payments: {str(e)}")
+        raise SanicException(f"Failed to retrieve payments: {str(e)}", status_code=500)
+
+@admin_bp.post("/reconcile", ctx_db="read")
+@admit("writes")
+@protected()
+async def reconcile_balances(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    # ?mode=incremental (по умолчанию) — только платежи после прошлой сверки, ?mode=full — вся история
+    mode = request.args.get("mode", "incremental")
+    if mode not in ("incremental", "full"):
+        raise SanicException("mode must be 'incremental' or 'full'", status_code=400)
+    try:
+        reports = await reconciliation.reconcile(full=mode == "full")
+        return response.json(
+            {
+                "drift_count": sum(report["drift_count"] for report in reports),
+                "reserved_drift_count": sum(len(report["reserved_drift"]) for report in reports),
+                "shards": reports
+            }
+        )
+    except Exception as e:
+        print(f"❌ Error in reconcile_balances: {str(e)}")
+        raise SanicException(f"Failed to reconcile balances: {str(e)}", status_code=500)
+
+@admin_bp.get("/notifications", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_notifications(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    try:
+        statuses = {}
+        for status, count in await gather_rows(notifications.STATUS_COUNTS):
+            statuses[status] = statuses.get(status, 0) + count
+        # Очередь недоставленных: последние 100 строк со статусом dead со всех шардов
+        dead = await scatter_gather(notifications.DEAD_EVENTS.limit(100), key=lambda row: row.id, reverse=True, limit=100)
+        return response.json(
+            {
+                "endpoints": config.NOTIFY_WEBHOOK_URLS,
+                "statuses": statuses,
+                "dead": [
+                    {
+                        "shard": shard,
+                        "id": row.id,
+                        "event_id": row.event_id,
+                        "event_type": row.event_type,
+                        "endpoint": row.endpoint,
+                        "attempts": row.attempts,
+                        "last_error": row.last_error,
+                        "created_at": row.created_at.isoformat()
+                    }
+                    for shard, row in dead
+                ]
+            }
+        )
+    except Exception as e:
+        print(f"❌ Error in get_notifications: {str(e)}")
+        raise SanicException(f"Failed to retrieve notifications: {str(e)}", status_code=500)
+
+@admin_bp.post("/notifications/requeue", ctx_db="read")
+@admit("writes")
+@protected()
+async def requeue_notifications(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    try:
+        requeued = 0
+        for shard in shards:
+            async with shard.WriteSession() as session:
+                async with session.begin():
+                    result = await session.execute(notifications.REQUEUE_DEAD, {"now": datetime.utcnow()})
+                    requeued += result.rowcount
+        print(f"✅ Requeued {requeued} dead notifications")
+        return response.json({"status": "success", "requeued": requeued})
+    except Exception as e:
+        print(f"❌ Error in requeue_notifications: {str(e)}")
+        raise SanicException(f"Failed to requeue notifications: {str(e)}", status_code=500)
+
+# Без сессии запроса: пачки пишутся короткими транзакциями, а не одной на всё время хэширования
+@admin_bp.post("/users/bulk", ctx_db="read")
+@admit("writes")
+@protected()
+async def create_users_bulk(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    try:
+        return response.json(await provisioning.create_users(request))
+    except SanicException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in create_users_bulk: {str(e)}")
+        raise SanicException(f"Bulk user creation failed: {str(e)}", status_code=500)
+
 @admin_bp.post("/users")
+@admit("writes")
 @protected()
 async def create_user(request):
     try:
@@ -65,7 +272,7 @@ async def create_user(request):
         print(f"🔍 Creating user: {data}")
         
         # Проверяем, существует ли пользователь с таким email
-        result = await session.execute(select(User).where(User.email == data["email"]))
+        result = await session.execute(queries.USER_BY_EMAIL, {"email": data["email"]})
         existing_user = result.scalar_one_or_none()
         if existing_user:
             print(f"❌ User already exists: email={data['email']}")
@@ -2,11 +2,13 @@ from sanic import Blueprint
 from sanic.response import json
 from sanic.exceptions import SanicException
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.admission import admit
 from app.auth import authenticate_user, create_access_token
 
 auth_bp = Blueprint("auth", url_prefix="/auth")
 
-@auth_bp.route("/login", methods=["POST"])
+@auth_bp.route("/login", methods=["POST"], ctx_db="read")
+@admit("auth")
 async def login(request):
     session: AsyncSession = request.ctx.session  # Исправлено: db -> session
     data = request.json
@@ -0,0 +1,71 @@
+from sanic import Blueprint, response
+from app import diagnostics
+from app.admission import admit
+from app.auth import protected, get_current_admin_user
+from app.schemas import DiagnosticsQuery
+from app.search import parse_filters
+
+# Регистрируется в main.py только при DIAGNOSTICS_ENABLED=true
+diagnostics_bp = Blueprint("diagnostics", url_prefix="/admin/diagnostics")
+
+@diagnostics_bp.get("/", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_diagnostics(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, DiagnosticsQuery)
+    return response.json(diagnostics.overview(params.limit))
+
+@diagnostics_bp.post("/tracemalloc/start", ctx_db="read")
+@admit("reads")
+@protected()
+async def start_tracemalloc(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, DiagnosticsQuery)
+    started = diagnostics.start_tracing(params.frames)
+    return response.json({"started": started, "memory": diagnostics.process_memory()})
+
+@diagnostics_bp.post("/tracemalloc/stop", ctx_db="read")
+@admit("reads")
+@protected()
+async def stop_tracemalloc(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    stopped = diagnostics.stop_tracing()
+    return response.json({"stopped": stopped, "memory": diagnostics.process_memory()})
+
+@diagnostics_bp.post("/snapshots", ctx_db="read")
+@admit("reads")
+@protected()
+async def take_snapshot(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, DiagnosticsQuery)
+    snapshot_id = diagnostics.take_snapshot()
+    print(f"🔍 tracemalloc snapshot {snapshot_id} taken")
+    if params.base is not None:
+        return response.json(diagnostics.compare_snapshots(snapshot_id, params.base, params.group_by, params.limit), status=201)
+    return response.json(diagnostics.snapshot_top(snapshot_id, params.group_by, params.limit), status=201)
+
+@diagnostics_bp.get("/snapshots", ctx_db="read")
+@admit("reads")
+@protected()
+async def list_snapshots(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json(diagnostics.list_snapshots())
+
+@diagnostics_bp.get("/snapshots/<snapshot_id:int>", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_snapshot(request, snapshot_id: int):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, DiagnosticsQuery)
+    # ?base=<id> — разница с более ранним снимком вместо абсолютных размеров
+    if params.base is not None:
+        return response.json(diagnostics.compare_snapshots(snapshot_id, params.base, params.group_by, params.limit))
+    return response.json(diagnostics.snapshot_top(snapshot_id, params.group_by, params.limit))
+
+@diagnostics_bp.delete("/snapshots", ctx_db="read")
+@admit("reads")
+@protected()
+async def delete_snapshots(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    return response.json({"removed": diagnostics.clear_snapshots()})
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sanic import Blueprint
+from app import events
+from app.auth import protected
+
+events_bp = Blueprint("events", url_prefix="/events")
+
+@events_bp.get("/", ctx_db="read")
+@protected(query_token=True)
+async def stream_events(request):
+    # EventSource не передаёт заголовки, поэтому токен можно указать в ?token=
+    user = request.ctx.user  # Используем user из контекста
+    print(f"🔍 Event stream opened: user_id={user.id}")
+    try:
+        await events.stream(request, user.id)
+    finally:
+        print(f"🔍 Event stream closed: user_id={user.id}")
@@ -1,107 +1,140 @@
 from sanic import Blueprint, response
 from sanic.exceptions import SanicException
-from sqlalchemy.future import select
-from app.models import Account, Payment, User
+from app.admission import admit
+from app.models import Payment
+from app import archive, fx, ledger, notifications, queries, settlement, velocity
+from app.events import bus
+from app.rollups import record_payment
+from app.sharding import shard_for
 from app.auth import protected
+from app.config import config
+from app.idempotency import idempotent
+from app.search import parse_filters, search_statement
+from app.fx import UnknownCurrency
+from app.velocity import VelocityLimitExceeded
 from app.schemas import PaymentCreate
 from datetime import datetime
 import uuid
 
 payments_bp = Blueprint("payments", url_prefix="/payments")
 
-@payments_bp.post("/")
+@payments_bp.post("/", ctx_db="read")
+@admit("writes")
 @protected()
+@idempotent()
 async def create_payment(request):
     try:
         data = PaymentCreate(**request.json).dict()
         print(f"🔍 Creating payment: {data}")
         session = request.ctx.session
         user = request.ctx.user  # Используем user из контекста
-        async with session.begin():
-            # Проверяем, существует ли счет отправителя
-            result = await session.execute(select(Account).where(Account.id == data["account_id"]))
-            account = result.scalar_one_or_none()
-            if not account:
-                print(f"❌ Account not found: account_id={data['account_id']}")
-                raise SanicException("Account not found", status_code=404)
-            
-            # Проверяем, принадлежит ли счет текущему пользователю
-            if account.user_id != user.id:
-                print(f"❌ Unauthorized access to account: account_id={data['account_id']}, user_id={user.id}")
-                raise SanicException("Unauthorized", status_code=403)
-            
-            # Проверяем баланс
-            if account.balance < data["amount"]:
-                print(f"❌ Insufficient funds: account_id={data['account_id']}, balance={account.balance}, amount={data['amount']}")
-                raise SanicException("Insufficient funds", status_code=400)
-            
-            # Проверяем, существует ли получатель
-            result = await session.execute(select(User).where(User.email == data["recipient_email"]))
-            recipient = result.scalar_one_or_none()
-            if not recipient:
-                print(f"❌ Recipient not found: recipient_email={data['recipient_email']}")
-                raise SanicException("Recipient not found", status_code=404)
-            
-            # Создаем платеж
-            payment = Payment(
-                account_id=data["account_id"],
-                user_id=user.id,
-                amount=data["amount"],
-                recipient_email=data["recipient_email"],
-                transaction_id=str(uuid.uuid4()),
-                status="completed",
-                created_at=datetime.utcnow()
-            )
-            session.add(payment)
-            
-            # Обновляем баланс счета
-            account.balance -= data["amount"]
-            session.add(account)
-            
-            await session.commit()
-            print(f"✅ Payment created: id={payment.id}, amount={payment.amount}, transaction_id={payment.transaction_id}")
-            return response.json(
-                {
-                    "id": payment.id,
-                    "account_id": payment.account_id,
-                    "user_id": payment.user_id,
-                    "amount": payment.amount,
-                    "recipient_email": payment.recipient_email,
-                    "transaction_id": payment.transaction_id,
-                    "status": payment.status,
-                    "created_at": payment.created_at.isoformat()
-                },
-                status=201
-            )
+        settle_later = config.SETTLEMENT_MODE == "async"
+        # Счёт и платёж хранятся в шарде пользователя, получатель — в основной базе
+        async with shard_for(user.id).WriteSession() as shard_session:
+            async with shard_session.begin():
+                # Проверяем, существует ли счет отправителя
+                result = await shard_session.execute(queries.ACCOUNT_BY_ID, {"account_id": data["account_id"]})
+                account = result.scalar_one_or_none()
+                if not account:
+                    print(f"❌ Account not found: account_id={data['account_id']}")
+                    raise SanicException("Account not found", status_code=404)
+                
+                # Проверяем, принадлежит ли счет текущему пользователю
+                if account.user_id != user.id:
+                    print(f"❌ Unauthorized access to account: account_id={data['account_id']}, user_id={user.id}")
+                    raise SanicException("Unauthorized", status_code=403)
+                
+                # Сумма в валюте счёта: перевод в другой валюте пересчитывается по текущему курсу (app.fx)
+                amounts = fx.payment_fields(data["amount"], data["currency"], account.currency)
+                amount = amounts["amount"]
+                
+                # Проверяем баланс: суммы платежей, ещё ожидающих проведения, уже обещаны
+                if account.balance - account.reserved < amount:
+                    print(f"❌ Insufficient funds: account_id={data['account_id']}, balance={account.balance}, amount={amount}")
+                    raise SanicException("Insufficient funds", status_code=400)
+                
+                # Проверяем, существует ли получатель
+                result = await session.execute(queries.USER_BY_EMAIL, {"email": data["recipient_email"]})
+                recipient = result.scalar_one_or_none()
+                if not recipient:
+                    print(f"❌ Recipient not found: recipient_email={data['recipient_email']}")
+                    raise SanicException("Recipient not found", status_code=404)
+                
+                # Лимиты частоты и суммы (app.velocity, в базовой валюте): платёж учитывается сразу и снимается, если commit не случился
+                with velocity.engine.reserve(user.id, account.id, "debit", amount * amounts["fx_rate"]):
+                    # Создаем платеж
+                    payment = Payment(
+                        **amounts,
+                        account_id=data["account_id"],
+                        user_id=user.id,
+                        recipient_email=data["recipient_email"],
+                        transaction_id=str(uuid.uuid4()),
+                        status="pending" if settle_later else "completed",
+                        direction="debit",
+                        created_at=datetime.utcnow()
+                    )
+                    shard_session.add(payment)
+                    if settle_later:
+                        # Только резерв: списание, проводки, агрегаты и уведомление — при проведении (app.settlement)
+                        account.reserved += amount
+                    else:
+                        await record_payment(shard_session, payment)
+                        await ledger.record_payment(shard_session, payment)
+                        notifications.enqueue(shard_session, "payment.completed", notifications.payment_event(payment))
+                        # Обновляем баланс счета
+                        account.balance -= amount
+                    shard_session.add(account)
+                
+                    await shard_session.commit()
+                print(f"✅ Payment created: id={payment.id}, amount={payment.amount}, transaction_id={payment.transaction_id}")
+                payment_data = settlement.payment_data(payment)
+                # Подписчики /events получают события только после commit
+                bus.publish(user.id, "payment.created", payment_data)
+                if settle_later:
+                    # Итог — GET /payments/<id> или событие payment.updated
+                    return response.json(payment_data, status=202)
+                bus.publish(user.id, "balance.updated", {"account_id": account.id, "balance": account.balance})
+                return response.json(payment_data, status=201)
+    except (VelocityLimitExceeded, UnknownCurrency):
+        raise
     except Exception as e:
         print(f"❌ Error in create_payment: {str(e)}")
         raise SanicException(f"Payment creation failed: {str(e)}", status_code=500)
 
-@payments_bp.get("/")
+@payments_bp.get("/", ctx_db="read")
+@admit("reads")
 @protected()
 async def get_payments(request):
+    # Фильтры — см. PaymentFilters: ?from=2024-01-01&to=2024-02-01&status=completed&amount_min=10&limit=50
+    filters = parse_filters(request)
     try:
-        session = request.ctx.session
         user = request.ctx.user  # Используем user из контекста
-        async with session.begin():
-            result = await session.execute(select(Payment).where(Payment.user_id == user.id))
-            payments = result.scalars().all()
-            print(f"🔍 Retrieved {len(payments)} payments for user_id={user.id}")
-            return response.json(
-                [
-                    {
-                        "id": payment.id,
-                        "account_id": payment.account_id,
-                        "user_id": payment.user_id,
-                        "amount": payment.amount,
-                        "recipient_email": payment.recipient_email,
-                        "transaction_id": payment.transaction_id,
-                        "status": payment.status,
-                        "created_at": payment.created_at.isoformat()
-                    }
-                    for payment in payments
-                ]
-            )
+        # Закрытые месяцы — в архиве, текущие платежи — в шарде пользователя; с limit архив
+        # читается по месяцам от старых к новым, пока limit не набран
+        payments = await archive.search(filters, user_id=user.id, limit=filters.limit)
+        remaining = None if filters.limit is None else filters.limit - len(payments)
+        if remaining != 0:
+            async with shard_for(user.id).ReadSession() as session:
+                result = await session.execute(search_statement(Payment, filters, user_id=user.id, limit=remaining))
+                payments += result.scalars().all()
+        print(f"🔍 Retrieved {len(payments)} payments for user_id={user.id}")
+        return response.json([settlement.payment_data(payment) for payment in payments])
     except Exception as e:
         print(f"❌ Error in get_payments: {str(e)}")
-        raise SanicException(f"Failed to retrieve payments: {str(e)}", status_code=500)
\ No newline at end of file
+        raise SanicException(f"Failed to retrieve payments: {str(e)}", status_code=500)
+
+@payments_bp.get("/<payment_id:int>", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_payment(request, payment_id: int):
+    # Опрос статуса платежа, принятого в режиме SETTLEMENT_MODE=async
+    user = request.ctx.user  # Используем user из контекста
+    async with shard_for(user.id).ReadSession() as session:
+        result = await session.execute(queries.PAYMENT_BY_ID_AND_USER, {"payment_id": payment_id, "user_id": user.id})
+        payment = result.scalar_one_or_none()
+    if not payment:
+        # Платежи закрытых месяцев перенесены в архив (app.archive)
+        payment = await archive.get_payment(payment_id, user.id)
+    if not payment:
+        raise SanicException("Payment not found", status_code=404)
+    return response.json(settlement.payment_data(payment))
\ No newline at end of file
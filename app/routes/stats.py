@@ -0,0 +1,137 @@
+from sanic import Blueprint, response
+from sanic.exceptions import SanicException
+from collections import defaultdict
+from datetime import date
+import heapq
+from app.admission import admit
+from app import fx, queries, rollups
+from app.auth import protected, get_current_admin_user
+from app.config import config
+from app.schemas import StatsQuery
+from app.search import parse_filters
+from app.sharding import gather_rows
+
+stats_bp = Blueprint("stats", url_prefix="/admin/stats")
+
+def sum_by_key(rows) -> dict:
+    """Суммирует строки (ключ, count, volume) разных шардов по ключу"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for key, count, volume in rows:
+        totals[key][0] += count
+        totals[key][1] += volume
+    return totals
+
+def report_rate(params) -> float:
+    """Множитель объёмов агрегатов (они в BASE_CURRENCY) для валюты отчёта ?convert_to=; неизвестная — 400"""
+    if params.convert_to is None:
+        return 1.0
+    return fx.table.convert(1.0, config.BASE_CURRENCY, params.convert_to)
+
+@stats_bp.get("/daily", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_daily_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, StatsQuery)
+    rate = report_rate(params)
+    try:
+        rows = await gather_rows(
+            queries.STATS_DAILY,
+            {"start": params.date_from or date.min, "end": params.date_to or date.max}
+        )
+        days = defaultdict(lambda: {"count": 0, "volume": 0.0, "inflow": 0.0, "outflow": 0.0})
+        for day, direction, count, volume in rows:
+            volume *= rate
+            days[day]["count"] += count
+            days[day]["volume"] += volume
+            days[day]["inflow" if direction == "credit" else "outflow"] += volume
+        return response.json([{"day": day.isoformat(), **days[day]} for day in sorted(days)])
+    except Exception as e:
+        print(f"❌ Error in get_daily_stats: {str(e)}")
+        raise SanicException(f"Failed to retrieve stats: {str(e)}", status_code=500)
+
+@stats_bp.get("/statuses", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_status_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    rate = report_rate(parse_filters(request, StatsQuery))
+    try:
+        totals = sum_by_key(await gather_rows(queries.STATS_STATUSES))
+        return response.json(
+            [{"status": status, "count": count, "volume": volume * rate} for status, (count, volume) in sorted(totals.items())]
+        )
+    except Exception as e:
+        print(f"❌ Error in get_status_stats: {str(e)}")
+        raise SanicException(f"Failed to retrieve stats: {str(e)}", status_code=500)
+
+@stats_bp.get("/flows", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_flow_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    rate = report_rate(parse_filters(request, StatsQuery))
+    try:
+        totals = sum_by_key(await gather_rows(queries.STATS_FLOWS))
+        inflow = totals.get("credit", [0, 0.0])
+        outflow = totals.get("debit", [0, 0.0])
+        return response.json(
+            {
+                "inflow": {"count": inflow[0], "volume": inflow[1] * rate},
+                "outflow": {"count": outflow[0], "volume": outflow[1] * rate},
+                "net": (inflow[1] - outflow[1]) * rate
+            }
+        )
+    except Exception as e:
+        print(f"❌ Error in get_flow_stats: {str(e)}")
+        raise SanicException(f"Failed to retrieve stats: {str(e)}", status_code=500)
+
+@stats_bp.get("/users", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_user_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, StatsQuery)
+    rate = report_rate(params)
+    try:
+        rows = await gather_rows(queries.STATS_TOP_USERS, {"limit": params.limit})
+        top = heapq.nlargest(params.limit, rows, key=lambda row: row[2])
+        return response.json(
+            [
+                {"user_id": user_id, "count": count, "volume": volume * rate, "inflow": inflow * rate, "outflow": outflow * rate}
+                for user_id, count, volume, inflow, outflow in top
+            ]
+        )
+    except Exception as e:
+        print(f"❌ Error in get_user_stats: {str(e)}")
+        raise SanicException(f"Failed to retrieve stats: {str(e)}", status_code=500)
+
+@stats_bp.get("/recipients", ctx_db="read")
+@admit("reads")
+@protected()
+async def get_recipient_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    params = parse_filters(request, StatsQuery)
+    rate = report_rate(params)
+    try:
+        rows = await gather_rows(queries.STATS_RECIPIENTS)
+        totals = sum_by_key(rows)
+        top = heapq.nlargest(params.limit, totals.items(), key=lambda item: item[1][1])
+        return response.json(
+            [{"recipient_email": email, "count": count, "volume": volume * rate} for email, (count, volume) in top]
+        )
+    except Exception as e:
+        print(f"❌ Error in get_recipient_stats: {str(e)}")
+        raise SanicException(f"Failed to retrieve stats: {str(e)}", status_code=500)
+
+@stats_bp.post("/rebuild", ctx_db="read")
+@admit("writes")
+@protected()
+async def rebuild_stats(request):
+    await get_current_admin_user(request.ctx.user)  # Проверяем, что пользователь — админ
+    try:
+        payments = await rollups.rebuild()
+        return response.json({"status": "success", "payments": payments})
+    except Exception as e:
+        print(f"❌ Error in rebuild_stats: {str(e)}")
+        raise SanicException(f"Failed to rebuild stats: {str(e)}", status_code=500)
@@ -1,12 +1,14 @@
 from sanic import Blueprint, response
 from sanic.exceptions import SanicException
-from sqlalchemy.future import select
-from app.models import Account
+from app.admission import admit
+from app import queries
+from app.sharding import shard_for
 from app.auth import protected
 
 users_bp = Blueprint("users", url_prefix="/users")
 
-@users_bp.get("/me")
+@users_bp.get("/me", ctx_db="read")
+@admit("reads")
 @protected()
 async def get_current_user_info(request):
     try:
@@ -26,14 +28,16 @@ async def get_current_user_info(request):
         print(f"❌ Error in get_current_user_info: {str(e)}")
         raise SanicException(f"Failed to retrieve user info: {str(e)}", status_code=500)
 
-@users_bp.get("/me/accounts")
+@users_bp.get("/me/accounts", ctx_db="read")
+@admit("reads")
 @protected()
 async def get_user_accounts(request):
     try:
-        session = request.ctx.session
         user = request.ctx.user  # Используем user из контекста
-        result = await session.execute(select(Account).where(Account.user_id == user.id))
-        accounts = result.scalars().all()
+        # Счета хранятся в шарде пользователя
+        async with shard_for(user.id).ReadSession() as session:
+            result = await session.execute(queries.ACCOUNTS_BY_USER, {"user_id": user.id})
+            accounts = result.scalars().all()
         print(f"🔍 Retrieved {len(accounts)} accounts for user_id={user.id}")
         return response.json(
             [
@@ -41,6 +45,8 @@ async def get_user_accounts(request):
                     "id": account.id,
                     "user_id": account.user_id,
                     "balance": account.balance,
+                    "reserved": account.reserved,  # Платежи, ожидающие проведения
+                    "currency": account.currency,
                     "created_at": account.created_at.isoformat()
                 }
                 for account in accounts
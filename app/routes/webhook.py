@@ -1,70 +1,136 @@
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sanic import Blueprint
 from sanic.response import json
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from app.database import engine
-from app.models import User, Account, Payment
-from app.auth import verify_webhook_signature
+from app.admission import admit
+from app.models import Payment, WebhookTransaction
+from app import database, fx, ledger, notifications, queries, settlement, velocity
+from app.events import bus
+from app.rollups import record_payment
+from app.sharding import shard_for
+from app.auth import signed_webhook, verify_webhook_signature
+from app.fx import UnknownCurrency
+from app.schemas import WebhookData
+from app.velocity import VelocityLimitExceeded
 from sanic.exceptions import SanicException
 from datetime import datetime
 
 webhook_bp = Blueprint("webhook", url_prefix="/webhook")
 
-@webhook_bp.route("/payment", methods=["POST"])
-async def payment_webhook(request):
-    data = request.json
+async def claim_transaction(transaction_id: str, user_id: int):
+    """Проверяет пользователя и занимает transaction_id в основной базе до зачисления; возвращает пользователя.
     
-    if not data or not all(key in data for key in ["transaction_id", "user_id", "account_id", "amount", "signature"]):
+    Платежи лежат в шарде пользователя, и проверка по шарду не видит тот же transaction_id,
+    присланный для пользователя из другого шарда; первичный ключ webhook_transactions видит.
+    Пользователь читается тем же соединением записи: запрос, который держит соединение чтения
+    и ждёт записи, взаимно блокируется с create_payment (тот держит запись и ждёт чтения).
+    Сессия закрывается до открытия сессии шарда: шард 0 — та же основная база с одним соединением
+    """
+    try:
+        async with database.WriteSession() as session:
+            async with session.begin():
+                result = await session.execute(queries.USER_BY_ID, {"user_id": user_id})
+                user = result.scalar_one_or_none()
+                if not user:
+                    raise SanicException("User not found", status_code=404)
+                session.add(WebhookTransaction(transaction_id=transaction_id, user_id=user_id))
+    except IntegrityError:
+        raise SanicException("Transaction already processed", status_code=400)
+    return user
+
+async def release_transaction(transaction_id: str):
+    """Освобождает transaction_id, если зачисление не состоялось: провайдер сможет повторить вебхук"""
+    async with database.WriteSession() as session:
+        async with session.begin():
+            await session.execute(queries.DELETE_WEBHOOK_TRANSACTION, {"transaction_id": transaction_id})
+
+# Подпись проверяется до @admit: поддельные запросы не занимают места в очереди вебхуков
+@webhook_bp.route("/payment", methods=["POST"], ctx_db="read")
+@signed_webhook()
+@admit("webhooks")
+async def payment_webhook(request):
+    body = request.json
+    if not isinstance(body, dict):
         raise SanicException("Invalid webhook data", status_code=400)
+    try:
+        data = WebhookData(**body).dict()
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise SanicException(f"Invalid webhook data: {errors}", status_code=400)
     
-    # Проверяем подпись
-    if not verify_webhook_signature(data):
+    # Прежняя подпись в теле — если запрос не подписан заголовком (app.auth.signed_webhook);
+    # считается по полям в том виде, в каком их прислал провайдер
+    if not request.ctx.signature_verified and not verify_webhook_signature(body):
         raise SanicException("Invalid signature", status_code=400)
     
-    async with AsyncSession(engine) as session:
+    # Пользователь хранится в основной базе, счёт и платёж — в шарде пользователя
+    user = await claim_transaction(data["transaction_id"], data["user_id"])
+    try:
+        return await credit_payment(data, user)
+    except BaseException:
+        await release_transaction(data["transaction_id"])
+        raise
+
+async def credit_payment(data: dict, user):
+    async with shard_for(data["user_id"]).WriteSession() as session:
         try:
-            # Проверяем существование пользователя
-            result = await session.execute(select(User).where(User.id == data["user_id"]))
-            user = result.scalar_one_or_none()
-            if not user:
-                raise SanicException("User not found", status_code=404)
-            
             # Проверяем существование счета
             result = await session.execute(
-                select(Account).where(Account.id == data["account_id"], Account.user_id == data["user_id"])
+                queries.ACCOUNT_BY_ID_AND_USER,
+                {"account_id": data["account_id"], "user_id": data["user_id"]}
             )
             account = result.scalar_one_or_none()
             if not account:
                 raise SanicException("Account not found", status_code=404)
             
-            # Проверяем, существует ли уже транзакция
+            # Зачисления, принятые до появления webhook_transactions, ищутся в шарде
             result = await session.execute(
-                select(Payment).where(Payment.transaction_id == data["transaction_id"])
+                queries.PAYMENT_BY_TRANSACTION, {"transaction_id": data["transaction_id"]}
             )
             existing_payment = result.scalar_one_or_none()
+            if not existing_payment:
+                # Платежи закрытых месяцев перенесены в архив (app.archive)
+                result = await session.execute(
+                    queries.ARCHIVED_TRANSACTION, {"transaction_id": data["transaction_id"]}
+                )
+                existing_payment = result.scalar_one_or_none()
             if existing_payment:
                 raise SanicException("Transaction already processed", status_code=400)
             
-            # Обновляем баланс
-            account.balance += data["amount"]
+            # Зачисление в другой валюте переводится в валюту счёта по текущему курсу (app.fx)
+            amounts = fx.payment_fields(data["amount"], data.get("currency"), account.currency)
             
-            # Создаем запись о платеже
-            payment = Payment(
-                transaction_id=data["transaction_id"],
-                user_id=data["user_id"],
-                account_id=data["account_id"],
-                amount=data["amount"],
-                status="completed",
-                created_at=datetime.utcnow(),
-                recipient_email=user.email  # Добавляем recipient_email
-            )
+            # Лимиты зачислений (app.velocity, в базовой валюте); при отказе провайдер повторит вебхук после Retry-After
+            with velocity.engine.reserve(data["user_id"], data["account_id"], "credit", amounts["amount"] * amounts["fx_rate"]):
+                # Обновляем баланс
+                account.balance += amounts["amount"]
+            
+                # Создаем запись о платеже
+                payment = Payment(
+                    **amounts,
+                    transaction_id=data["transaction_id"],
+                    user_id=data["user_id"],
+                    account_id=data["account_id"],
+                    status="completed",
+                    direction="credit",
+                    created_at=datetime.utcnow(),
+                    recipient_email=user.email  # Добавляем recipient_email
+                )
+            
+                session.add(payment)
+                session.add(account)
+                await record_payment(session, payment)
+                await ledger.record_payment(session, payment)
+                notifications.enqueue(session, "payment.completed", notifications.payment_event(payment))
+                await session.commit()
             
-            session.add(payment)
-            session.add(account)
-            await session.commit()
+            bus.publish(payment.user_id, "payment.created", settlement.payment_data(payment))
+            bus.publish(payment.user_id, "balance.updated", {"account_id": account.id, "balance": account.balance})
             
             return json({"status": "success", "message": "Payment processed"})
         
+        except (VelocityLimitExceeded, UnknownCurrency):
+            raise
         except Exception as e:
             await session.rollback()
             raise SanicException(f"Failed to process payment: {str(e)}", status_code=500)
\ No newline at end of file
@@ -1,15 +1,28 @@
-from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime
-from typing import List, Optional
+import math
+import re
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional
 
-class UserBase(BaseModel):
+CURRENCY_PATTERN = "^[A-Z]{3}$"
+
+class Schema(BaseModel):
+    # Валидатор строится при первом использовании, а не при импорте (EmailStr тянет email_validator)
+    class Config:
+        defer_build = True
+
+class UserBase(Schema):
     email: EmailStr
     full_name: str = Field(..., min_length=1, max_length=100)
 
 class UserCreate(UserBase):
     password: str = Field(..., min_length=6)
 
-class UserUpdate(BaseModel):
+class BulkUserCreate(UserCreate):
+    # Строка POST /admin/users/bulk; с opening_balance пользователю сразу открывается счёт
+    opening_balance: Optional[float] = Field(None, ge=0.0)
+
+class UserUpdate(Schema):
     email: Optional[EmailStr] = None
     full_name: Optional[str] = Field(None, min_length=1, max_length=100)
     password: Optional[str] = Field(None, min_length=6)
@@ -23,7 +36,7 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
-class AccountBase(BaseModel):
+class AccountBase(Schema):
     balance: float = Field(ge=0.0)
 
 class Account(AccountBase):
@@ -34,15 +47,18 @@ class Account(AccountBase):
         from_attributes = True
 
 class AccountCreate(AccountBase):
-    pass
+    # Без currency счёт открывается в BASE_CURRENCY
+    currency: Optional[str] = Field(None, pattern=CURRENCY_PATTERN)
 
-class PaymentBase(BaseModel):
+class PaymentBase(Schema):
     amount: float = Field(gt=0.0)
     recipient_email: EmailStr
     transaction_id: Optional[str] = None
 
 class PaymentCreate(PaymentBase):
     account_id: int
+    # Валюта amount; другая, чем у счёта, — сумма переводится по текущему курсу (app.fx)
+    currency: Optional[str] = Field(None, pattern=CURRENCY_PATTERN)
 
 class Payment(PaymentBase):
     id: int
@@ -53,24 +69,105 @@ class Payment(PaymentBase):
     class Config:
         from_attributes = True
 
-class WebhookData(BaseModel):
+def to_naive_utc(value):
+    # created_at хранится в UTC без часового пояса
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class PaymentFilters(Schema):
+    # Параметры строки запроса ?from=2024-01-01&to=2024-02-01&status=completed; to не включается
+    date_from: Optional[datetime] = Field(None, alias="from")
+    date_to: Optional[datetime] = Field(None, alias="to")
+    amount_min: Optional[float] = Field(None, ge=0.0)
+    amount_max: Optional[float] = Field(None, ge=0.0)
+    status: Optional[str] = Field(None, max_length=50)
+    account_id: Optional[int] = None
+    recipient_email: Optional[str] = Field(None, max_length=120)
+    transaction_id_prefix: Optional[str] = Field(None, min_length=1, max_length=100)
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    class Config:
+        extra = "forbid"
+
+    _naive_dates = field_validator("date_from", "date_to")(to_naive_utc)
+
+class AdminPaymentFilters(PaymentFilters):
+    user_id: Optional[int] = None
+    limit: int = Field(100, ge=1, le=1000)
+    # Валюта отчёта: суммы выборки дополнительно переводятся в неё (converted_amount)
+    convert_to: Optional[str] = Field(None, pattern=CURRENCY_PATTERN)
+
+class StatsQuery(Schema):
+    # Параметры /admin/stats: ?from=2024-01-01&to=2024-02-01&limit=20; to не включается
+    date_from: Optional[date] = Field(None, alias="from")
+    date_to: Optional[date] = Field(None, alias="to")
+    limit: int = Field(20, ge=1, le=1000)
+    # Валюта отчёта; по умолчанию — BASE_CURRENCY, в которой ведутся агрегаты
+    convert_to: Optional[str] = Field(None, pattern=CURRENCY_PATTERN)
+    class Config:
+        extra = "forbid"
+
+class VelocityQuery(Schema):
+    # GET /admin/velocity?user_id=1&account_id=2; account_id — только вместе с user_id владельца
+    user_id: Optional[int] = None
+    account_id: Optional[int] = None
+    class Config:
+        extra = "forbid"
+
+class DiagnosticsQuery(Schema):
+    # Параметры /admin/diagnostics: ?group_by=lineno&limit=20&base=1&frames=1
+    group_by: str = Field("lineno", pattern="^(filename|lineno|traceback)$")
+    limit: int = Field(20, ge=1, le=500)
+    base: Optional[int] = None
+    frames: Optional[int] = Field(None, ge=1, le=100)
+    class Config:
+        extra = "forbid"
+
+class StatementQuery(Schema):
+    # Параметры выписки ?from=2024-01-01&to=2024-02-01; to не включается
+    date_from: Optional[datetime] = Field(None, alias="from")
+    date_to: Optional[datetime] = Field(None, alias="to")
+    class Config:
+        extra = "forbid"
+
+    _naive_dates = field_validator("date_from", "date_to")(to_naive_utc)
+
+class WebhookData(Schema):
     transaction_id: str
     user_id: int
     account_id: int
     amount: float = Field(gt=0.0)
-    signature: str
+    # Прежняя подпись; при подписи заголовком WEBHOOK_SIGNATURE_HEADER не нужна
+    signature: Optional[str] = None
+    currency: Optional[str] = Field(None, pattern=CURRENCY_PATTERN)
+
+def check_rates(value: dict) -> dict:
+    for currency, rate in value.items():
+        if not re.fullmatch(CURRENCY_PATTERN[1:-1], currency):
+            raise ValueError(f"invalid currency code {currency!r}")
+        if not math.isfinite(rate) or rate <= 0:
+            raise ValueError(f"rate of {currency} must be a positive number")
+    return value
+
+class FxRatesUpdate(Schema):
+    # PUT /admin/fx-rates и FX_RATES_FILE: {"rates": {"EUR": 1.08}} — единиц BASE_CURRENCY за единицу валюты
+    rates: Dict[str, float]
+    class Config:
+        extra = "forbid"
+
+    _valid_rates = field_validator("rates")(check_rates)
 
-class Token(BaseModel):
+class Token(Schema):
     access_token: str
     token_type: str
 
-class TokenData(BaseModel):
+class TokenData(Schema):
     user_id: Optional[int] = None
 
-class LoginRequest(BaseModel):
+class LoginRequest(Schema):
     email: EmailStr
     password: str
 
-class ErrorResponse(BaseModel):
+class ErrorResponse(Schema):
     error: str
     details: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""Поиск платежей по фильтрам.
+
+Условия строятся только из полей схемы PaymentFilters и передаются через
+bind-параметры SQLAlchemy, сырой SQL из строки запроса не собирается. Один и
+тот же построитель работает с горячей таблицей (модель Payment) и с архивной
+(app.archive.archived_payments): колонки у них одинаковые.
+"""
+from pydantic import ValidationError
+from sanic.exceptions import SanicException
+from sqlalchemy.future import select
+from app.schemas import PaymentFilters
+
+FULL_SCAN_MESSAGE = (
+    "These filters would require a full table scan: "
+    "add user_id, recipient_email, transaction_id_prefix or both from and to"
+)
+
+def parse_filters(request, schema=PaymentFilters) -> PaymentFilters:
+    """Фильтры из строки запроса; неизвестный параметр или неверное значение — 400"""
+    try:
+        return schema(**{key: request.args.get(key) for key in request.args})
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise SanicException(f"Invalid filters: {errors}", status_code=400)
+
+def prefix_upper_bound(prefix: str) -> str:
+    # LIKE 'abc%' в SQLite не использует индекс (регистронезависимое сравнение),
+    # поэтому префикс превращается в диапазон abc <= x < abd
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def payment_conditions(columns, filters: PaymentFilters, user_id: int = None) -> list:
+    conditions = []
+    if user_id is not None:
+        conditions.append(columns.user_id == user_id)
+    if filters.date_from is not None:
+        conditions.append(columns.created_at >= filters.date_from)
+    if filters.date_to is not None:
+        conditions.append(columns.created_at < filters.date_to)
+    if filters.amount_min is not None:
+        conditions.append(columns.amount >= filters.amount_min)
+    if filters.amount_max is not None:
+        conditions.append(columns.amount <= filters.amount_max)
+    if filters.status is not None:
+        conditions.append(columns.status == filters.status)
+    if filters.account_id is not None:
+        conditions.append(columns.account_id == filters.account_id)
+    if filters.recipient_email is not None:
+        conditions.append(columns.recipient_email == filters.recipient_email)
+    if filters.transaction_id_prefix is not None:
+        conditions.append(columns.transaction_id >= filters.transaction_id_prefix)
+        conditions.append(columns.transaction_id < prefix_upper_bound(filters.transaction_id_prefix))
+    return conditions
+
+def check_indexed(filters: PaymentFilters, user_id: int = None):
+    """Отклоняет (400) фильтры, для которых нет индекса с подходящей ведущей колонкой.
+
+    Без фильтров запрос допустим: ORDER BY created_at ... LIMIT идёт по ix_payments_created"""
+    if user_id is not None or filters.recipient_email is not None or filters.transaction_id_prefix is not None:
+        return
+    if filters.date_from is not None and filters.date_to is not None:
+        return
+    # convert_to — валюта отчёта (AdminPaymentFilters), а не условие выборки
+    if not filters.model_dump(exclude_none=True, exclude={"limit", "convert_to"}):
+        return
+    raise SanicException(FULL_SCAN_MESSAGE, status_code=400)
+
+def search_statement(entity, filters: PaymentFilters, user_id: int = None, newest_first: bool = False, limit: int = None):
+    """select() по модели Payment или архивной таблице с условиями фильтров и сортировкой по created_at"""
+    check_indexed(filters, user_id)
+    # У Table колонки в .c, у ORM-модели — атрибуты класса
+    columns = getattr(entity, "c", entity)
+    if newest_first:
+        order = (columns.created_at.desc(), columns.id.desc())
+    else:
+        order = (columns.created_at, columns.id)
+    statement = select(entity).where(*payment_conditions(columns, filters, user_id)).order_by(*order)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
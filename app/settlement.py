@@ -0,0 +1,113 @@
+"""Пакетное проведение исходящих платежей (SETTLEMENT_MODE=async).
+
+В режиме async create_payment только проверяет доступный остаток
+(balance - reserved), пишет платёж со статусом pending и резервирует сумму на
+счёте — одна короткая вставка в запросе, ответ 202. Фоновая задача раз в
+SETTLEMENT_INTERVAL_S секунд проводит накопившиеся платежи всех шардов
+параллельно (asyncio.TaskGroup), до SETTLEMENT_BATCH_SIZE платежей на шард в
+одной транзакции: списывает баланс, снимает резерв, пишет проводки, агрегаты и
+исходящее уведомление и переводит платёж в completed или failed. Одна фиксация
+(fsync) приходится на сотни платежей.
+
+Клиент узнаёт итог опросом GET /payments/<id> или из потока /events (событие
+payment.updated). В режиме sync платёж проводится в запросе, как раньше;
+задача всё равно запущена и доводит платежи, оставшиеся pending после
+переключения режима.
+"""
+import asyncio
+from sqlalchemy import bindparam
+from sqlalchemy.future import select
+from app import ledger, notifications, velocity
+from app.config import config
+from app.events import bus
+from app.models import Account, Payment
+from app.rollups import record_payment
+from app.sharding import shards
+
+PENDING = select(Payment).where(
+    Payment.status == "pending",
+    Payment.direction == "debit"
+).order_by(Payment.id).limit(bindparam("limit"))
+HAS_PENDING = select(Payment.id).where(Payment.status == "pending", Payment.direction == "debit").limit(1)
+ACCOUNTS_BY_IDS = select(Account).where(Account.id.in_(bindparam("ids", expanding=True)))
+
+def payment_data(payment: Payment) -> dict:
+    return {
+        "id": payment.id,
+        "account_id": payment.account_id,
+        "user_id": payment.user_id,
+        "amount": payment.amount,
+        "recipient_email": payment.recipient_email,
+        "transaction_id": payment.transaction_id,
+        "status": payment.status,
+        "direction": payment.direction,
+        "currency": payment.currency,
+        "original_amount": payment.original_amount,
+        "original_currency": payment.original_currency,
+        "created_at": payment.created_at.isoformat()
+    }
+
+async def settle_shard(shard) -> int:
+    """Проводит одну пачку платежей шарда; возвращает размер пачки"""
+    # Пустая очередь проверяется читателем, чтобы не занимать единственное соединение записи
+    async with shard.ReadSession() as session:
+        if (await session.execute(HAS_PENDING)).first() is None:
+            return 0
+
+    async with shard.WriteSession() as session:
+        async with session.begin():
+            payments = (await session.execute(PENDING, {"limit": config.SETTLEMENT_BATCH_SIZE})).scalars().all()
+            if not payments:
+                return 0
+            accounts = {
+                account.id: account
+                for account in (await session.execute(
+                    ACCOUNTS_BY_IDS, {"ids": list({payment.account_id for payment in payments})}
+                )).scalars()
+            }
+            completed = []
+            for payment in payments:
+                account = accounts.get(payment.account_id)
+                if account is not None:
+                    account.reserved -= payment.amount
+                # Резерв гарантирует остаток; failed — если счёт исчез или баланс изменили в обход платежей
+                if account is None or account.balance < payment.amount:
+                    payment.status = "failed"
+                else:
+                    account.balance -= payment.amount
+                    payment.status = "completed"
+                    completed.append(payment)
+                await record_payment(session, payment)
+                notifications.enqueue(session, f"payment.{payment.status}", notifications.payment_event(payment))
+            await ledger.record_payments(session, completed)
+
+    failed = len(payments) - len(completed)
+    print(f"{'⚠️' if failed else '✅'} Settled {len(payments)} payments in shard {shard.index}: {failed} failed")
+    for payment in payments:
+        if payment.status == "failed":
+            # Несостоявшееся списание не должно расходовать лимиты (app.velocity)
+            velocity.engine.release(
+                payment.user_id, payment.account_id, "debit", payment.amount * payment.fx_rate, payment.created_at
+            )
+    # Подписчики /events получают события только после commit
+    for payment in payments:
+        bus.publish(payment.user_id, "payment.updated", payment_data(payment))
+    for account in accounts.values():
+        bus.publish(account.user_id, "balance.updated", {"account_id": account.id, "balance": account.balance})
+    return len(payments)
+
+async def _settle_shard_safely(shard) -> int:
+    # Ошибка одного шарда не отменяет проведение остальных в той же группе задач
+    try:
+        return await settle_shard(shard)
+    except Exception as e:
+        print(f"❌ Settlement failed in shard {shard.index}: {str(e)}")
+        return 0
+
+async def settlement_loop():
+    while True:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(_settle_shard_safely(shard)) for shard in shards]
+        # Полная пачка — в очереди есть ещё платежи, следующая проводится без паузы
+        if not any(task.result() >= config.SETTLEMENT_BATCH_SIZE for task in tasks):
+            await asyncio.sleep(config.SETTLEMENT_INTERVAL_S)
\ No newline at end of file
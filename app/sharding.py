@@ -0,0 +1,340 @@
+"""Шардирование счетов и платежей по user_id.
+
+Пользователи живут в основной базе (DATABASE_URL), а таблицы accounts и
+payments раскладываются по SHARD_COUNT базам по хэшу user_id. Шард 0 — это
+основная база, поэтому при SHARD_COUNT=1 поведение не меняется. Каждый шард
+использует ту же пару движков, что и основная база: один писатель и пул
+читателей (см. app.database).
+
+id счетов и платежей уникальны во всех шардах: шард N выдаёт их из своего
+диапазона [N * 2**40, (N + 1) * 2**40) по последовательности id_sequences, в
+той же транзакции, что и вставку. Шард 0 продолжает нумерацию с 1. При
+переносе пользователя id не меняются, поэтому в шарде могут лежать строки с
+id чужого диапазона; инкрементальные проходы по high-water mark (сверка,
+пересчёт агрегатов) читают только id своего диапазона.
+
+Перебалансировка после изменения SHARD_COUNT (запускать при остановленном API;
+при уменьшении числа шардов --previous-count указывает, сколько их было):
+
+    python -m app.sharding rebalance --dry-run
+    python -m app.sharding rebalance --previous-count 4
+"""
+import argparse
+import asyncio
+import heapq
+import zlib
+from sqlalchemy import and_, delete, distinct, event, func, insert, inspect, union, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session, sessionmaker
+from app import database
+from app.config import config
+from app.models import (
+    Base, Account, Payment, ArchivedTransaction, DailyPaymentStats, UserPaymentStats, RecipientPaymentStats,
+    AccountReconciliation, ReconciliationState, LedgerEntry, BalanceSnapshot, LedgerState, OutboxEvent,
+    IdempotencyRecord, IdSequence, ShardMove
+)
+
+SHARDED_TABLES = [
+    Account.__table__,
+    Payment.__table__,
+    ArchivedTransaction.__table__,
+    DailyPaymentStats.__table__,
+    UserPaymentStats.__table__,
+    RecipientPaymentStats.__table__,
+    AccountReconciliation.__table__,
+    ReconciliationState.__table__,
+    LedgerEntry.__table__,
+    BalanceSnapshot.__table__,
+    LedgerState.__table__,
+    OutboxEvent.__table__,
+    IdempotencyRecord.__table__,
+    IdSequence.__table__,
+    ShardMove.__table__,
+]
+
+# 2**40 id на шард: id 8192 шардов остаются меньше 2**53 и точно представимы в JSON-клиентах
+ID_RANGE = 2 ** 40
+ID_MODELS = (Account, Payment)
+
+# Движок записи (sync Engine) -> индекс шарда: по нему сессия находит свою последовательность id
+_shard_engines = {}
+
+class Shard:
+    __slots__ = ("index", "url", "engine", "read_engine", "WriteSession", "ReadSession")
+
+    def __init__(self, index: int, url: str, engine, read_engine):
+        self.index = index
+        self.url = url
+        self.engine = engine
+        self.read_engine = read_engine
+        self.WriteSession = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        self.ReadSession = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+        _shard_engines[engine.sync_engine] = index
+
+def shard_url(index: int) -> str:
+    """URL базы шарда: шард 0 — основная база, остальные — рядом с ней (finance.db -> finance.shard1.db)"""
+    if index == 0:
+        return config.DATABASE_URL
+    url = make_url(config.DATABASE_URL)
+    stem, dot, suffix = url.database.rpartition(".")
+    database_name = f"{stem}.shard{index}.{suffix}" if dot else f"{url.database}.shard{index}"
+    return url.set(database=database_name).render_as_string(hide_password=False)
+
+def _open_shard(index: int) -> Shard:
+    url = shard_url(index)
+    engine = database.create_write_engine(url)
+    return Shard(index, url, engine, database.create_read_engine(url, engine))
+
+def _create_shards():
+    return [Shard(0, config.DATABASE_URL, database.engine, database.read_engine)] + [
+        _open_shard(index) for index in range(1, config.SHARD_COUNT)
+    ]
+
+shards = _create_shards()
+
+def shard_index(user_id: int, count: int = None) -> int:
+    # crc32, а не hash(): hash() для строк зависит от PYTHONHASHSEED и различается между процессами
+    return zlib.crc32(str(user_id).encode()) % (count or len(shards))
+
+def shard_for(user_id: int) -> Shard:
+    return shards[shard_index(user_id)]
+
+def id_range(index: int) -> tuple:
+    """Полуинтервал id счетов и платежей, которые выдаёт шард index"""
+    return index * ID_RANGE, (index + 1) * ID_RANGE
+
+def local_ids(column, index: int):
+    """Условие «id выдан шардом index», то есть строка не перенесена из другого шарда"""
+    start, end = id_range(index)
+    return and_(column >= start, column < end)
+
+def _allocate_ids(connection, index: int, table, count: int) -> int:
+    """Резервирует count подряд идущих id таблицы в шарде index; возвращает первый"""
+    sequences = IdSequence.__table__
+    start, end = id_range(index)
+    bumped = connection.execute(
+        update(sequences).where(sequences.c.name == table.name).values(last_id=sequences.c.last_id + count)
+    ).rowcount
+    if not bumped:
+        # Первая выдача в шарде: нумерация продолжается после строк, созданных до последовательности
+        current = connection.execute(
+            select(func.max(table.c.id)).where(local_ids(table.c.id, index))
+        ).scalar()
+        connection.execute(insert(sequences).values(name=table.name, last_id=(current or start) + count))
+    last_id = connection.execute(select(sequences.c.last_id).where(sequences.c.name == table.name)).scalar()
+    if last_id >= end:
+        raise RuntimeError(f"Shard {index} has run out of {table.name} ids")
+    return last_id - count + 1
+
+@event.listens_for(Session, "before_flush")
+def _assign_ids(session, flush_context, instances):
+    # Строка последовательности блокируется до commit, поэтому порядок id в шарде совпадает
+    # с порядком commit — на этом держатся high-water marks сверки и пересчёта агрегатов
+    pending = {}
+    for obj in session.new:
+        if isinstance(obj, ID_MODELS) and obj.id is None:
+            pending.setdefault(type(obj), []).append(obj)
+    if not pending:
+        return
+    index = _shard_engines.get(session.get_bind())
+    if index is None:
+        return  # Не база шарда (например, база бенчмарка в памяти): id выдаёт автоинкремент
+    connection = session.connection()
+    for model, objects in pending.items():
+        first_id = _allocate_ids(connection, index, model.__table__, len(objects))
+        for offset, obj in enumerate(objects):
+            obj.id = first_id + offset
+
+def _migrate(connection):
+    # create_all не меняет существующие таблицы: колонки, добавленные в модели позже
+    # (с server_default), и новые индексы досоздаются здесь
+    inspector = inspect(connection)
+    for table in SHARDED_TABLES:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            connection.exec_driver_sql(ddl)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+async def create_shard_tables():
+    """Создаёт таблицы шардов и индексы, добавленные в модели после создания таблиц"""
+    for shard in shards:
+        async with shard.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=SHARDED_TABLES)
+            await conn.run_sync(_migrate)
+
+async def scatter_gather(statement, params: dict = None, key=None, reverse: bool = False, limit: int = None):
+    """Выполняет запрос на всех шардах параллельно и сливает результаты.
+
+    Если каждый шард вернул строки, упорядоченные по key, результат сливается
+    heapq.merge без полной пересортировки. Возвращает пары (индекс шарда, объект)."""
+    async def fetch(shard: Shard):
+        async with shard.ReadSession() as session:
+            result = await session.execute(statement, params or {})
+            return [(shard.index, row) for row in result.scalars().all()]
+
+    per_shard = await asyncio.gather(*(fetch(shard) for shard in shards))
+    if key is None:
+        merged = [item for rows in per_shard for item in rows]
+    else:
+        merged = heapq.merge(*per_shard, key=lambda item: key(item[1]), reverse=reverse)
+    if limit is not None:
+        return [item for _, item in zip(range(limit), merged)]
+    return list(merged)
+
+async def gather_rows(statement, params: dict = None) -> list:
+    """Выполняет запрос (например, агрегирующий) на всех шардах параллельно; строки всех шардов одним списком"""
+    async def fetch(shard: Shard):
+        async with shard.ReadSession() as session:
+            result = await session.execute(statement, params or {})
+            return result.all()
+
+    return [row for rows in await asyncio.gather(*(fetch(shard) for shard in shards)) for row in rows]
+
+# --- перебалансировка ---------------------------------------------------------
+
+async def _misplaced_users(shard: Shard):
+    user_ids = union(
+        select(distinct(Account.user_id)),
+        select(distinct(Payment.user_id)),
+        select(distinct(ArchivedTransaction.user_id))
+    )
+    async with shard.ReadSession() as session:
+        result = await session.execute(user_ids)
+        return [user_id for user_id in result.scalars().all() if shard_index(user_id) != shard.index]
+
+def _copy(model, row, **overrides):
+    return model(**{**{column.key: getattr(row, column.key) for column in model.__table__.columns}, **overrides})
+
+async def _delete_user(session, user_id: int):
+    """Удаляет из шарда счета, платежи и проводки пользователя и всё, что на них ссылается"""
+    account_ids = select(Account.id).where(Account.user_id == user_id)
+    # Обе ноги проводок по счетам пользователя
+    groups = select(LedgerEntry.entry_group).where(LedgerEntry.account_id.in_(account_ids))
+    await session.execute(delete(LedgerEntry).where(LedgerEntry.entry_group.in_(groups)))
+    await session.execute(delete(AccountReconciliation).where(AccountReconciliation.account_id.in_(account_ids)))
+    await session.execute(delete(BalanceSnapshot).where(BalanceSnapshot.account_id.in_(account_ids)))
+    await session.execute(delete(UserPaymentStats).where(UserPaymentStats.user_id == user_id))
+    await session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.user_id == user_id))
+    await session.execute(delete(ArchivedTransaction).where(ArchivedTransaction.user_id == user_id))
+    await session.execute(delete(Payment).where(Payment.user_id == user_id))
+    await session.execute(delete(Account).where(Account.user_id == user_id))
+
+async def _finish_move(user_id: int, source: Shard, target: Shard):
+    async with source.WriteSession() as session:
+        async with session.begin():
+            await _delete_user(session, user_id)
+    async with target.WriteSession() as session:
+        async with session.begin():
+            await session.execute(delete(ShardMove).where(ShardMove.user_id == user_id))
+
+async def move_user(user_id: int, source: Shard, target: Shard) -> int:
+    """Переносит счета, платежи и проводки пользователя с теми же id; возвращает число платежей.
+
+    Копия и отметка ShardMove пишутся в целевой шард одной транзакцией, затем пользователь
+    удаляется из исходного шарда и отметка снимается. Если процесс упал между этими шагами,
+    resume_moves по отметке доводит удаление, не копируя пользователя повторно"""
+    from app import reconciliation  # Сверка сама импортирует шарды
+
+    async with source.ReadSession() as session:
+        accounts = (await session.execute(
+            select(Account).where(Account.user_id == user_id).order_by(Account.id)
+        )).scalars().all()
+        payments = (await session.execute(
+            select(Payment).where(Payment.user_id == user_id).order_by(Payment.id)
+        )).scalars().all()
+        archived = (await session.execute(
+            select(ArchivedTransaction).where(ArchivedTransaction.user_id == user_id)
+        )).scalars().all()
+        user_stats = (await session.execute(
+            select(UserPaymentStats).where(UserPaymentStats.user_id == user_id)
+        )).scalars().all()
+        idempotency_records = (await session.execute(
+            select(IdempotencyRecord).where(IdempotencyRecord.user_id == user_id)
+        )).scalars().all()
+        groups = select(LedgerEntry.entry_group).where(
+            LedgerEntry.account_id.in_(select(Account.id).where(Account.user_id == user_id))
+        )
+        entries = (await session.execute(
+            select(LedgerEntry).where(LedgerEntry.entry_group.in_(groups)).order_by(LedgerEntry.id)
+        )).scalars().all()
+
+    async with target.WriteSession() as session:
+        async with session.begin():
+            session.add_all(_copy(Account, account) for account in accounts)
+            session.add_all(_copy(Payment, payment) for payment in payments)
+            # Проводки получают новые id целевого шарда (выше его high-water mark), поэтому
+            # следующий снимок балансов посчитает их с нуля; снимки не переносятся
+            session.add_all(_copy(LedgerEntry, entry, id=None) for entry in entries)
+            session.add_all(_copy(ArchivedTransaction, row) for row in archived)
+            for record in idempotency_records:
+                await session.merge(_copy(IdempotencyRecord, record))
+            # Агрегаты по пользователю суммируются с уже накопленными в целевом шарде
+            for stats in user_stats:
+                existing = await session.get(UserPaymentStats, (stats.user_id, stats.direction))
+                if existing is None:
+                    session.add(_copy(UserPaymentStats, stats))
+                else:
+                    existing.count += stats.count
+                    existing.volume += stats.volume
+            # Инкрементальная сверка целевого шарда не увидит платежей с id чужого диапазона
+            # и архив, записанный за другим шардом: их суммы переносятся сразу
+            for account_id, net in (await reconciliation.moved_net(session, target.index, user_id, payments)).items():
+                session.add(AccountReconciliation(account_id=account_id, net=net))
+            session.add(ShardMove(user_id=user_id, source_shard=source.index))
+
+    await _finish_move(user_id, source, target)
+    return len(payments)
+
+async def resume_moves(sources: list) -> int:
+    """Доводит переносы, прерванные после копирования: удаляет пользователя из исходного шарда"""
+    resumed = 0
+    for target in shards:
+        async with target.ReadSession() as session:
+            moves = (await session.execute(select(ShardMove))).scalars().all()
+        for move in moves:
+            if move.source_shard >= len(sources):
+                print(f"⚠️ user_id={move.user_id}: source shard {move.source_shard} is not open, pass --previous-count")
+                continue
+            await _finish_move(move.user_id, sources[move.source_shard], target)
+            print(f"✅ Resumed move of user_id={move.user_id}: shard {move.source_shard} -> {target.index}")
+            resumed += 1
+    return resumed
+
+async def rebalance(dry_run: bool = False, previous_count: int = None):
+    await create_shard_tables()
+    # Шарды сверх текущего SHARD_COUNT остаются на диске, пока из них не вынесут всех пользователей
+    sources = shards + [_open_shard(index) for index in range(len(shards), previous_count or 0)]
+    if not dry_run:
+        await resume_moves(sources)
+    moved = 0
+    for source in sources:
+        for user_id in await _misplaced_users(source):
+            target = shard_for(user_id)
+            if dry_run:
+                print(f"🔍 user_id={user_id}: shard {source.index} -> {target.index}")
+            else:
+                payments = await move_user(user_id, source, target)
+                print(f"✅ Moved user_id={user_id}: shard {source.index} -> {target.index}, {payments} payments")
+            moved += 1
+    print(f"✅ Rebalance {'planned' if dry_run else 'finished'}: {moved} users")
+
+def main():
+    parser = argparse.ArgumentParser(description="Finance API shard maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebalance_parser = subcommands.add_parser("rebalance", help="move users to the shard their user_id hashes to")
+    rebalance_parser.add_argument("--dry-run", action="store_true", help="only print the planned moves")
+    rebalance_parser.add_argument("--previous-count", type=int, help="shard count before the change, when shrinking")
+    args = parser.parse_args()
+    if args.command == "rebalance":
+        asyncio.run(rebalance(dry_run=args.dry_run, previous_count=args.previous_count))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Лимиты частоты и суммы платежей (velocity limits) в памяти процесса.
+
+Политики задаются строкой VELOCITY_LIMITS через запятую:
+
+    область:направление:окно:метрика=предел
+    account:debit:minute:count=30,user:debit:day:amount=100000
+
+область — account или user, направление — debit (create_payment) или credit
+(вебхук), окно — minute, hour или day, метрика — count или amount (сумма в
+BASE_CURRENCY по курсу платежа, app.fx).
+
+Для каждого счёта и пользователя, по которым есть политики, держатся кольцевые
+буферы корзин: окно делится на WINDOWS[окно][1] корзин, и буфер хранит число и
+сумму платежей в каждой корзине плюс итог по окну. Проверка платежа — сравнение
+итогов с пределами, без запросов к базе; окно сдвигается шагом корзины.
+
+Платёж резервирует место в счётчиках до commit (reserve) и снимается, если
+транзакция не завершилась: параллельные запросы не проходят лимит вдвоём.
+При старте счётчики восстанавливаются из платежей за последние сутки во всех
+шардах, кроме failed; платёж, не прошедший проведение, снимается (release).
+Процесс один (single_process), поэтому счётчики общие для всех запросов;
+платежи, уже перенесённые в архив, при восстановлении не учитываются.
+"""
+import asyncio
+import math
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from sanic.exceptions import SanicException
+from sqlalchemy.future import select
+from app.config import config
+from app.models import Payment
+from app.sharding import gather_rows
+
+# Окно: (длина в секундах, число корзин)
+WINDOWS = {
+    "minute": (60, 12),
+    "hour": (3600, 12),
+    "day": (86400, 24),
+}
+WINDOWS_SPAN_MAX = max(span for span, _ in WINDOWS.values())
+SCOPES = ("account", "user")
+DIRECTIONS = ("debit", "credit")
+METRICS = ("count", "amount")
+
+class VelocityLimitExceeded(SanicException):
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, headers={"Retry-After": str(retry_after)})
+
+class Policy:
+    __slots__ = ("scope", "direction", "window", "metric", "limit")
+
+    def __init__(self, scope: str, direction: str, window: str, metric: str, limit: float):
+        self.scope = scope
+        self.direction = direction
+        self.window = window
+        self.metric = metric
+        self.limit = limit
+
+    def describe(self) -> str:
+        return f"{self.scope}:{self.direction}:{self.window}:{self.metric}={self.limit:g}"
+
+def parse_policies(spec: str) -> list:
+    policies = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, _, limit = item.partition("=")
+            scope, direction, window, metric = name.strip().split(":")
+            policy = Policy(scope, direction, window, metric, float(limit))
+        except ValueError:
+            raise ValueError(f"Invalid VELOCITY_LIMITS entry: {item!r}")
+        if scope not in SCOPES or direction not in DIRECTIONS or window not in WINDOWS or metric not in METRICS:
+            raise ValueError(f"Invalid VELOCITY_LIMITS entry: {item!r}")
+        policies.append(policy)
+    return policies
+
+class Ring:
+    """Число и сумма событий за окно в кольце корзин"""
+    __slots__ = ("width", "counts", "amounts", "head", "count", "amount")
+
+    def __init__(self, window: str):
+        span, buckets = WINDOWS[window]
+        self.width = span / buckets
+        self.counts = array("l", [0]) * buckets
+        self.amounts = array("d", [0.0]) * buckets
+        self.head = 0  # Номер последней корзины, до которой сдвинуто окно
+        self.count = 0
+        self.amount = 0.0
+
+    def _advance(self, slot: int):
+        if slot <= self.head:
+            return
+        size = len(self.counts)
+        if slot - self.head >= size:
+            for index in range(size):
+                self.counts[index] = 0
+                self.amounts[index] = 0.0
+            self.count = 0
+            self.amount = 0.0
+        else:
+            for expired in range(self.head + 1, slot + 1):
+                index = expired % size
+                self.count -= self.counts[index]
+                self.amount -= self.amounts[index]
+                self.counts[index] = 0
+                self.amounts[index] = 0.0
+            if self.count == 0:
+                self.amount = 0.0  # Без накопленной ошибки округления
+        self.head = slot
+
+    def add(self, timestamp: float, amount: float, count: int = 1):
+        slot = int(timestamp // self.width)
+        self._advance(slot)
+        if self.head - slot >= len(self.counts):
+            return  # Событие старше окна
+        index = slot % len(self.counts)
+        self.counts[index] += count
+        self.amounts[index] += amount
+        self.count += count
+        self.amount += amount
+
+    def totals(self, now: float) -> tuple:
+        self._advance(int(now // self.width))
+        return self.count, self.amount
+
+    def retry_after(self, now: float, metric: str, value: float, limit: float) -> int:
+        """Через сколько секунд из окна уйдёт достаточно старых корзин, чтобы value поместилось"""
+        self._advance(int(now // self.width))
+        size = len(self.counts)
+        used = self.count if metric == "count" else self.amount
+        for slot in range(self.head - size + 1, self.head + 1):
+            index = slot % size
+            used -= self.counts[index] if metric == "count" else self.amounts[index]
+            if used + value <= limit:
+                return max(1, math.ceil((slot + size) * self.width - now))
+        # Платёж больше самого предела: ожидание не поможет, подсказываем длину окна
+        return math.ceil(size * self.width)
+
+class VelocityEngine:
+    def __init__(self, policies: list):
+        self.policies = policies
+        self.by_key = {}
+        for policy in policies:
+            self.by_key.setdefault((policy.scope, policy.direction), []).append(policy)
+        # (область, ключ, направление) -> {окно: Ring}; ключ — user_id или (user_id, account_id),
+        # только окна, на которые есть политики
+        self.counters = {}
+        self.allowed = 0
+        self.denied = 0
+
+    def _rings(self, scope: str, key, direction: str, create: bool = True):
+        rings = self.counters.get((scope, key, direction))
+        if rings is None and create:
+            windows = {policy.window for policy in self.by_key.get((scope, direction), ())}
+            if not windows:
+                return None
+            rings = self.counters[(scope, key, direction)] = {window: Ring(window) for window in windows}
+        return rings
+
+    def _subjects(self, user_id: int, account_id: int):
+        # Счёт — вместе с владельцем: в базах до глобальных id один номер счёта встречается в разных шардах
+        return (("account", (user_id, account_id)), ("user", user_id))
+
+    def check(self, user_id: int, account_id: int, direction: str, amount: float, now: float = None):
+        """Бросает VelocityLimitExceeded, если платёж превысит хотя бы одну политику"""
+        now = time.time() if now is None else now
+        for scope, key in self._subjects(user_id, account_id):
+            policies = self.by_key.get((scope, direction))
+            if not policies:
+                continue
+            rings = self._rings(scope, key, direction)
+            for policy in policies:
+                ring = rings[policy.window]
+                count, total = ring.totals(now)
+                value, used = (1, count) if policy.metric == "count" else (amount, total)
+                if used + value > policy.limit:
+                    self.denied += 1
+                    print(f"❌ Velocity limit exceeded: {policy.describe()}, {scope}_id={key}, used={used:g}")
+                    raise VelocityLimitExceeded(
+                        f"Velocity limit exceeded: {policy.describe()}",
+                        ring.retry_after(now, policy.metric, value, policy.limit)
+                    )
+        self.allowed += 1
+
+    def add(self, user_id: int, account_id: int, direction: str, amount: float, timestamp: float = None, count: int = 1):
+        timestamp = time.time() if timestamp is None else timestamp
+        for scope, key in self._subjects(user_id, account_id):
+            rings = self._rings(scope, key, direction)
+            if rings is not None:
+                for ring in rings.values():
+                    ring.add(timestamp, amount, count)
+
+    @contextmanager
+    def reserve(self, user_id: int, account_id: int, direction: str, amount: float):
+        """Проверка и учёт платежа; если блок завершился исключением (не было commit), учёт снимается"""
+        if not config.VELOCITY_ENABLED:
+            yield
+            return
+        now = time.time()
+        self.check(user_id, account_id, direction, amount, now)
+        self.add(user_id, account_id, direction, amount, now)
+        try:
+            yield
+        except BaseException:
+            self.add(user_id, account_id, direction, -amount, now, count=-1)
+            raise
+
+    def release(self, user_id: int, account_id: int, direction: str, amount: float, created_at: datetime):
+        """Снимает учёт платежа, который не состоялся (failed при проведении)"""
+        if config.VELOCITY_ENABLED:
+            self.add(user_id, account_id, direction, -amount, _timestamp(created_at), count=-1)
+
+    def usage(self, scope: str, key) -> list:
+        """Использование политик области; key — user_id или (user_id, account_id) для счёта"""
+        now = time.time()
+        usage = []
+        for policy in self.policies:
+            if policy.scope != scope:
+                continue
+            rings = self._rings(scope, key, policy.direction, create=False)
+            count, total = rings[policy.window].totals(now) if rings else (0, 0.0)
+            used = count if policy.metric == "count" else round(total, 2)
+            usage.append({
+                "policy": policy.describe(),
+                "used": used,
+                "limit": policy.limit,
+                "remaining": max(0, round(policy.limit - used, 2))
+            })
+        return usage
+
+    def sweep(self) -> int:
+        """Удаляет счётчики, в окнах которых не осталось платежей"""
+        now = time.time()
+        idle = [
+            key for key, rings in self.counters.items()
+            if all(ring.totals(now)[0] == 0 for ring in rings.values())
+        ]
+        for key in idle:
+            del self.counters[key]
+        return len(idle)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.VELOCITY_ENABLED,
+            "policies": [policy.describe() for policy in self.policies],
+            "counters": len(self.counters),
+            "allowed": self.allowed,
+            "denied": self.denied
+        }
+
+engine = VelocityEngine(parse_policies(config.VELOCITY_LIMITS))
+
+def _timestamp(created_at: datetime) -> float:
+    # created_at хранится как наивное UTC
+    return created_at.replace(tzinfo=timezone.utc).timestamp()
+
+async def load():
+    """Восстанавливает счётчики из платежей за самое длинное окно"""
+    since = datetime.utcnow() - timedelta(seconds=WINDOWS_SPAN_MAX)
+    rows = await gather_rows(
+        select(Payment.user_id, Payment.account_id, Payment.direction, Payment.amount * Payment.fx_rate, Payment.created_at)
+        .where(Payment.created_at >= since, Payment.status != "failed")
+        .order_by(Payment.created_at)
+    )
+    # Строки разных шардов идут подряд: порядок по времени внутри шарда, кольцу этого достаточно
+    for user_id, account_id, direction, amount, created_at in rows:
+        engine.add(user_id, account_id, direction, amount, _timestamp(created_at))
+    print(f"✅ Velocity counters loaded from {len(rows)} payments: {len(engine.counters)} counters")
+
+async def sweep_loop():
+    while True:
+        await asyncio.sleep(300)
+        removed = engine.sweep()
+        if removed:
+            print(f"✅ Removed {removed} idle velocity counters")
\ No newline at end of file
@@ -0,0 +1,66 @@
+import asyncio
+import time
+from sanic import response
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from app import provisioning, queries, schemas
+from app.passwords import verify_password
+from app.config import config
+from app.database import engine, read_engine
+from app.models import Payment
+from app.schemas import PaymentFilters, AdminPaymentFilters
+from app.search import search_statement
+from app.sharding import shards
+
+async def warm_pool(engine: AsyncEngine, connections: int):
+    """Открывает соединения пула заранее; после закрытия они остаются в пуле"""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else connections
+    opened = await asyncio.gather(*(engine.connect() for _ in range(min(connections, size))))
+    for conn in opened:
+        await conn.close()
+
+async def warm_statements(engine: AsyncEngine, statements):
+    """Компилирует запросы обработчиков в кэш движка, не выбирая строки"""
+    async with AsyncSession(engine) as session:
+        for statement, params in statements:
+            result = await session.stream(statement, params)
+            await result.close()
+
+def warm_schemas():
+    """Строит отложенные (defer_build) pydantic-валидаторы и сериализаторы"""
+    for model in vars(schemas).values():
+        if isinstance(model, type) and issubclass(model, schemas.Schema) and model is not schemas.Schema:
+            model.model_rebuild()
+    response.json({"status": "OK", "created_at": time.time()})
+
+async def warm_hash_pool():
+    """Запускает процессы пула хэшей паролей (app.provisioning) и загружает в них bcrypt-бэкенд.
+    
+    Проверяется дешёвый хэш (4 раунда), а не хэш стоимости BCRYPT_ROUNDS: прогрев не тратит
+    на него сотни миллисекунд, а первый вход после /ready не ждёт запуска процессов
+    """
+    from passlib.hash import bcrypt
+    dummy = bcrypt.using(rounds=4).hash("warm-up")
+    loop = asyncio.get_running_loop()
+    pool = provisioning.get_hash_pool()
+    # По задаче на процесс: пул запускает новый процесс, пока свободных нет
+    await asyncio.gather(*(
+        loop.run_in_executor(pool, verify_password, "warm-up", dummy) for _ in range(config.BULK_HASH_WORKERS)
+    ))
+
+async def warm_up():
+    started = time.perf_counter()
+    # Поиск без фильтров: GET /payments/ и /admin/payments
+    shard_statements = queries.SHARD_STATEMENTS + [
+        (search_statement(Payment, PaymentFilters(), user_id=0), {}),
+        (search_statement(Payment, AdminPaymentFilters(), newest_first=True, limit=100), {}),
+    ]
+    targets = [(engine, queries.USER_STATEMENTS), (read_engine, queries.USER_STATEMENTS)]
+    for shard in shards:
+        targets += [(shard.engine, shard_statements), (shard.read_engine, shard_statements)]
+    for target, statements in targets:
+        await warm_statements(target, statements)
+    for target in {target for target, _ in targets}:
+        await warm_pool(target, config.WARMUP_POOL_CONNECTIONS)
+    warm_schemas()
+    await warm_hash_pool()
+    print(f"✅ Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1 @@
+"""Бенчмарки Finance API (нагрузочные и микро)."""
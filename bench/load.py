@@ -0,0 +1,438 @@
+"""Нагрузочный бенчмарк Finance API.
+
+Поднимает приложение в отдельном процессе (main.app.run, как bench.startup)
+на временной SQLite-базе, заполняет её пользователями, счетами и платежами и
+гоняет смешанную нагрузку через общий пул соединений aiohttp. Настройки
+приложения, от которых зависит замер, задаются явно (app_settings) и
+записываются в отчёт. Результат печатается в JSON и сравнивается
+с сохранённым baseline, регрессия или хотя бы одна ошибка завершает процесс
+с кодом 1.
+
+    python -m bench.load --users 50 --concurrency 32 --duration 20
+    python -m bench.load --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from hashlib import sha256
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PASSWORD = "BenchPass123!"
+DEFAULT_MIX = "login=1,accounts=6,payment=2,webhook=1"
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Для быстрых операций (единицы мс) относительный допуск меньше шума планировщика
+LATENCY_SLACK_MS = 10.0
+# Допуск запросов включён, как в бою, с лимитами по умолчанию из app.config: заданы явно,
+# чтобы смена значений по умолчанию не меняла замер незаметно. При --concurrency до 48
+# запросы ждут в очередях, а не сбрасываются с 503
+ADMISSION_SETTINGS = {
+    "ADMISSION_ENABLED": "true",
+    "ADMISSION_TOTAL_LIMIT": "48",
+    "ADMISSION_WEBHOOKS_LIMIT": "16",
+    "ADMISSION_WEBHOOKS_QUEUE": "256",
+    "ADMISSION_WEBHOOKS_WAIT_MS": "5000",
+    "ADMISSION_AUTH_LIMIT": "4",
+    "ADMISSION_AUTH_QUEUE": "32",
+    "ADMISSION_AUTH_WAIT_MS": "2000",
+    "ADMISSION_WRITES_LIMIT": "16",
+    "ADMISSION_WRITES_QUEUE": "128",
+    "ADMISSION_WRITES_WAIT_MS": "2000",
+    "ADMISSION_READS_LIMIT": "32",
+    "ADMISSION_READS_QUEUE": "128",
+    "ADMISSION_READS_WAIT_MS": "1000",
+}
+# Процесс сервера; журнал SQL на каждый запрос измерял бы логирование, а не API
+SERVER_SCRIPT = """
+import main
+from app import database
+from app.sharding import shards
+for engine in [database.engine, database.read_engine] + [shard.engine for shard in shards] + [shard.read_engine for shard in shards]:
+    engine.echo = False
+main.app.run(host={host!r}, port={port}, single_process=True, access_log=False)
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Finance API load benchmark")
+    parser.add_argument("--users", type=int, default=50, help="number of seeded users")
+    parser.add_argument("--payments-per-user", type=int, default=20, help="seeded payment history per user")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=15.0, help="measured phase, seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured warm-up phase, seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. login=1,accounts=6")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the workload")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up waiting for /ready, seconds")
+    parser.add_argument(
+        "--bcrypt-rounds", type=int, default=4,
+        help="BCRYPT_ROUNDS of the benchmarked app: at the production cost logins saturate a small machine"
+    )
+    parser.add_argument(
+        "--settlement-mode", choices=("sync", "async"), default=os.getenv("SETTLEMENT_MODE", "sync"),
+        help="SETTLEMENT_MODE of the benchmarked app: payments answer 201 (sync) or 202 (async)"
+    )
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    return parser.parse_args(argv)
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in LoadRunner.OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, q: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors: int, duration: float) -> dict:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "throughput_rps": round(count / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def sign_webhook(data: dict, secret: str) -> str:
+    """Подпись вебхука в формате app.auth.verify_webhook_signature"""
+    sorted_keys = sorted(key for key in data.keys() if key != "signature")
+    concatenated = ''.join(str(data[key]) for key in sorted_keys) + secret
+    return sha256(concatenated.encode()).hexdigest()
+
+
+async def seed(users: int, payments_per_user: int):
+    """Заполняет базу тестовыми пользователями, счетами и историей платежей"""
+    from app import ledger
+    from app.auth import create_access_token, get_password_hash
+    from app.database import WriteSession
+    from app.models import Account, Payment, User
+    from app.sharding import shard_for
+
+    hashed = get_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+    async with WriteSession() as session:
+        async with session.begin():
+            user_rows = [
+                User(
+                    email=f"bench{i}@example.com",
+                    full_name=f"Bench User {i}",
+                    hashed_password=hashed,
+                    is_active=True,
+                    is_admin=False,
+                    created_at=now
+                )
+                for i in range(users)
+            ]
+            session.add_all(user_rows)
+
+    # Счета и платежи — в шардах пользователей, по одной транзакции на шард
+    by_shard = {}
+    for i, user in enumerate(user_rows):
+        by_shard.setdefault(shard_for(user.id), []).append((i, user))
+    accounts_by_user = {}
+    for shard, shard_users in by_shard.items():
+        async with shard.WriteSession() as session:
+            async with session.begin():
+                account_rows = [
+                    Account(user_id=user.id, balance=1_000_000_000.0, opening_balance=1_000_000_000.0, created_at=now)
+                    for _, user in shard_users
+                ]
+                session.add_all(account_rows)
+                for account in account_rows:
+                    await ledger.open_account(session, account)
+
+                session.add_all(
+                    Payment(
+                        account_id=account.id,
+                        user_id=user.id,
+                        amount=1.0,
+                        recipient_email=user_rows[(n + i) % users].email,
+                        transaction_id=f"bench-seed-{i}-{n}",
+                        status="completed",
+                        created_at=now
+                    )
+                    for (i, user), account in zip(shard_users, account_rows)
+                    for n in range(payments_per_user)
+                )
+        accounts_by_user.update((account.user_id, account) for account in account_rows)
+
+    return [
+        {
+            "id": user.id,
+            "email": user.email,
+            "account_id": accounts_by_user[user.id].id,
+            "token": create_access_token(data={"sub": str(user.id)})
+        }
+        for user in user_rows
+    ]
+
+
+class LoadRunner:
+    OPERATIONS = ("login", "accounts", "payment", "webhook")
+
+    def __init__(self, base_url: str, users: list, mix: dict, webhook_secret: str, rng: random.Random):
+        self.base_url = base_url
+        self.users = users
+        self.webhook_secret = webhook_secret
+        self.rng = rng
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.latencies = {name: [] for name in self.names}
+        self.errors = {name: 0 for name in self.names}
+        self.recording = False
+
+    def _auth(self, user):
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    async def login(self, http, user):
+        payload = {"email": user["email"], "password": BENCH_PASSWORD}
+        async with http.post(f"{self.base_url}/auth/login", json=payload) as response:
+            await response.read()
+            return response.status == 200
+
+    async def accounts(self, http, user):
+        async with http.get(f"{self.base_url}/users/me/accounts", headers=self._auth(user)) as response:
+            await response.read()
+            return response.status == 200
+
+    async def payment(self, http, user):
+        recipient = self.rng.choice(self.users)
+        payload = {
+            "account_id": user["account_id"],
+            "amount": 1.0,
+            "recipient_email": recipient["email"]
+        }
+        async with http.post(f"{self.base_url}/payments/", json=payload, headers=self._auth(user)) as response:
+            await response.read()
+            # 202 — платёж принят и будет проведён фоновой задачей (SETTLEMENT_MODE=async)
+            return response.status in (201, 202)
+
+    async def webhook(self, http, user):
+        payload = {
+            "transaction_id": f"bench-tx-{uuid.uuid4()}",
+            "user_id": user["id"],
+            "account_id": user["account_id"],
+            "amount": 1.0
+        }
+        payload["signature"] = sign_webhook(payload, self.webhook_secret)
+        async with http.post(f"{self.base_url}/webhook/payment", json=payload) as response:
+            await response.read()
+            return response.status == 200
+
+    async def worker(self, http, deadline: float):
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(self.names, self.weights)[0]
+            user = self.rng.choice(self.users)
+            started = time.perf_counter()
+            try:
+                ok = await getattr(self, name)(http, user)
+            except aiohttp.ClientError:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if self.recording:
+                self.latencies[name].append(elapsed)
+                if not ok:
+                    self.errors[name] += 1
+
+    async def run_phase(self, http, concurrency: int, duration: float, record: bool) -> float:
+        self.recording = record
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(self.worker(http, deadline) for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, duration: float) -> dict:
+        everything = [value for values in self.latencies.values() for value in values]
+        return {
+            "overall": summarize(everything, sum(self.errors.values()), duration),
+            "ops": {
+                name: summarize(self.latencies[name], self.errors[name], duration)
+                for name in self.names
+            }
+        }
+
+
+def app_settings(args) -> dict:
+    """Переменные окружения приложения, от которых зависит замер; попадают в отчёт"""
+    return {
+        # Стоимость bcrypt — настройка политики (app.passwords), а не свойство API: при боевой стоимости
+        # входы упираются в процессор, группа auth сбрасывает их с 503, и замер показывает только это
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "SETTLEMENT_MODE": args.settlement_mode,
+        # Лимиты частоты платежей (по умолчанию 30 списаний в минуту на счёт) за долгий прогон
+        # превращают замер в подсчёт 429
+        "VELOCITY_ENABLED": "false",
+        **ADMISSION_SETTINGS,
+    }
+
+
+def start_server(args) -> subprocess.Popen:
+    # Отдельный процесс и app.run: только так Sanic запускает фоновые задачи приложения
+    # (add_task(..., name=)), а create_server для них не поддерживается
+    return subprocess.Popen(
+        [sys.executable, "-c", SERVER_SCRIPT.format(host=args.host, port=args.port)],
+        cwd=ROOT,
+        env=dict(os.environ),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        # Sanic теряет SIGTERM, пришедший во время after_server_start
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(http, base_url: str, process: subprocess.Popen, timeout: float):
+    """Ждёт 200 от /ready: прогрев закончен, фоновые задачи запущены"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode} before /ready")
+        try:
+            async with http.get(f"{base_url}/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit(f"Server did not become ready on {base_url} within {timeout}s")
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="finance-bench-")
+    settings = app_settings(args)
+    # Те же настройки у процесса сервера и у этого процесса, который заполняет базу
+    os.environ.update(settings)
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    base_url = f"http://{args.host}:{args.port}"
+    server = start_server(args)
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as http:
+            await wait_ready(http, base_url, server, args.timeout)
+            from app import database
+            from app.config import config
+            from app.sharding import shards
+            engines = {database.engine, database.read_engine, *(shard.engine for shard in shards), *(shard.read_engine for shard in shards)}
+            for engine in engines:
+                engine.echo = False
+            # Таблицы создал сервер при старте; база заполняется напрямую, мимо API
+            print(f"🌱 Seeding {args.users} users...", file=sys.stderr)
+            users = await seed(args.users, args.payments_per_user)
+            for engine in engines:
+                await engine.dispose()
+            runner = LoadRunner(base_url, users, parse_mix(args.mix), config.WEBHOOK_SECRET, random.Random(args.seed))
+            print(f"🔥 Warm-up {args.warmup}s...", file=sys.stderr)
+            await runner.run_phase(http, args.concurrency, args.warmup, record=False)
+            print(f"🚀 Measuring {args.duration}s at concurrency {args.concurrency}...", file=sys.stderr)
+            duration = await runner.run_phase(http, args.concurrency, args.duration, record=True)
+    finally:
+        stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = runner.report(duration)
+    report["config"] = {
+        "users": args.users,
+        "payments_per_user": args.payments_per_user,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "mix": args.mix,
+        "app_settings": settings
+    }
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Возвращает список регрессий относительно baseline"""
+    regressions = []
+    sections = [("overall", report["overall"], baseline.get("overall"))]
+    sections += [(name, stats, baseline.get("ops", {}).get(name)) for name, stats in report["ops"].items()]
+    for name, current, previous in sections:
+        if not previous:
+            continue
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']} rps < baseline {previous['throughput_rps']} rps"
+            )
+        for key in ("p95_ms", "p99_ms"):
+            if current[key] > previous[key] * (1 + tolerance) + LATENCY_SLACK_MS:
+                regressions.append(f"{name}: {key} {current[key]} > baseline {previous[key]}")
+        # Ошибки не сравниваются с baseline: замер с отказами не отражает производительность
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors (error rate {current['error_rate']})")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(output + "\n")
+        print(f"✅ Baseline updated: {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("ℹ️ No baseline found, skipping comparison", file=sys.stderr)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("⚠️ Baseline was recorded with a different configuration", file=sys.stderr)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("❌ Performance regressions:", file=sys.stderr)
+        for line in regressions:
+            print(f"   - {line}", file=sys.stderr)
+        return 1
+    print("✅ No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
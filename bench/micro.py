@@ -0,0 +1,314 @@
+"""Микробенчмарки горячих функций Finance API.
+
+Каждый бенчмарк прогревается, затем снимается --repeat выборок; размер
+выборки подбирается так, чтобы она длилась не меньше --min-time. Результат
+печатается таблицей и пишется в JSON, который можно сравнить с другим
+прогоном через --compare (до/после для perf-PR).
+
+    python -m bench.micro --output before.json
+    python -m bench.micro --output after.json --compare before.json
+    python -m bench.micro --filter schemas
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+# app.settlement (сериализатор платежей) создаёт движки при импорте; к базе бенчмарки не подключаются
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Регистрирует фабрику бенчмарка: она готовит данные и возвращает вызываемый объект"""
+    def decorator(factory):
+        BENCHMARKS[name] = factory
+        return factory
+    return decorator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Finance API microbenchmarks")
+    parser.add_argument("--filter", default="", help="run only benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=7, help="number of timed samples")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum duration of one sample, seconds")
+    parser.add_argument("--warmup", type=float, default=0.2, help="warm-up duration, seconds")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    return parser.parse_args(argv)
+
+
+# --- auth -----------------------------------------------------------------
+
+def _webhook_payload():
+    from bench.load import sign_webhook
+    from app.config import config
+    payload = {
+        "transaction_id": "bench-tx-1",
+        "user_id": 2,
+        "account_id": 1,
+        "amount": 100.0
+    }
+    payload["signature"] = sign_webhook(payload, config.WEBHOOK_SECRET)
+    return payload
+
+
+@benchmark("auth.verify_webhook_signature")
+def bench_verify_webhook_signature():
+    from app.auth import verify_webhook_signature
+    payload = _webhook_payload()
+    return lambda: verify_webhook_signature(payload)
+
+
+@benchmark("auth.create_access_token")
+def bench_create_access_token():
+    from app.auth import create_access_token
+    return lambda: create_access_token(data={"sub": "2"})
+
+
+@benchmark("auth.jwt_decode")
+def bench_jwt_decode():
+    from jose import jwt
+    from app.auth import create_access_token
+    from app.config import config
+    token = create_access_token(data={"sub": "2"})
+    return lambda: jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
+
+
+@benchmark("auth.verify_password")
+def bench_verify_password():
+    from app.auth import get_password_hash, verify_password
+    hashed = get_password_hash("UserStrongPass456!")
+    return lambda: verify_password("UserStrongPass456!", hashed)
+
+
+# --- schemas --------------------------------------------------------------
+
+SCHEMA_PAYLOADS = {
+    "UserCreate": {"email": "newuser@example.com", "full_name": "New User", "password": "NewPass123!"},
+    "UserUpdate": {"full_name": "Renamed User", "is_active": True},
+    "AccountCreate": {"balance": 500.0},
+    "PaymentCreate": {"account_id": 1, "amount": 10.5, "recipient_email": "admin@example.com"},
+    "WebhookData": {
+        "transaction_id": "bench-tx-1",
+        "user_id": 2,
+        "account_id": 1,
+        "amount": 100.0,
+        "signature": "0" * 64
+    },
+    "LoginRequest": {"email": "user@example.com", "password": "UserStrongPass456!"},
+    # Параметры строки запроса приходят строками, как их передаёт app.search.parse_filters
+    "PaymentFilters": {
+        "from": "2024-01-01",
+        "to": "2024-02-01",
+        "status": "completed",
+        "amount_min": "10",
+        "limit": "50"
+    },
+    "StatsQuery": {"from": "2024-01-01", "to": "2024-02-01", "limit": "20", "convert_to": "EUR"},
+    "BulkUserCreate": {
+        "email": "bulkuser@example.com",
+        "full_name": "Bulk User",
+        "password": "BulkPass123!",
+        "opening_balance": 25.0
+    },
+    "FxRatesUpdate": {"rates": {"EUR": 1.08, "GBP": 1.27, "JPY": 0.0067}},
+}
+
+
+def _schema_factory(model_name: str):
+    def factory():
+        from app import schemas
+        model = getattr(schemas, model_name)
+        payload = SCHEMA_PAYLOADS[model_name]
+        return lambda: model(**payload)
+    return factory
+
+
+for _model_name in SCHEMA_PAYLOADS:
+    benchmark(f"schemas.{_model_name}")(_schema_factory(_model_name))
+
+
+# --- queries --------------------------------------------------------------
+# Накладные расходы на запрос: построение select() и вычисление ключа кэша компиляции
+# против готового выражения из app.queries (ключ мемоизирован)
+
+@benchmark("queries.user_by_id_inline_cache_key")
+def bench_query_inline_cache_key():
+    from sqlalchemy.future import select
+    from app.models import User
+    return lambda: select(User).where(User.id == 2)._generate_cache_key()
+
+
+@benchmark("queries.user_by_id_prebuilt_cache_key")
+def bench_query_prebuilt_cache_key():
+    from app import queries
+    return lambda: queries.USER_BY_ID._generate_cache_key()
+
+
+def _sqlite_session():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app.models import Base, User
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+    session.add(User(id=2, email="user@example.com", full_name="Regular User", hashed_password="x"))
+    session.commit()
+    return session
+
+
+@benchmark("queries.user_by_id_inline_execute")
+def bench_query_inline_execute():
+    from sqlalchemy.future import select
+    from app.models import User
+    session = _sqlite_session()
+    return lambda: session.execute(select(User).where(User.id == 2)).scalar_one_or_none()
+
+
+@benchmark("queries.user_by_id_prebuilt_execute")
+def bench_query_prebuilt_execute():
+    from app import queries
+    session = _sqlite_session()
+    return lambda: session.execute(queries.USER_BY_ID, {"user_id": 2}).scalar_one_or_none()
+
+
+# --- serialization --------------------------------------------------------
+
+SERIALIZATION_SIZES = (1, 100, 10_000)
+
+
+def _payment_rows(count: int):
+    from app.models import Payment
+    now = datetime.utcnow()
+    return [
+        Payment(
+            id=i,
+            account_id=1,
+            user_id=2,
+            amount=100.0 + i,
+            recipient_email="admin@example.com",
+            transaction_id=f"bench-tx-{i}",
+            status="completed",
+            direction="debit",
+            # Каждый десятый платёж — перевод из другой валюты, как в ответе с original_*
+            currency="EUR",
+            fx_rate=1.08,
+            original_amount=(100.0 + i) * 1.08 if i % 10 == 0 else None,
+            original_currency="USD" if i % 10 == 0 else None,
+            created_at=now
+        )
+        for i in range(count)
+    ]
+
+
+def _serialize_dicts_factory(count: int):
+    # Построение ответа GET /payments/: тот же сериализатор, что в маршрутах
+    def factory():
+        from app.settlement import payment_data
+        payments = _payment_rows(count)
+        return lambda: [payment_data(payment) for payment in payments]
+    return factory
+
+
+def _serialize_json_factory(count: int):
+    def factory():
+        from sanic import response
+        from app.settlement import payment_data
+        rows = [payment_data(payment) for payment in _payment_rows(count)]
+        return lambda: response.json(rows)
+    return factory
+
+
+for _size in SERIALIZATION_SIZES:
+    benchmark(f"serialize.payment_dicts[{_size}]")(_serialize_dicts_factory(_size))
+    benchmark(f"serialize.payment_json[{_size}]")(_serialize_json_factory(_size))
+
+
+# --- runner ---------------------------------------------------------------
+
+def _time_batch(func, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - started
+
+
+def calibrate(func, min_time: float) -> int:
+    """Подбирает число вызовов в выборке, как timeit.Timer.autorange"""
+    number = 1
+    while True:
+        elapsed = _time_batch(func, number)
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+
+def run_benchmark(func, repeat: int, min_time: float, warmup: float) -> dict:
+    deadline = time.perf_counter() + warmup
+    while time.perf_counter() < deadline:
+        func()
+
+    number = calibrate(func, min_time)
+    samples = [_time_batch(func, number) / number * 1e6 for _ in range(repeat)]
+    ordered = sorted(samples)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "mean_us": round(statistics.fmean(samples), 3),
+        "median_us": round(statistics.median(samples), 3),
+        "stdev_us": round(statistics.stdev(samples), 3) if repeat > 1 else 0.0,
+        "min_us": round(ordered[0], 3),
+        "max_us": round(ordered[-1], 3),
+        "ops_per_sec": round(1e6 / statistics.median(samples), 1),
+    }
+
+
+def format_table(results: dict, previous: dict = None) -> str:
+    lines = [f"{'benchmark':<40} {'median':>12} {'stdev':>10} {'ops/s':>12}" + ("  change" if previous else "")]
+    for name, stats in results.items():
+        line = f"{name:<40} {stats['median_us']:>10.2f}us {stats['stdev_us']:>8.2f}us {stats['ops_per_sec']:>12.1f}"
+        if previous and name in previous:
+            before = previous[name]["median_us"]
+            change = (stats["median_us"] - before) / before * 100 if before else math.nan
+            line += f"  {change:+.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {}
+    for name, factory in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        print(f"⏱️ {name}...", file=sys.stderr)
+        results[name] = run_benchmark(factory(), args.repeat, args.min_time, args.warmup)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+    print(format_table(results, previous))
+
+    if args.output:
+        document = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": datetime.utcnow().isoformat(),
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Проверка бюджета времени старта Finance API.
+
+Замеряет в отдельных процессах:
+  * import_main_ms — суммарное время `import main` по данным `python -X importtime`;
+  * first_request_ms — время от запуска процесса сервера до первого ответа 200 на `/`.
+
+Каждая метрика снимается --runs раз, в отчёт идёт медиана. Если медиана
+превышает бюджет из bench/startup_budget.json, процесс завершается с кодом 1.
+
+    python -m bench.startup
+    python -m bench.startup --top 15
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Finance API startup-time budget check")
+    parser.add_argument("--runs", type=int, default=5, help="measurements per metric, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="show the N slowest top-level imports")
+    parser.add_argument("--budget", default=BUDGET_PATH, help="JSON file with import_main_ms and first_request_ms")
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up waiting for the server, seconds")
+    return parser.parse_args(argv)
+
+
+def _env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'startup.db')}"
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def parse_importtime(stderr: str):
+    """Возвращает (время import main в мс, список (модуль, cumulative мс) для импортов первого уровня)"""
+    total = None
+    children = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if name == "main" and indent == 1:
+            total = cumulative_us / 1000
+        elif indent == 3:
+            children.append((name, cumulative_us / 1000))
+    return total, sorted(children, key=lambda item: item[1], reverse=True)
+
+
+def measure_import(workdir: str):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=_env(workdir),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return parse_importtime(completed.stderr)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(workdir: str, timeout: float) -> float:
+    port = _free_port()
+    script = (
+        "import main; "
+        f"main.app.run(host='127.0.0.1', port={port}, single_process=True, access_log=False)"
+    )
+    url = f"http://127.0.0.1:{port}/"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        env=_env(workdir),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                # Порт слушается ещё до конца before_server_start: соединение принято, ответа пока нет
+                time.sleep(0.01)
+        raise SystemExit(f"Server did not answer on {url} within {timeout}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # Sanic теряет SIGTERM, пришедший во время after_server_start (первый ответ бывает уже тогда)
+            process.kill()
+            process.wait()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    import_samples, first_request_samples = [], []
+    slowest = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="finance-startup-") as workdir:
+            total, children = measure_import(workdir)
+            import_samples.append(total)
+            if run == 0:
+                slowest = children[:args.top]
+        with tempfile.TemporaryDirectory(prefix="finance-startup-") as workdir:
+            first_request_samples.append(measure_first_request(workdir, args.timeout))
+
+    report = {
+        "import_main_ms": round(statistics.median(import_samples), 1),
+        "first_request_ms": round(statistics.median(first_request_samples), 1),
+        "slowest_imports_ms": {name: round(ms, 1) for name, ms in slowest}
+    }
+    print(json.dumps(report, indent=2))
+
+    if not os.path.exists(args.budget):
+        print("ℹ️ No budget file found, skipping check", file=sys.stderr)
+        return 0
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    exceeded = [
+        f"{key}: {report[key]} ms > budget {budget[key]} ms"
+        for key in ("import_main_ms", "first_request_ms")
+        if key in budget and report[key] > budget[key]
+    ]
+    if exceeded:
+        print("❌ Startup budget exceeded:", file=sys.stderr)
+        for line in exceeded:
+            print(f"   - {line}", file=sys.stderr)
+        return 1
+    print("✅ Startup within budget", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
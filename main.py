@@ -2,8 +2,6 @@ import asyncio
 import os
 import signal
 from sanic import Sanic, response
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
 from app.config import config
 from app.models import Base, User, Account, Payment
@@ -14,10 +12,19 @@ from app.routes.payments import payments_bp
 from app.routes.users import users_bp
 from app.routes.admin import admin_bp
 from app.routes.webhook import webhook_bp
+from app.routes.stats import stats_bp
+from app.routes.events import events_bp
+from app.database import engine, WriteSession, ReadSession
+from app.sharding import shard_for, create_shard_tables
+from app.warmup import warm_up
+from app.archive import compaction_loop
+from app import compression, fx, idempotency, ledger, notifications, provisioning, settlement, velocity
+from app.rollups import record_payment
 from datetime import datetime, UTC
 import uuid
 
 app = Sanic("FinanceAPI")
+app.ctx.ready = False
 
 app.blueprint(auth_bp)
 app.blueprint(accounts_bp)
@@ -25,23 +32,33 @@ app.blueprint(payments_bp)
 app.blueprint(users_bp)
 app.blueprint(admin_bp)
 app.blueprint(webhook_bp)
+app.blueprint(stats_bp)
+app.blueprint(events_bp)
 
-engine = create_async_engine(config.DATABASE_URL, echo=True)
-AsyncSessionLocal = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+if config.DIAGNOSTICS_ENABLED:
+    # Без флага модуль диагностики не импортируется и маршрутов /admin/diagnostics нет
+    from app.routes.diagnostics import diagnostics_bp
+    app.blueprint(diagnostics_bp)
 
 @app.get("/")
 async def health_check(request):
     return response.json({"status": "OK", "message": "Finance API is running"})
 
+@app.get("/ready")
+async def readiness_check(request):
+    # В отличие от "/", отвечает 200 только после прогрева: по нему балансировщик решает, слать ли трафик
+    if not app.ctx.ready:
+        return response.json({"status": "warming_up"}, status=503)
+    return response.json({"status": "ready"})
+
 @app.before_server_start
 async def setup_db(app, loop):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await create_shard_tables()
     print("✅ Database tables created successfully")
     
-    async with AsyncSessionLocal() as session:
+    async with WriteSession() as session:
         # Создание пользователей
         async with session.begin():
             admin_result = await session.execute(
@@ -87,44 +104,122 @@ async def setup_db(app, loop):
             user_id = user.id
             print(f"✅ Created users: admin_id={admin_id}, user_id={user_id}")
         
-        # Создание счетов
-        async with session.begin():
-            user_account = Account(
-                user_id=user_id,
-                balance=500.0,
-                created_at=datetime.now(UTC)
-            )
-            admin_account = Account(
-                user_id=admin_id,
-                balance=1000.0,
-                created_at=datetime.now(UTC)
-            )
-            session.add_all([user_account, admin_account])
-            await session.commit()
-            
-            account_id = user_account.id
-            admin_account_id = admin_account.id
-            print(f"✅ Created accounts: account_id={account_id}, admin_account_id={admin_account_id}")
+        # Создание счетов: каждый счет — в шарде своего пользователя
+        user_account = Account(
+            user_id=user_id,
+            balance=500.0,
+            opening_balance=600.0,  # Тестовый платёж ниже уже списан с баланса
+            created_at=datetime.now(UTC)
+        )
+        admin_account = Account(
+            user_id=admin_id,
+            balance=1000.0,
+            opening_balance=1000.0,
+            created_at=datetime.now(UTC)
+        )
+        for account in (user_account, admin_account):
+            async with shard_for(account.user_id).WriteSession() as shard_session:
+                async with shard_session.begin():
+                    shard_session.add(account)
+                    await ledger.open_account(shard_session, account)
+        
+        account_id = user_account.id
+        admin_account_id = admin_account.id
+        print(f"✅ Created accounts: account_id={account_id}, admin_account_id={admin_account_id}")
         
         # Создание платежа
-        async with session.begin():
+        async with shard_for(user_id).WriteSession() as shard_session, shard_session.begin():
             payment = Payment(
+                **fx.payment_fields(100.0, None, config.BASE_CURRENCY),
                 account_id=account_id,
                 user_id=user_id,
-                amount=100.0,
                 recipient_email=config.DEFAULT_ADMIN_EMAIL,
                 transaction_id=f"test-transaction-{uuid.uuid4()}",
                 status="completed",
+                direction="debit",
                 created_at=datetime.now(UTC)
             )
-            session.add(payment)
-            await session.commit()
+            shard_session.add(payment)
+            await record_payment(shard_session, payment)
+            await ledger.record_payment(shard_session, payment)
+            await shard_session.commit()
             
             print("✅ Default users, accounts, and payments created successfully")
 
+@app.before_server_start
+async def load_fx_rates(app, loop):
+    await fx.load()
+
+@app.before_server_start
+async def load_velocity_counters(app, loop):
+    # До первого платежа: иначе лимиты не видят платежи, сделанные до перезапуска
+    await velocity.load()
+
+@app.before_server_start
+async def warm_up_before_traffic(app, loop):
+    if config.WARMUP_ENABLED:
+        try:
+            await warm_up()
+        except Exception as e:
+            # Инстанс поднимается, но /ready остаётся 503 и балансировщик не пускает на него трафик
+            print(f"❌ Warm-up failed: {str(e)}")
+            return
+    app.ctx.ready = True
+
+@app.after_server_start
+async def start_archive_compaction(app, loop):
+    if config.ARCHIVE_COMPACTION_INTERVAL_S > 0:
+        app.add_task(compaction_loop(), name="archive_compaction")
+
+@app.after_server_start
+async def start_ledger_snapshots(app, loop):
+    if config.LEDGER_SNAPSHOT_INTERVAL_S > 0:
+        app.add_task(ledger.snapshot_loop(), name="ledger_snapshots")
+
+@app.after_server_start
+async def start_settlement(app, loop):
+    # Запускается и в режиме sync: доводит платежи, оставшиеся pending после переключения режима
+    app.add_task(settlement.settlement_loop(), name="settlement")
+
+@app.after_server_start
+async def start_velocity_sweep(app, loop):
+    app.add_task(velocity.sweep_loop(), name="velocity_sweep")
+
+@app.after_server_start
+async def start_idempotency_cleanup(app, loop):
+    app.add_task(idempotency.cleanup_loop(), name="idempotency_cleanup")
+
+@app.after_server_start
+async def start_notification_delivery(app, loop):
+    if config.NOTIFY_WEBHOOK_URLS:
+        app.add_task(notifications.delivery_loop(), name="notification_delivery")
+
+@app.before_server_stop
+async def mark_not_ready(app, loop):
+    app.ctx.ready = False
+
+@app.before_server_stop
+async def stop_background_tasks(app, loop):
+    # Отмена, пока цикл событий ещё работает: задача, прерванная посреди транзакции (проведение,
+    # доставка уведомлений), успевает сделать rollback. Sanic отменяет задачи уже после остановки
+    # цикла и ждёт их завершения до GRACEFUL_SHUTDOWN_TIMEOUT
+    for task in list(app.tasks):
+        await app.cancel_task(task.get_name(), raise_exception=False)
+
+@app.after_server_stop
+async def stop_hash_pool(app, loop):
+    provisioning.shutdown_hash_pool()
+
 @app.middleware("request")
 async def add_session(request):
-    request.ctx.session = AsyncSessionLocal()
+    # Неизвестный путь (маршрут не найден) получит 404, сессия ему не нужна
+    if request.route is None:
+        return
+    # Маршрут объявляет тип сессии через ctx_db="read"; по умолчанию — сессия записи
+    if getattr(request.route.ctx, "db", "write") == "read":
+        request.ctx.session = ReadSession()
+    else:
+        request.ctx.session = WriteSession()
 
 @app.middleware("response")
 async def close_session(request, response):
@@ -133,5 +228,10 @@ async def close_session(request, response):
             await request.ctx.session.commit()
         await request.ctx.session.close()
 
+@app.middleware("response")
+async def compress_body(request, response):
+    if config.COMPRESSION_ENABLED:
+        await compression.compress_response(request, response)
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True, single_process=True)
\ No newline at end of file
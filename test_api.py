@@ -4,6 +4,7 @@ import json
 import sys
 import time
 from hashlib import sha256
+import zlib
 
 class FinanceAPITester:
     def __init__(self, base_url: str = "http://localhost:8000"):
@@ -24,6 +25,19 @@ class FinanceAPITester:
             print(f"❌ Health check failed: {e}")
             return False
     
+    async def test_readiness(self):
+        """Тест готовности приложения (прогрев завершён)"""
+        print("\n🔥 Testing readiness...")
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.base_url}/ready") as response:
+                    data = await response.json()
+                    print(f"✅ Readiness: {data}")
+                    return response.status == 200 and data["status"] == "ready"
+        except Exception as e:
+            print(f"❌ Readiness check failed: {e}")
+            return False
+    
     async def admin_login(self):
         """Авторизация администратора"""
         print("\n🔐 Admin login...")
@@ -172,6 +186,644 @@ class FinanceAPITester:
             print(f"❌ All users error: {e}")
             return False
     
+    async def get_query_cache_stats(self):
+        """Статистика кэша скомпилированных запросов (админ)"""
+        print("\n🗃️ Getting query cache stats...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                async with session.get(
+                    f"{self.base_url}/admin/query-cache",
+                    headers=headers
+                ) as response:
+                    data = await response.json()
+                    print(f"✅ Query cache stats: {data}")
+                    return response.status == 200 and data["hits"] > 0
+        except Exception as e:
+            print(f"❌ Query cache stats error: {e}")
+            return False
+    
+    async def get_payments_in_range(self):
+        """Получение платежей пользователя за диапазон дат"""
+        print("\n📅 Getting payments in date range...")
+        if not self.user_token:
+            print("❌ User token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.user_token}"}
+                async with session.get(f"{self.base_url}/payments/", headers=headers) as response:
+                    all_payments = await response.json()
+                async with session.get(
+                    f"{self.base_url}/payments/?from=2000-01-01&to=2000-02-01",
+                    headers=headers
+                ) as response:
+                    old_payments = await response.json()
+                async with session.get(
+                    f"{self.base_url}/payments/?from=not-a-date",
+                    headers=headers
+                ) as response:
+                    invalid_status = response.status
+                print(f"✅ Payments: {len(all_payments)} total, {len(old_payments)} in January 2000")
+                return len(all_payments) > 0 and old_payments == [] and invalid_status == 400
+        except Exception as e:
+            print(f"❌ Payments in range error: {e}")
+            return False
+    
+    async def test_payment_filters(self):
+        """Фильтры поиска платежей и отказ от запросов без индекса"""
+        print("\n🔎 Testing payment filters...")
+        if not self.user_token or not self.admin_token:
+            print("❌ Tokens not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                user_headers = {"Authorization": f"Bearer {self.user_token}"}
+                admin_headers = {"Authorization": f"Bearer {self.admin_token}"}
+                async with session.get(
+                    f"{self.base_url}/payments/?status=completed&amount_min=1&limit=1",
+                    headers=user_headers
+                ) as response:
+                    filtered = await response.json()
+                async with session.get(
+                    f"{self.base_url}/payments/?unknown=1",
+                    headers=user_headers
+                ) as response:
+                    unknown_status = response.status
+                async with session.get(
+                    f"{self.base_url}/admin/payments?status=completed",
+                    headers=admin_headers
+                ) as response:
+                    full_scan_status = response.status
+                async with session.get(
+                    f"{self.base_url}/admin/payments?recipient_email=admin@example.com&status=completed",
+                    headers=admin_headers
+                ) as response:
+                    by_recipient = await response.json()
+                print(f"✅ Filtered: {len(filtered)} user payments, {len(by_recipient)} to admin@example.com")
+                return (
+                    len(filtered) == 1
+                    and all(payment["status"] == "completed" for payment in filtered + by_recipient)
+                    and len(by_recipient) > 0
+                    and unknown_status == 400
+                    and full_scan_status == 400
+                )
+        except Exception as e:
+            print(f"❌ Payment filters error: {e}")
+            return False
+    
+    async def get_payment_stats(self):
+        """Агрегаты платежей для админа"""
+        print("\n📈 Getting payment stats...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                results = {}
+                for kind in ("daily", "statuses", "users", "recipients", "flows"):
+                    async with session.get(f"{self.base_url}/admin/stats/{kind}", headers=headers) as response:
+                        if response.status != 200:
+                            print(f"❌ Stats {kind} failed: {await response.text()}")
+                            return False
+                        results[kind] = await response.json()
+                print(f"✅ Payment stats: {json.dumps(results['flows'])}")
+                # Тестовый платёж при старте — списание, платёж через вебхук — зачисление
+                return (
+                    results["flows"]["outflow"]["count"] > 0
+                    and results["flows"]["inflow"]["count"] > 0
+                    and len(results["daily"]) > 0
+                    and len(results["recipients"]) > 0
+                )
+        except Exception as e:
+            print(f"❌ Payment stats error: {e}")
+            return False
+    
+    async def reconcile_balances(self):
+        """Сверка балансов счетов с историей платежей (админ)"""
+        print("\n🧮 Reconciling balances...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                reports = {}
+                for mode in ("full", "incremental"):
+                    async with session.post(
+                        f"{self.base_url}/admin/reconcile?mode={mode}",
+                        headers=headers
+                    ) as response:
+                        if response.status != 200:
+                            print(f"❌ Reconciliation ({mode}) failed: {await response.text()}")
+                            return False
+                        reports[mode] = await response.json()
+                print(f"✅ Reconciliation: {json.dumps(reports['full'], indent=2)}")
+                # Повторный инкрементальный прогон не перечитывает уже учтённые платежи
+                return (
+                    reports["full"]["drift_count"] == 0
+                    and reports["incremental"]["drift_count"] == 0
+                    and sum(shard["payments_processed"] for shard in reports["incremental"]["shards"]) == 0
+                )
+        except Exception as e:
+            print(f"❌ Reconciliation error: {e}")
+            return False
+    
+    async def get_account_statement(self):
+        """Выписка по счёту пользователя: исходящий баланс совпадает с текущим"""
+        print("\n📒 Getting account statement...")
+        if not self.user_token:
+            print("❌ User token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.user_token}"}
+                async with session.get(f"{self.base_url}/users/me/accounts", headers=headers) as response:
+                    account = (await response.json())[0]
+                async with session.get(
+                    f"{self.base_url}/accounts/{account['id']}/statement",
+                    headers=headers
+                ) as response:
+                    if response.status != 200:
+                        print(f"❌ Statement failed: {await response.text()}")
+                        return False
+                    statement = await response.json()
+                    print(f"✅ Statement: {json.dumps(statement, indent=2)}")
+                # Выписка за период после последней проводки: пустая, входящий баланс равен текущему
+                async with session.get(
+                    f"{self.base_url}/accounts/{account['id']}/statement?from=2999-01-01",
+                    headers=headers
+                ) as response:
+                    empty = await response.json()
+                return (
+                    abs(statement["closing_balance"] - account["balance"]) < 0.005
+                    and statement["opening_balance"] == 0
+                    and not empty["entries"]
+                    and abs(empty["opening_balance"] - account["balance"]) < 0.005
+                )
+        except Exception as e:
+            print(f"❌ Statement error: {e}")
+            return False
+    
+    async def test_event_stream(self):
+        """Поток /events: событие о новом счёте приходит подписчику"""
+        print("\n📡 Testing event stream...")
+        if not self.user_token:
+            print("❌ User token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.base_url}/events") as response:
+                    if response.status != 401:
+                        print(f"❌ Event stream without token: {response.status}")
+                        return False
+                # EventSource не умеет заголовки — токен передаётся в строке запроса
+                async with session.get(f"{self.base_url}/events?token={self.user_token}") as stream:
+                    if stream.status != 200:
+                        print(f"❌ Event stream failed: {await stream.text()}")
+                        return False
+                    await stream.content.readuntil(b"\n\n")  # retry: ...
+                    async with session.post(
+                        f"{self.base_url}/accounts/",
+                        headers={"Authorization": f"Bearer {self.user_token}"},
+                        json={"balance": 0.0}
+                    ) as response:
+                        account = await response.json()
+                    frame = (await asyncio.wait_for(stream.content.readuntil(b"\n\n"), timeout=5)).decode()
+                    print(f"✅ Event: {frame.strip()}")
+                    event_type, data = frame.strip().split("\n")
+                    return event_type == "event: account.created" and json.loads(data[len("data: "):])["id"] == account["id"]
+        except Exception as e:
+            print(f"❌ Event stream error: {e}")
+            return False
+    
+    async def test_notification_delivery(self):
+        """Исходящие уведомления: доставка на локальный stub-сервер, повтор после отказа, подпись"""
+        from aiohttp import web
+        print("\n📬 Testing notification delivery...")
+        if not self.admin_token or not self.user_token:
+            print("❌ Tokens not available")
+            return False
+        stub_url = "http://localhost:8001/hooks"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{self.base_url}/admin/notifications",
+                    headers={"Authorization": f"Bearer {self.admin_token}"}
+                ) as response:
+                    if response.status != 200:
+                        print(f"❌ Notifications failed: {await response.text()}")
+                        return False
+                    if stub_url not in (await response.json())["endpoints"]:
+                        print(f"⚠️ Delivery not checked: start the server with NOTIFY_WEBHOOK_URLS={stub_url}")
+                        return True
+
+                # Stub-получатель: первый запрос отклоняется, дальше события сохраняются
+                received, calls = [], []
+                async def hooks(request):
+                    calls.append(request)
+                    if len(calls) == 1:
+                        return web.Response(status=503)
+                    received.extend((await request.json())["events"])
+                    return web.json_response({"status": "ok"})
+                stub = web.Application()
+                stub.router.add_post("/hooks", hooks)
+                runner = web.AppRunner(stub)
+                await runner.setup()
+                await web.TCPSite(runner, "localhost", 8001).start()
+                try:
+                    headers = {"Authorization": f"Bearer {self.user_token}"}
+                    async with session.get(f"{self.base_url}/users/me/accounts", headers=headers) as response:
+                        account = (await response.json())[0]
+                    async with session.post(
+                        f"{self.base_url}/payments/",
+                        headers=headers,
+                        json={"account_id": account["id"], "amount": 1.0, "recipient_email": "admin@example.com"}
+                    ) as response:
+                        payment = await response.json()
+                    for _ in range(60):
+                        event = next((event for event in received if event["payment_id"] == payment["id"]), None)
+                        if event:
+                            break
+                        await asyncio.sleep(0.5)
+                    else:
+                        print(f"❌ Notification not delivered, stub calls: {len(calls)}")
+                        return False
+                finally:
+                    await runner.cleanup()
+            print(f"✅ Notification: {json.dumps(event, indent=2)}")
+            secret_key = "7d8f9e0a1b2c3d4e5f6a7b8c9d0e1f2a"  # Из .env
+            concatenated = ''.join(str(event[key]) for key in sorted(event) if key != "signature") + secret_key
+            return event["signature"] == sha256(concatenated.encode()).hexdigest() and len(calls) > 1
+        except Exception as e:
+            print(f"❌ Notification delivery error: {e}")
+            return False
+    
+    async def test_idempotency_key(self):
+        """Повтор POST /accounts/ с тем же Idempotency-Key не создаёт второй счёт"""
+        print("\n🔁 Testing Idempotency-Key...")
+        if not self.user_token:
+            print("❌ User token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {
+                    "Authorization": f"Bearer {self.user_token}",
+                    "Idempotency-Key": f"test-account-{time.time()}"
+                }
+                # Два одновременных запроса и повтор после них
+                async def create():
+                    async with session.post(f"{self.base_url}/accounts/", headers=headers, json={"balance": 0.0}) as response:
+                        return response.status, await response.json(), response.headers.get("Idempotent-Replayed")
+                results = await asyncio.gather(create(), create())
+                results.append(await create())
+                print(f"✅ Responses: {results}")
+                async with session.post(f"{self.base_url}/accounts/", headers=headers, json={"balance": 5.0}) as response:
+                    conflict = response.status
+                return (
+                    all(status == 201 for status, _, _ in results)
+                    and len({body["id"] for _, body, _ in results}) == 1
+                    and sum(1 for _, _, replayed in results if replayed) == 2
+                    and conflict == 422
+                )
+        except Exception as e:
+            print(f"❌ Idempotency-Key error: {e}")
+            return False
+    
+    async def bulk_create_users(self):
+        """Массовое создание пользователей: JSON со счётом и повторами, затем CSV"""
+        print("\n👥 Bulk creating users...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                suffix = int(time.time() * 1000)
+                rows = [
+                    {"email": f"bulk1_{suffix}@example.com", "full_name": "Bulk One", "password": "bulkpass1", "opening_balance": 25.0},
+                    {"email": f"bulk2_{suffix}@example.com", "full_name": "Bulk Two", "password": "bulkpass2"},
+                    {"email": f"bulk1_{suffix}@example.com", "full_name": "Bulk Again", "password": "bulkpass1"},
+                    {"email": "user@example.com", "full_name": "Existing", "password": "bulkpass3"},
+                    {"email": "not-an-email", "full_name": "Broken", "password": "bulkpass4"},
+                ]
+                async with session.post(f"{self.base_url}/admin/users/bulk", headers=headers, json=rows) as response:
+                    data = await response.json()
+                    print(f"✅ Bulk JSON: {json.dumps(data, indent=2)}")
+                    statuses = [row["status"] for row in data["results"]]
+                    json_ok = (
+                        response.status == 200
+                        and statuses == ["created", "created", "duplicate", "exists", "invalid"]
+                        and "account_id" in data["results"][0]
+                        and data["accounts_created"] == 1
+                    )
+                csv_body = (
+                    "email,full_name,password,opening_balance\n"
+                    f"bulk3_{suffix}@example.com,Bulk Three,bulkpass3,\n"
+                    f"bulk4_{suffix}@example.com,Bulk Four,bulkpass4,10\n"
+                )
+                async with session.post(
+                    f"{self.base_url}/admin/users/bulk",
+                    headers={**headers, "Content-Type": "text/csv"},
+                    data=csv_body
+                ) as response:
+                    data = await response.json()
+                    print(f"✅ Bulk CSV: created={data.get('created')}, accounts={data.get('accounts_created')}")
+                    csv_ok = response.status == 200 and data["created"] == 2 and data["accounts_created"] == 1
+                # Созданный пользователь входит с паролем, захэшированным в пуле процессов
+                async with session.post(
+                    f"{self.base_url}/auth/login",
+                    json={"email": f"bulk2_{suffix}@example.com", "password": "bulkpass2"}
+                ) as response:
+                    login_ok = response.status == 200
+                return json_ok and csv_ok and login_ok
+        except Exception as e:
+            print(f"❌ Bulk create users error: {e}")
+            return False
+    
+    async def get_payment_status(self):
+        """Статус платежа по id: в режиме SETTLEMENT_MODE=async — опрос до проведения"""
+        print("\n📮 Getting payment status...")
+        if not self.user_token:
+            print("❌ User token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.user_token}"}
+                async with session.get(f"{self.base_url}/users/me/accounts", headers=headers) as response:
+                    account = (await response.json())[0]
+                async with session.post(
+                    f"{self.base_url}/payments/",
+                    headers=headers,
+                    json={"account_id": account["id"], "amount": 1.0, "recipient_email": "admin@example.com"}
+                ) as response:
+                    accepted = response.status
+                    payment = await response.json()
+                for _ in range(20):
+                    async with session.get(f"{self.base_url}/payments/{payment['id']}", headers=headers) as response:
+                        current = await response.json()
+                    if current["status"] != "pending":
+                        break
+                    await asyncio.sleep(0.5)
+                print(f"✅ Payment {payment['id']}: accepted {accepted} as {payment['status']}, now {current['status']}")
+                async with session.get(f"{self.base_url}/payments/999999999", headers=headers) as response:
+                    missing = response.status
+                return accepted in (201, 202) and current["status"] == "completed" and missing == 404
+        except Exception as e:
+            print(f"❌ Payment status error: {e}")
+            return False
+    
+    async def test_velocity_limits(self):
+        """Лимит числа списаний со счёта в минуту: 429 с Retry-After и использование в /admin/velocity"""
+        print("\n⏱️ Testing velocity limits...")
+        if not self.user_token or not self.admin_token:
+            print("❌ Tokens not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.user_token}"}
+                # Отдельный счёт, чтобы исчерпанный лимит не мешал другим тестам
+                async with session.post(f"{self.base_url}/accounts/", headers=headers, json={"balance": 100.0}) as response:
+                    account = await response.json()
+                    account_id = account["id"]
+                created, denied = 0, None
+                for _ in range(40):
+                    async with session.post(
+                        f"{self.base_url}/payments/",
+                        headers=headers,
+                        json={"account_id": account_id, "amount": 0.01, "recipient_email": "admin@example.com"}
+                    ) as response:
+                        # 202 — платёж принят в режиме SETTLEMENT_MODE=async
+                        if response.status in (201, 202):
+                            created += 1
+                            continue
+                        denied = (response.status, response.headers.get("Retry-After"), await response.json())
+                        break
+                print(f"✅ Payments before limit: {created}, denied: {denied}")
+                async with session.get(
+                    f"{self.base_url}/admin/velocity",
+                    headers={"Authorization": f"Bearer {self.admin_token}"},
+                    params={"user_id": account["user_id"], "account_id": account_id}
+                ) as response:
+                    data = await response.json()
+                    print(f"✅ Velocity: {json.dumps(data, indent=2)}")
+                    usage = {row["policy"]: row["used"] for row in data["account"]["usage"]}
+                async with session.get(
+                    f"{self.base_url}/admin/velocity",
+                    headers={"Authorization": f"Bearer {self.admin_token}"},
+                    params={"account_id": account_id}
+                ) as response:
+                    # Номер счёта без владельца неоднозначен
+                    ambiguous_status = response.status
+                return (
+                    denied is not None
+                    and denied[0] == 429
+                    and int(denied[1]) >= 1
+                    and usage.get("account:debit:minute:count=30") == created == 30
+                    and data["denied"] >= 1
+                    and ambiguous_status == 400
+                )
+        except Exception as e:
+            print(f"❌ Velocity limits error: {e}")
+            return False
+    
+    async def get_admission_stats(self):
+        """Статистика контроля допуска по группам маршрутов (админ)"""
+        print("\n🚦 Getting admission stats...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{self.base_url}/admin/admission",
+                    headers={"Authorization": f"Bearer {self.admin_token}"}
+                ) as response:
+                    data = await response.json()
+                    print(f"✅ Admission: {json.dumps(data, indent=2)}")
+                    return (
+                        response.status == 200
+                        and set(data["groups"]) == {"webhooks", "auth", "writes", "reads"}
+                        and data["groups"]["auth"]["admitted"] > 0
+                    )
+        except Exception as e:
+            print(f"❌ Admission stats error: {e}")
+            return False
+    
+    async def test_response_compression(self):
+        """Сжатие ответов: gzip по Accept-Encoding для ответов больше порога"""
+        import gzip
+        print("\n🗜️ Testing response compression...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            url = f"{self.base_url}/admin/payments?limit=1000"
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                async with session.get(url, headers={**headers, "Accept-Encoding": "identity"}) as response:
+                    plain = await response.read()
+                    plain_encoding = response.headers.get("Content-Encoding")
+                async with session.get(url, headers={**headers, "Accept-Encoding": "gzip, deflate"}) as response:
+                    body = await response.read()
+                    encoding = response.headers.get("Content-Encoding")
+                    vary = response.headers.get("Vary")
+            print(f"✅ Plain: {len(plain)} bytes, {encoding or 'identity'}: {len(body)} bytes")
+            if plain_encoding is not None or vary != "Accept-Encoding":
+                return False
+            if encoding is None:
+                return len(plain) < 1024  # Меньше COMPRESSION_MIN_SIZE по умолчанию
+            return encoding == "gzip" and json.loads(gzip.decompress(body)) == json.loads(plain)
+        except Exception as e:
+            print(f"❌ Response compression error: {e}")
+            return False
+    
+    async def test_memory_diagnostics(self):
+        """Диагностика памяти: tracemalloc, снимки и их разница, счётчики объектов (админ)"""
+        print("\n🩺 Testing memory diagnostics...")
+        if not self.admin_token or not self.user_token:
+            print("❌ Tokens not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                url = f"{self.base_url}/admin/diagnostics"
+                async with session.get(f"{url}/?limit=5", headers=headers) as response:
+                    if response.status == 404:
+                        print("⚠️ Diagnostics not checked: start the server with DIAGNOSTICS_ENABLED=true")
+                        return True
+                    overview = await response.json()
+                    if response.status != 200 or "User" not in overview["objects"]["orm"] or not overview["pools"]:
+                        print(f"❌ Diagnostics overview failed: {overview}")
+                        return False
+                async with session.get(f"{url}/", headers={"Authorization": f"Bearer {self.user_token}"}) as response:
+                    if response.status != 403:
+                        print(f"❌ Diagnostics allowed for a regular user: {response.status}")
+                        return False
+
+                async with session.post(f"{url}/tracemalloc/start", headers=headers) as response:
+                    if response.status != 200 or not (await response.json())["memory"]["tracemalloc"]:
+                        return False
+                try:
+                    async with session.post(f"{url}/snapshots", headers=headers) as response:
+                        base = await response.json()
+                    # Нагрузка между снимками
+                    for _ in range(5):
+                        async with session.get(f"{self.base_url}/admin/payments?limit=100", headers=headers) as response:
+                            await response.read()
+                    async with session.post(f"{url}/snapshots?base={base['id']}&group_by=filename&limit=5", headers=headers) as response:
+                        diff = await response.json()
+                        print(f"✅ Snapshot diff: {json.dumps(diff, indent=2)}")
+                        if response.status != 201 or diff["base"] != base["id"] or len(diff["top"]) > 5:
+                            return False
+                    async with session.get(f"{url}/snapshots/999999", headers=headers) as response:
+                        if response.status != 404:
+                            return False
+                finally:
+                    async with session.post(f"{url}/tracemalloc/stop", headers=headers) as response:
+                        stopped = (await response.json())["stopped"]
+                    async with session.delete(f"{url}/snapshots", headers=headers) as response:
+                        await response.read()
+                return stopped and base["total_size"] > 0
+        except Exception as e:
+            print(f"❌ Memory diagnostics error: {e}")
+            return False
+    
+    async def test_multi_currency(self):
+        """Счёт в EUR, перевод в USD по курсу, отчёт админа в GBP"""
+        print("\n💱 Testing multi-currency payments...")
+        if not self.admin_token or not self.user_token:
+            print("❌ Tokens not available")
+            return False
+        try:
+            admin_headers = {"Authorization": f"Bearer {self.admin_token}"}
+            user_headers = {"Authorization": f"Bearer {self.user_token}"}
+            async with aiohttp.ClientSession() as session:
+                async with session.put(
+                    f"{self.base_url}/admin/fx-rates", json={"rates": {"EUR": 1.1, "GBP": 1.25}}, headers=admin_headers
+                ) as response:
+                    rates = await response.json()
+                    print(f"✅ FX rates: {rates}")
+                    if response.status != 200 or rates["rates"]["USD"] != 1.0 or rates["version"] < 1:
+                        return False
+                async with session.put(
+                    f"{self.base_url}/admin/fx-rates", json={"rates": {"eur": -1}}, headers=admin_headers
+                ) as response:
+                    if response.status != 400:
+                        return False
+                async with session.post(
+                    f"{self.base_url}/accounts/", json={"balance": 100.0, "currency": "EUR"}, headers=user_headers
+                ) as response:
+                    account = await response.json()
+                    if response.status != 201 or account["currency"] != "EUR":
+                        print(f"❌ EUR account failed: {account}")
+                        return False
+                # Курс EUR нельзя убрать, пока есть счёт в EUR
+                async with session.put(
+                    f"{self.base_url}/admin/fx-rates", json={"rates": {"GBP": 1.25}}, headers=admin_headers
+                ) as response:
+                    if response.status != 400:
+                        print(f"❌ Rates without EUR accepted: {response.status}")
+                        return False
+                payload = {"account_id": account["id"], "amount": 11.0, "currency": "USD", "recipient_email": "admin@example.com"}
+                async with session.post(f"{self.base_url}/payments/", json=payload, headers=user_headers) as response:
+                    payment = await response.json()
+                    print(f"✅ Cross-currency payment: {payment}")
+                    # 11 USD = 10 EUR при курсе EUR 1.1
+                    if response.status not in (201, 202) or payment["amount"] != 10.0 or payment["currency"] != "EUR":
+                        return False
+                    if payment["original_amount"] != 11.0 or payment["original_currency"] != "USD":
+                        return False
+                async with session.post(
+                    f"{self.base_url}/payments/", json={**payload, "currency": "XYZ"}, headers=user_headers
+                ) as response:
+                    if response.status != 400:
+                        print(f"❌ Unknown currency accepted: {response.status}")
+                        return False
+                async with session.get(
+                    f"{self.base_url}/admin/payments?limit=1000&convert_to=GBP", headers=admin_headers
+                ) as response:
+                    payments = await response.json()
+                    converted = next(item for item in payments if item["id"] == payment["id"] and item["currency"] == "EUR")
+                    print(f"✅ In GBP: {converted['converted_amount']}")
+                    # 10 EUR * 1.1 / 1.25
+                    if response.status != 200 or converted["converted_amount"] != 8.8:
+                        return False
+                async with session.get(f"{self.base_url}/admin/stats/flows?convert_to=EUR", headers=admin_headers) as response:
+                    return response.status == 200
+        except Exception as e:
+            print(f"❌ Multi-currency error: {e}")
+            return False
+    
+    async def get_all_payments(self):
+        """Получение последних платежей со всех шардов (админ)"""
+        print("\n🧾 Getting all payments...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                async with session.get(
+                    f"{self.base_url}/admin/payments?limit=10",
+                    headers=headers
+                ) as response:
+                    data = await response.json()
+                    if response.status == 200:
+                        print(f"✅ All payments: {len(data)} payments found")
+                        dates = [payment["created_at"] for payment in data]
+                        return len(data) > 0 and dates == sorted(dates, reverse=True)
+                    else:
+                        print(f"❌ All payments failed: {data}")
+                        return False
+        except Exception as e:
+            print(f"❌ All payments error: {e}")
+            return False
+    
     async def create_user(self):
         """Создание нового пользователя администратором"""
         print("\n👤 Creating new user...")
@@ -302,6 +954,17 @@ class FinanceAPITester:
             print(f"📤 Webhook payload: {json.dumps(payload, indent=2)}")
             
             async with aiohttp.ClientSession() as session:
+                # Валюта не строкой — 400 при разборе тела, а не 500
+                invalid = {**transaction_data, "transaction_id": f"{transaction_data['transaction_id']}-bad", "currency": 5}
+                concatenated = ''.join(str(invalid[key]) for key in sorted(invalid)) + secret_key
+                async with session.post(
+                    f"{self.base_url}/webhook/payment",
+                    json={**invalid, "signature": sha256(concatenated.encode()).hexdigest()},
+                    headers={"Content-Type": "application/json"}
+                ) as response:
+                    if response.status != 400:
+                        print(f"❌ Invalid currency accepted: Status {response.status}, {await response.text()}")
+                        return False
                 async with session.post(
                     f"{self.base_url}/webhook/payment",
                     json=payload,
@@ -322,6 +985,102 @@ class FinanceAPITester:
             traceback.print_exc()
             return False
     
+    async def test_webhook_hmac(self):
+        """Вебхук с HMAC-SHA256 сырого тела в заголовке X-Signature-256 (WEBHOOK_SIGNATURE_MODE=both)"""
+        import hmac
+        print("\n🔏 Testing webhook HMAC signature...")
+        try:
+            user_id = await self.get_user_id()
+            account_id = await self.get_user_account_id()
+            if not user_id or not account_id:
+                print("❌ Cannot get user or account ID")
+                return False
+            secret_key = "7d8f9e0a1b2c3d4e5f6a7b8c9d0e1f2a"  # Из .env
+            body = json.dumps({
+                "transaction_id": f"test-hmac-tx-{time.time_ns()}",
+                "user_id": user_id,
+                "account_id": account_id,
+                "amount": 5.0
+            }).encode()
+            signature = hmac.new(secret_key.encode(), body, sha256).hexdigest()
+            url = f"{self.base_url}/webhook/payment"
+            async with aiohttp.ClientSession() as session:
+                # Подделка отклоняется ещё до разбора тела: тело даже не JSON
+                async with session.post(
+                    url, data=b"not json", headers={"Content-Type": "application/json", "X-Signature-256": f"sha256={signature}"}
+                ) as response:
+                    forged_status = response.status
+                    forged_error = await response.text()
+                async with session.post(
+                    url, data=body, headers={"Content-Type": "application/json", "X-Signature-256": f"sha256={signature}"}
+                ) as response:
+                    status = response.status
+                    print(f"✅ HMAC webhook: {status}, {await response.text()}")
+                # Тот же подписанный запрос с изменённым телом
+                async with session.post(
+                    url, data=body.replace(b"5.0", b"500.0"), headers={"Content-Type": "application/json", "X-Signature-256": signature}
+                ) as response:
+                    tampered_status = response.status
+            print(f"✅ Forged: {forged_status}, tampered: {tampered_status}")
+            return (
+                status == 200
+                and forged_status == 400 and "Invalid signature" in forged_error
+                and tampered_status == 400
+            )
+        except Exception as e:
+            print(f"❌ Webhook HMAC error: {e}")
+            return False
+    
+    async def test_webhook_duplicate_across_shards(self):
+        """Один transaction_id для пользователей из разных шардов зачисляется один раз (SHARD_COUNT=2)"""
+        print("\n🔁 Testing duplicate webhook across shards...")
+        if not self.admin_token:
+            print("❌ Admin token not available")
+            return False
+        try:
+            user_id = await self.get_user_id()
+            account_id = await self.get_user_account_id()
+            if not user_id or not account_id:
+                print("❌ Cannot get user or account ID")
+                return False
+            secret_key = "7d8f9e0a1b2c3d4e5f6a7b8c9d0e1f2a"  # Из .env
+            suffix = time.time_ns()
+            async with aiohttp.ClientSession() as session:
+                # Пользователи со счетами, один из них — в другом шарде, чем основной (crc32(user_id) % 2)
+                rows = [
+                    {"email": f"shard{i}_{suffix}@example.com", "full_name": "Shard User", "password": "shardpass", "opening_balance": 0}
+                    for i in range(8)
+                ]
+                async with session.post(
+                    f"{self.base_url}/admin/users/bulk", headers={"Authorization": f"Bearer {self.admin_token}"}, json=rows
+                ) as response:
+                    created = [row for row in (await response.json())["results"] if row["status"] == "created"]
+                home = zlib.crc32(str(user_id).encode()) % 2
+                other = next((row for row in created if zlib.crc32(str(row["id"]).encode()) % 2 != home), None)
+                if not other:
+                    print("❌ No user in the other shard")
+                    return False
+                
+                statuses = []
+                for target_user, target_account in [(user_id, account_id), (other["id"], other["account_id"])]:
+                    data = {
+                        "transaction_id": f"test-shard-tx-{suffix}",
+                        "user_id": target_user,
+                        "account_id": target_account,
+                        "amount": 7.0
+                    }
+                    concatenated = ''.join(str(data[key]) for key in sorted(data)) + secret_key
+                    async with session.post(
+                        f"{self.base_url}/webhook/payment",
+                        json={**data, "signature": sha256(concatenated.encode()).hexdigest()}
+                    ) as response:
+                        statuses.append(response.status)
+                        print(f"✅ Webhook for user {target_user}: {response.status}, {await response.text()}")
+            return statuses == [200, 400]
+        except Exception as e:
+            print(f"❌ Duplicate webhook error: {e}")
+            return False
+    
     async def run_tests(self):
         """Запуск всех тестов"""
         print("🚀 Starting Finance API Tests")
@@ -330,14 +1089,34 @@ class FinanceAPITester:
         # Список всех тестов
         tests = [
             ("Health Check", self.test_health_check),
+            ("Readiness", self.test_readiness),
             ("Admin Login", self.admin_login),
             ("User Login", self.user_login),
             ("Admin Info", self.get_admin_info),
             ("User Info", self.get_user_info),
             ("User Accounts", self.get_user_accounts),
             ("All Users", self.get_all_users),
+            ("Query Cache Stats", self.get_query_cache_stats),
             ("Create User", self.create_user),
+            ("Bulk Create Users", self.bulk_create_users),
             ("Webhook Payment", self.test_webhook_payment),
+            ("Webhook HMAC Signature", self.test_webhook_hmac),
+            ("Webhook Duplicate Across Shards", self.test_webhook_duplicate_across_shards),
+            ("Payments In Range", self.get_payments_in_range),
+            ("All Payments", self.get_all_payments),
+            ("Payment Status", self.get_payment_status),
+            ("Multi Currency", self.test_multi_currency),
+            ("Payment Filters", self.test_payment_filters),
+            ("Payment Stats", self.get_payment_stats),
+            ("Reconcile Balances", self.reconcile_balances),
+            ("Account Statement", self.get_account_statement),
+            ("Event Stream", self.test_event_stream),
+            ("Notification Delivery", self.test_notification_delivery),
+            ("Idempotency Key", self.test_idempotency_key),
+            ("Velocity Limits", self.test_velocity_limits),
+            ("Admission Stats", self.get_admission_stats),
+            ("Response Compression", self.test_response_compression),
+            ("Memory Diagnostics", self.test_memory_diagnostics),
         ]
         
         results = []